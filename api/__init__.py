@@ -1 +1,2 @@
-from .api import InstagramAPI
\ No newline at end of file
+from .api import InstagramAPI
+from .registry import InstagramClientRegistry
\ No newline at end of file
@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+from .rate_limiter import AdaptiveTokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Загальний бюджет запитів до AI: одночасні запити, черга очікування та швидкість (запитів/с)
+AI_MAX_CONCURRENT = int(os.environ.get("AI_MAX_CONCURRENT", os.environ.get("DEEPSEEK_MAX_IN_FLIGHT", "10")))
+AI_MAX_QUEUE = int(os.environ.get("AI_MAX_QUEUE", "50"))  # Більше запитів у черзі - одразу відмова
+AI_QUEUE_TIMEOUT = float(os.environ.get("AI_QUEUE_TIMEOUT", "20"))  # секунди в черзі до відмови
+AI_RATE = float(os.environ.get("AI_RATE", "2"))
+AI_MIN_RATE = float(os.environ.get("AI_MIN_RATE", "0.1"))
+AI_BURST = float(os.environ.get("AI_BURST", "5"))
+AI_RATE_RECOVERY = float(os.environ.get("AI_RATE_RECOVERY", "0.05"))
+# Запобіжник: відкривається, якщо серед останніх AI_BREAKER_WINDOW запитів частка помилок
+# (або повільніших за AI_BREAKER_SLOW_CALL; для потоку - до першої частини відповіді)
+# не менша за AI_BREAKER_FAILURE_RATE
+AI_BREAKER_WINDOW = int(os.environ.get("AI_BREAKER_WINDOW", "20"))
+AI_BREAKER_MIN_CALLS = int(os.environ.get("AI_BREAKER_MIN_CALLS", "10"))
+AI_BREAKER_FAILURE_RATE = float(os.environ.get("AI_BREAKER_FAILURE_RATE", "0.5"))
+AI_BREAKER_SLOW_CALL = float(os.environ.get("AI_BREAKER_SLOW_CALL", "30"))  # секунди
+AI_BREAKER_OPEN_SECONDS = float(os.environ.get("AI_BREAKER_OPEN_SECONDS", "30"))
+
+
+class AIRejected(Exception):
+    """Запит до AI не допущено."""
+
+
+class AISuperseded(AIRejected):
+    """Користувач надіслав новіше повідомлення, поки цей запит чекав у черзі."""
+
+
+class AIOverloaded(AIRejected):
+    """Черга запитів переповнена або очікування перевищило AI_QUEUE_TIMEOUT."""
+
+
+class CircuitBreaker:
+    """Запобіжник моделі: closed -> open (швидка відмова) -> half_open (один пробний запит)."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name, window=AI_BREAKER_WINDOW, min_calls=AI_BREAKER_MIN_CALLS,
+                 failure_rate=AI_BREAKER_FAILURE_RATE, slow_call=AI_BREAKER_SLOW_CALL,
+                 open_seconds=AI_BREAKER_OPEN_SECONDS):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call = slow_call
+        self.open_seconds = open_seconds
+        self.state = self.CLOSED
+        self.opens = 0
+        self._outcomes = deque(maxlen=window)  # True - успішний і досить швидкий запит
+        self._opened_at = 0.0
+        self._probe_at = None
+
+    def allow(self):
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now - self._opened_at < self.open_seconds:
+                return False
+            self.state = self.HALF_OPEN
+            self._probe_at = None
+        # Один пробний запит; якщо він не завершився (скасовано) - наступний через open_seconds
+        if self._probe_at is not None and now - self._probe_at < self.open_seconds:
+            return False
+        self._probe_at = now
+        return True
+
+    def record(self, ok):
+        if self.state == self.HALF_OPEN:
+            if ok:
+                self.state = self.CLOSED
+                self._outcomes.clear()
+                logger.info(f"Запобіжник AI ({self.name}) закрито")
+            else:
+                self._open()
+            return
+        if self.state == self.OPEN:
+            return  # Запити, початі до відкриття
+        self._outcomes.append(ok)
+        failures = self._outcomes.count(False)
+        if len(self._outcomes) >= self.min_calls and failures / len(self._outcomes) >= self.failure_rate:
+            self._open()
+
+    def _open(self):
+        self.state = self.OPEN
+        self.opens += 1
+        self._opened_at = time.monotonic()
+        self._probe_at = None
+        self._outcomes.clear()
+        logger.warning(f"Запобіжник AI ({self.name}) відкрито на {self.open_seconds:.0f} с")
+
+
+class CallTimer:
+    """Тривалість запиту для запобіжника: до першої частини відповіді (потік) або до кінця запиту."""
+
+    __slots__ = ("started", "first_response_at")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.first_response_at = None
+
+    def first_response(self):
+        """Позначає першу частину потокової відповіді; подальша генерація в тривалість не входить."""
+        if self.first_response_at is None:
+            self.first_response_at = time.monotonic()
+
+    def elapsed(self):
+        return (self.first_response_at or time.monotonic()) - self.started
+
+
+class _UserSlot:
+    __slots__ = ("busy", "waiter")
+
+    def __init__(self):
+        self.busy = False
+        self.waiter = None  # Future запиту, що чекає; True - черга перейшла до нього, False - замінено
+
+
+class AIAdmission:
+    """Допуск запитів до AI: бюджет на процес, один запит на користувача, запобіжники моделей.
+
+    Поки запит користувача виконується, новіше повідомлення чекає, а ще новіше
+    замінює те, що чекає (AISuperseded). Коли черга переповнена - AIOverloaded
+    замість накопичення запитів.
+    """
+
+    def __init__(self, max_concurrent=AI_MAX_CONCURRENT, max_queue=AI_MAX_QUEUE, queue_timeout=AI_QUEUE_TIMEOUT):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.bucket = AdaptiveTokenBucket(rate=AI_RATE, burst=AI_BURST, min_rate=AI_MIN_RATE,
+                                          max_rate=AI_RATE, recovery=AI_RATE_RECOVERY)
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._users = {}  # user_id -> _UserSlot
+        self._breakers = {}  # модель -> CircuitBreaker
+        self.in_flight = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.shed = 0
+        self.superseded = 0
+        self.fallbacks = 0
+
+    def breaker(self, model):
+        breaker = self._breakers.get(model)
+        if breaker is None:
+            breaker = self._breakers[model] = CircuitBreaker(model)
+        return breaker
+
+    def models(self, primary, fallback=None):
+        """Моделі, яким зараз можна надіслати запит: основна, потім запасна (перевіряється ліниво)."""
+        if self.breaker(primary).allow():
+            yield primary
+        if fallback and fallback != primary and self.breaker(fallback).allow():
+            self.fallbacks += 1
+            yield fallback
+
+    async def _enter_user(self, user_id):
+        slot = self._users.get(user_id)
+        if slot is None:
+            slot = self._users[user_id] = _UserSlot()
+        if not slot.busy:
+            slot.busy = True
+            return
+        if slot.waiter is not None and not slot.waiter.done():
+            slot.waiter.set_result(False)  # Старіше повідомлення, що чекало, більше не потрібне
+            self.superseded += 1
+        waiter = slot.waiter = asyncio.get_running_loop().create_future()
+        try:
+            granted = await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self._leave_user(user_id)  # Черга вже перейшла до нас - передаємо далі
+            raise
+        if not granted:
+            raise AISuperseded()
+
+    def _leave_user(self, user_id):
+        slot = self._users[user_id]
+        waiter, slot.waiter = slot.waiter, None
+        if waiter is not None and not waiter.done():
+            waiter.set_result(True)  # busy лишається: запит переходить до того, хто чекав
+        else:
+            del self._users[user_id]
+
+    async def _acquire(self):
+        await self._slots.acquire()
+        try:
+            await self.bucket.acquire()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    @asynccontextmanager
+    async def admit(self, user_id=None):
+        """Допуск одного запиту (разом із запасною моделлю) від користувача user_id."""
+        if user_id is not None:
+            await self._enter_user(user_id)
+        try:
+            if self.waiting >= self.max_queue:
+                self.shed += 1
+                raise AIOverloaded()
+            self.waiting += 1
+            try:
+                await asyncio.wait_for(self._acquire(), self.queue_timeout)
+            except asyncio.TimeoutError:
+                self.shed += 1
+                raise AIOverloaded() from None
+            finally:
+                self.waiting -= 1
+            self.admitted += 1
+            self.in_flight += 1
+            try:
+                yield
+            finally:
+                self.in_flight -= 1
+                self._slots.release()
+        finally:
+            if user_id is not None:
+                self._leave_user(user_id)
+
+    @asynccontextmanager
+    async def call(self, model):
+        """Запит до моделі: результат і тривалість ідуть у запобіжник, 429 - зменшує швидкість.
+
+        Повертає CallTimer: потоковий запит викликає first_response() на першій частині,
+        щоб повільна генерація довгої відповіді не вважалась збоєм моделі.
+        """
+        breaker = self.breaker(model)
+        timer = CallTimer()
+        try:
+            yield timer
+        except Exception as e:
+            if isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 429:
+                self.bucket.on_throttle()
+            breaker.record(False)
+            raise
+        self.bucket.on_success()
+        breaker.record(timer.elapsed() <= breaker.slow_call)
+
+    def stats(self):
+        stats = {
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "superseded": self.superseded,
+            "fallbacks": self.fallbacks,
+            "rate": self.bucket.rate,
+            "throttles": self.bucket.throttles,
+        }
+        for model, breaker in self._breakers.items():
+            label = re.sub(r"\W", "_", model)  # deepseek-chat -> breaker_deepseek_chat_open
+            stats[f"breaker_{label}_open"] = int(breaker.state != CircuitBreaker.CLOSED)
+            stats[f"breaker_{label}_opens"] = breaker.opens
+        return stats
+
+
+# Один на процес (у шардованому режимі бюджет ділиться між процесами: AI_RATE на кожен)
+ai_admission = AIAdmission()
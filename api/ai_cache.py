@@ -0,0 +1,136 @@
+import datetime
+import hashlib
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete
+
+from database import session_scope
+from database.models import AIResponseCache
+
+logger = logging.getLogger(__name__)
+
+AI_CACHE_MAX_ENTRIES = int(os.environ.get("AI_CACHE_MAX_ENTRIES", "1000"))
+AI_CACHE_TTL = int(os.environ.get("AI_CACHE_TTL", str(24 * 60 * 60)))  # секунди
+AI_CACHE_PERSIST = os.environ.get("AI_CACHE_PERSIST", "0") == "1"
+# Як часто видаляти з БД прострочені відповіді, які більше ніхто не запитував
+AI_CACHE_PRUNE_INTERVAL = int(os.environ.get("AI_CACHE_PRUNE_INTERVAL", "3600"))  # секунди
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_prompt(prompt):
+    """Нормалізація запиту: регістр, пробіли та кінцеві розділові знаки не впливають на ключ."""
+    return _WHITESPACE.sub(" ", prompt.casefold()).strip().rstrip("?!.… ")
+
+
+def make_cache_key(prompt, system_prompt, model, temperature):
+    raw = "\x1f".join([normalize_prompt(prompt), system_prompt, model, repr(float(temperature))])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LRU-кеш відповідей AI з TTL та опціональним збереженням у БД."""
+
+    def __init__(self, max_entries=AI_CACHE_MAX_ENTRIES, ttl=AI_CACHE_TTL, persist=AI_CACHE_PERSIST,
+                 session_factory=None, prune_interval=AI_CACHE_PRUNE_INTERVAL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.persist = persist
+        self.session_factory = session_factory
+        self.prune_interval = prune_interval
+        self._entries = OrderedDict()  # key -> (expires_at, response)
+        self._next_prune = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.pruned = 0
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, response = entry
+            if expires_at > time.time():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return response
+            del self._entries[key]
+
+        if self.persist:
+            stored = await self._load(key)
+            if stored is not None:
+                expires_at, response = stored
+                self._remember(key, expires_at, response)
+                self.hits += 1
+                return response
+
+        self.misses += 1
+        return None
+
+    async def set(self, key, response):
+        expires_at = time.time() + self.ttl
+        self._remember(key, expires_at, response)
+        if self.persist:
+            await self._store(key, expires_at, response)
+
+    def _remember(self, key, expires_at, response):
+        self._entries[key] = (expires_at, response)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "pruned": self.pruned,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    # --- Збереження в БД ---
+
+    async def _load(self, key):
+        try:
+            async with session_scope(self.session_factory) as session:
+                row = await session.get(AIResponseCache, key)
+                if row is None:
+                    return None
+                if row.expires_at <= datetime.datetime.utcnow():
+                    await session.delete(row)
+                    return None
+                return row.expires_at.replace(tzinfo=datetime.timezone.utc).timestamp(), row.response
+        except Exception as e:
+            logger.error(f"Помилка читання кешу AI з БД: {e}")
+            return None
+
+    async def _store(self, key, expires_at, response):
+        try:
+            async with session_scope(self.session_factory) as session:
+                await session.merge(AIResponseCache(
+                    key=key,
+                    response=response,
+                    expires_at=datetime.datetime.utcfromtimestamp(expires_at),
+                ))
+                if time.monotonic() >= self._next_prune:
+                    await self._prune(session)
+        except Exception as e:
+            logger.error(f"Помилка збереження кешу AI в БД: {e}")
+
+    async def _prune(self, session):
+        """Видаляє прострочені записи (раз на prune_interval, разом із записом нової відповіді)."""
+        self._next_prune = time.monotonic() + self.prune_interval
+        result = await session.execute(
+            delete(AIResponseCache).where(AIResponseCache.expires_at <= datetime.datetime.utcnow()))
+        if result.rowcount:
+            self.pruned += result.rowcount
+            logger.info(f"Видалено прострочених відповідей AI з БД: {result.rowcount}")
+
+
+response_cache = ResponseCache()
@@ -1,33 +1,46 @@
-from instagrapi import Client
+import datetime
 import logging
-import asyncio
 import os
-from instagrapi.exceptions import (
-    LoginRequired,
-    PleaseWaitFewMinutes,
-    PrivateAccount,
-    UserNotFound,
-    ClientConnectionError,
-    ClientForbiddenError,
-    ClientThrottledError,
-    TwoFactorRequired,
-    ChallengeRequired
-)
+
+from sqlalchemy import update
 from telegram import Update
 from telegram.ext import CallbackContext
 
+from .executor import instagrapi_executor
+from .media_sync import media_store
+from .session_store import SessionStore, decode_settings
+from .stats_cache import stats_cache
+from database import session_scope
+from database.crud import get_user
 from database.models import User #Використовується
 
 logging.basicConfig(level=logging.INFO)
 
+
+def new_client():
+    """Новий instagrapi Client. Сам instagrapi (pydantic-моделі, HTTP-стек) імпортується лише тут."""
+    from instagrapi import Client
+
+    return Client()
+
+
 class InstagramAPI:
-    def __init__(self, db_session):
-        self.client = Client()
-        self.db_session = db_session #Зберiгаємо сесiю
+    def __init__(self, session_factory, session_store=None):
+        self.client = new_client()
+        self.session_factory = session_factory #Фабрика асинхронних сесій БД
+        self.session_store = session_store or SessionStore(session_factory)
+        self.user_pk = None  # User.id (кешується, записи в БД - за первинним ключем)
+        self.session_digest = None  # Хеш останньої збереженої сесії (незмінена не перезаписується)
         self.is_logged_in = False
         self.username = None
         self._last_login_result = None
         self.user_id = None  # Зберігаємо user_id
+        self.instagram_user_id = None  # Числовий ID акаунта Instagram (кешується в БД)
+        self.awaiting_2fa = False  # Вхід очікує код 2FA (стан лише в пам'яті клієнта)
+
+    async def _call(self, func, *args, **kwargs):
+        """Синхронний виклик instagrapi через спільний пул (по черзі для цього акаунта)."""
+        return await instagrapi_executor.run(self.client, func, *args, account=self.user_id, **kwargs)
 
     async def is_logged_in_check(self): #Метод для перевірки
         return self.is_logged_in
@@ -37,59 +50,82 @@ class InstagramAPI:
         if not self.user_id:
             logging.warning("User ID not set, cannot load session.")
             return False
-        user = self.db_session.query(User).filter(User.telegram_id == self.user_id).first()
-        if user and user.session_data:
-            try:
-                self.client.load_settings_from_json(user.session_data)  #Використовуєм json
-                self.is_logged_in = True
-                self.username = user.username
-                logging.info(f"Сесія для {self.username} завантажена з БД.")
-                return True
-            except Exception as e:
-                logging.error(f"Помилка завантаження сесії: {e}")
-                return False
+        async with session_scope(self.session_factory) as session:
+            user = await get_user(session, self.user_id)
+        if user:
+            self.user_pk = user.id
+            return self.apply_session(user)
         return False
 
-    async def save_session(self):
-        """Збереження сесії в БД."""
+    def apply_session(self, user):
+        """Відновлення сесії з уже прочитаного запису User (без звернення до БД)."""
+        try:
+            settings, digest = decode_settings(user)
+            if settings is None:
+                return False
+            self.client.set_settings(settings)
+            self.user_pk = user.id
+            self.session_digest = digest
+            self.is_logged_in = True
+            self.username = user.username
+            self.instagram_user_id = user.instagram_user_id  # None для старих записів, заповниться ліниво
+            logging.info(f"Сесія для {self.username} завантажена з БД.")
+            return True
+        except Exception as e:
+            logging.error(f"Помилка завантаження сесії: {e}")
+            return False
+
+    async def _get_user_pk(self):
+        """User.id: шукається за telegram_id лише раз, далі - з пам'яті."""
+        if self.user_pk is None:
+            async with session_scope(self.session_factory) as session:
+                user = await get_user(session, self.user_id)
+                self.user_pk = user.id if user else None
+        return self.user_pk
+
+    async def save_session(self, last_active_at=None):
+        """Збереження сесії в БД, якщо вона змінилась (або потрібно записати час останньої активності)."""
         if not self.is_logged_in:
             return False
 
-        user = self.db_session.query(User).filter(User.telegram_id == self.user_id).first()
-        if user:
-            try:
-                user.session_data = self.client.dump_settings_json()
-                self.db_session.commit()
-                logging.info(f"Сесія для {self.username} збережена в БД.")
-                return True
-            except Exception as e:
-                logging.error(f"Помилка збереження сесії: {e}")
+        try:
+            if await self._get_user_pk() is None:
                 return False
-        return False
+            return await self.session_store.save(self, last_active_at)
+        except Exception as e:
+            logging.error(f"Помилка збереження сесії: {e}")
+            return False
 
     async def login(self, username, password):
+        from instagrapi.exceptions import (
+            LoginRequired,
+            PleaseWaitFewMinutes,
+            PrivateAccount,
+            UserNotFound,
+            ClientConnectionError,
+            ClientForbiddenError,
+            ClientThrottledError,
+            TwoFactorRequired,
+            ChallengeRequired
+        )
+
         if os.environ.get("http_proxy"): #якщо треба проксі
                 self.client.set_proxy(os.environ.get("http_proxy"))
         try:
-            self.client.login(username, password)
+            await self._call(self.client.login, username, password)
             self.is_logged_in = True
             self.username = username
             logging.info(f"✅ Успішний вхід у Instagram як {username}")
 
-            #Оновлюємо, або створюємо юзера
-            user = self.db_session.query(User).filter(User.telegram_id == self.user_id).first()
-            if not user: #Якщо юзер не існує
-                user = User(telegram_id=self.user_id, username=username)
-                self.db_session.add(user)
-            else: #Якщо існує
-                user.username = username #оновлюємо данні
-            self.db_session.commit()
+            await self._store_user() #Оновлюємо, або створюємо юзера
             await self.save_session() # Зберігаєм сесію в БД
             self._last_login_result = True
             return True
 
         except TwoFactorRequired:
             logging.warning("Потрібна двоетапна автентифікація.")
+            self.awaiting_2fa = True
+            self.username = username  # Знадобиться для збереження юзера після 2FA
             self._last_login_result = None
             return False # Вказуємо що треба 2FA
         except ChallengeRequired:
@@ -109,6 +145,25 @@ class InstagramAPI:
             self._last_login_result = False
             return False
 
+    async def _store_user(self, two_factor_enabled=None):
+        """Створення/оновлення юзера після успішного входу разом з числовим ID Instagram."""
+        # ID береться з cookies сесії (ds_user_id), без додаткового запиту
+        if self.client.user_id:
+            self.instagram_user_id = str(self.client.user_id)
+        async with session_scope(self.session_factory) as session:
+            user = await get_user(session, self.user_id)
+            if not user: #Якщо юзер не існує
+                user = User(telegram_id=self.user_id, username=self.username)
+                session.add(user)
+            else: #Якщо існує
+                user.username = self.username #оновлюємо данні
+            user.instagram_user_id = self.instagram_user_id
+            user.last_active_at = datetime.datetime.utcnow()
+            if two_factor_enabled is not None:
+                user.two_factor_enabled = two_factor_enabled
+            await session.flush()  # id нового запису
+            self.user_pk = user.id
+
     async def request_2fa_code(self, context : CallbackContext, update: Update):
         """Запит коду 2FA (тепер з context)"""
         #Отримуємо об'єкт
@@ -117,18 +172,17 @@ class InstagramAPI:
     async def complete_2fa_login(self, code : str):
         """Завершення входу з 2FA (змінено)"""
         try:
-            self.client.two_factor_login(code) #Використовуємо метод two_factor_login
+            await self._call(self.client.two_factor_login, code) #Використовуємо метод two_factor_login
             self.is_logged_in = True
+            self.awaiting_2fa = False
             logging.info("✅ Успішний вхід з 2FA!")
+            #Оновлюєм інфу про юзера (зберігаєм що увімкнено 2fa)
+            await self._store_user(two_factor_enabled=True)
             await self.save_session() # Зберігаєм
-            #Оновлюєм інфу про юзера
-            user = self.db_session.query(User).filter(User.telegram_id == self.user_id).first()
-            if user:
-               user.two_factor_enabled = True #зберігаєм що увімкнено 2fa
-               self.db_session.commit()
             return True
         except Exception as e:
                 logging.warning(f"Помилка 2FA: {e}")
+                self.awaiting_2fa = False
                 return False
 
 
@@ -136,16 +190,20 @@ class InstagramAPI:
         """Вихід з Instagram."""
         if self.is_logged_in:
             try:
-                await asyncio.to_thread(self.client.logout)
+                await self._call(self.client.logout)
                # Очищаємо дані сесії з БД
-                user = self.db_session.query(User).filter(User.telegram_id == self.user_id).first()
-                if user:
-                    user.session_data = None  # Очищаємо дані сесії
-                    user.two_factor_enabled = False
-                    self.db_session.commit()  # Зберігаємо зміни
+                if await self._get_user_pk() is not None:
+                    async with session_scope(self.session_factory) as session:
+                        await session.execute(
+                            update(User).where(User.id == self.user_pk).values(
+                                session_data=None, session_blob=None, two_factor_enabled=False,
+                                instagram_user_id=None))
+                self.session_digest = None
 
                 self.is_logged_in = False
                 self.username = None
+                self.instagram_user_id = None
+                self.invalidate_stats()
                 logging.info("Вихід з Instagram успішний.")
                 return True
             except Exception as e:
@@ -153,27 +211,29 @@ class InstagramAPI:
                 return False
         return False
 
+    async def resolve_instagram_user_id(self):
+        """Числовий ID акаунта Instagram: з пам'яті, інакше визначається один раз і зберігається в БД."""
+        if self.instagram_user_id:
+            return self.instagram_user_id
+
+        # Лінива міграція старих записів: спершу cookies сесії, потім запит за username
+        user_id = self.client.user_id or await self._call(self.client.user_id_from_username, self.username)
+        self.instagram_user_id = str(user_id)
+        if await self._get_user_pk() is not None:
+            async with session_scope(self.session_factory) as session:
+                await session.execute(
+                    update(User).where(User.id == self.user_pk).values(instagram_user_id=self.instagram_user_id))
+        return self.instagram_user_id
+
     async def get_user_stats(self):
         """Отримання статистики акаунта."""
         if not self.is_logged_in:
              return None
 
         try:
-            user_id = await asyncio.to_thread(self.client.user_id_from_username, self.username)
-            user_info = await asyncio.to_thread(self.client.user_info, user_id)
-
-            total_likes = 0
-            medias = await asyncio.to_thread(self.client.user_medias, user_id, amount=0)
-            for media in medias:
-                total_likes += media.like_count
-
-            stats = {
-                "Лайки (всього)": total_likes,
-                "Підписники": user_info.follower_count,
-                "Підписки": user_info.following_count,
-                "Публікації" : user_info.media_count
-            }
-            return stats
+            # Відповідь з локальних агрегатів, медіа синхронізуються інкрементально.
+            # Одночасні натискання однієї кнопки об'єднуються в один запит.
+            return await stats_cache.get((self.user_id, "user_stats"), lambda: media_store.get_stats(self))
         except Exception as e:
             logging.error(f"❌ Помилка отримання статистики: {e}")
             return None
@@ -184,40 +244,62 @@ class InstagramAPI:
             return None
 
         try:
-            user_id = await asyncio.to_thread(self.client.user_id_from_username, self.username)
-            posts = await asyncio.to_thread(self.client.user_medias, user_id, amount=1)
-
-            if not posts:
-                return {"likes": 0, "comments": 0, "views": 0}
-
-            last_post = posts[0]
-            return {
-                "Лайки": last_post.like_count,
-                "Коментарі": last_post.comment_count,
-                "Перегляди": last_post.view_count if hasattr(last_post, 'view_count') else 0
-            }
+            return await stats_cache.get((self.user_id, "last_post_stats"), self._fetch_last_post_stats)
         except Exception as e:
             logging.error(f"❌ Помилка отримання статистики останнього поста: {e}")
             return None
 
+    async def _fetch_last_post_stats(self):
+        user_id = await self.resolve_instagram_user_id()
+        posts = await self._call(self.client.user_medias, user_id, amount=1)
+
+        if not posts:
+            return {"likes": 0, "comments": 0, "views": 0}
+
+        last_post = posts[0]
+        return {
+            "Лайки": last_post.like_count,
+            "Коментарі": last_post.comment_count,
+            "Перегляди": last_post.view_count if hasattr(last_post, 'view_count') else 0
+        }
+
+    def invalidate_stats(self):
+        """Скидання кешованої статистики (після публікації чи виходу)."""
+        stats_cache.invalidate((self.user_id, "user_stats"))
+        stats_cache.invalidate((self.user_id, "last_post_stats"))
+
     async def post_photo(self, photo_path, caption):
         """Публікація фото з підписом."""
         if not self.is_logged_in:
             raise Exception("Користувач не авторизований")
         try:
-            await asyncio.to_thread(self.client.photo_upload, photo_path, caption)
+            await self._call(self.client.photo_upload, photo_path, caption)
+            self.invalidate_stats()
             logging.info("Фото успішно опубліковано")
 
         except Exception as e:
             logging.error(f"Помилка публікації фото: {e}")
             raise
 
+    async def post_album(self, photo_paths, caption):
+        """Публікація альбому (каруселі) з кількох фото з одним підписом."""
+        if not self.is_logged_in:
+            raise Exception("Користувач не авторизований")
+        try:
+            await self._call(self.client.album_upload, photo_paths, caption)
+            self.invalidate_stats()
+            logging.info(f"Альбом з {len(photo_paths)} фото успішно опубліковано")
+        except Exception as e:
+            logging.error(f"Помилка публікації альбому: {e}")
+            raise
+
     async def post_story(self, photo_path):
         """Публікація історії з фотографією."""
         if not self.is_logged_in:
               raise Exception("Користувач не авторизований.")
         try:
-            await asyncio.to_thread(self.client.photo_upload_to_story, photo_path)
+            await self._call(self.client.photo_upload_to_story, photo_path)
+            self.invalidate_stats()
             logging.info("Сторіс успішно опубліковано.")
         except Exception as e:
             logging.error(f"Помилка при публікації сторіс: {e}")
@@ -0,0 +1,115 @@
+import asyncio
+import json
+import logging
+import os
+
+import httpx
+
+from config import DEEPSEEK_API_KEY, DEEPSEEK_API_URL
+from metrics import track
+
+logger = logging.getLogger(__name__)
+
+# Налаштування пулу з'єднань і таймаутів (можна перевизначити через змінні середовища)
+DEEPSEEK_CONNECT_TIMEOUT = float(os.environ.get("DEEPSEEK_CONNECT_TIMEOUT", "5"))
+DEEPSEEK_READ_TIMEOUT = float(os.environ.get("DEEPSEEK_READ_TIMEOUT", "60"))
+DEEPSEEK_MAX_CONNECTIONS = int(os.environ.get("DEEPSEEK_MAX_CONNECTIONS", "20"))
+DEEPSEEK_MAX_IN_FLIGHT = int(os.environ.get("DEEPSEEK_MAX_IN_FLIGHT", "10"))
+DEEPSEEK_KEEPALIVE_EXPIRY = float(os.environ.get("DEEPSEEK_KEEPALIVE_EXPIRY", "60"))
+
+
+def _http2_available():
+    """HTTP/2 вмикаємо лише якщо встановлено пакет h2."""
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class DeepSeekClient:
+    """Асинхронний клієнт DeepSeek з постійним пулом з'єднань на весь час роботи процесу."""
+
+    def __init__(self, api_url=DEEPSEEK_API_URL, api_key=DEEPSEEK_API_KEY, *,
+                 connect_timeout=DEEPSEEK_CONNECT_TIMEOUT,
+                 read_timeout=DEEPSEEK_READ_TIMEOUT,
+                 max_connections=DEEPSEEK_MAX_CONNECTIONS,
+                 max_in_flight=DEEPSEEK_MAX_IN_FLIGHT,
+                 transport=None):
+        self.api_url = api_url
+        self.api_key = api_key
+        self._timeout = httpx.Timeout(read_timeout, connect=connect_timeout, pool=connect_timeout)
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=DEEPSEEK_KEEPALIVE_EXPIRY,
+        )
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._transport = transport  # Для тестів/бенчмарків можна підставити свій транспорт
+        self._client = None
+        self.in_flight = 0
+
+    def _get_client(self):
+        """Лінива ініціалізація httpx.AsyncClient (пул створюється один раз)."""
+        if self._client is None or self._client.is_closed:
+            http2 = _http2_available() and self._transport is None
+            self._client = httpx.AsyncClient(
+                http2=http2,
+                timeout=self._timeout,
+                limits=self._limits,
+                transport=self._transport,
+                headers={
+                    "Authorization": f"Bearer {self.api_key}",
+                    "Content-Type": "application/json",
+                },
+            )
+            logger.info(f"DeepSeek клієнт створено (HTTP/2: {http2})")
+        return self._client
+
+    async def chat(self, payload):
+        """Запит chat/completions. Кількість одночасних запитів обмежена семафором."""
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                async with track("deepseek", "chat"):
+                    response = await self._get_client().post(self.api_url, json=payload)
+                    response.raise_for_status()
+                    return response.json()
+            finally:
+                self.in_flight -= 1
+
+    async def stream_chat(self, payload):
+        """Потоковий запит (SSE). Повертає частини тексту відповіді по мірі надходження."""
+        payload = dict(payload, stream=True)
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                async with track("deepseek", "stream_chat"), \
+                        self._get_client().stream("POST", self.api_url, json=payload) as response:
+                    response.raise_for_status()
+                    async for line in response.aiter_lines():
+                        # Рядки-коментарі (": keep-alive") та порожні рядки пропускаємо
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            break
+                        chunk = json.loads(data)
+                        choices = chunk.get("choices") or []
+                        if not choices:
+                            continue
+                        content = (choices[0].get("delta") or {}).get("content")
+                        if content:
+                            yield content
+            finally:
+                self.in_flight -= 1
+
+    async def aclose(self):
+        """Закриття пулу з'єднань (викликається при зупинці бота)."""
+        if self._client is not None and not self._client.is_closed:
+            await self._client.aclose()
+        self._client = None
+
+
+# Один клієнт на процес
+deepseek_client = DeepSeekClient()
@@ -0,0 +1,160 @@
+import asyncio
+import functools
+import logging
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import track
+from .rate_limiter import AdaptiveTokenBucket
+
+logger = logging.getLogger(__name__)
+
+INSTAGRAPI_MAX_WORKERS = int(os.environ.get("INSTAGRAPI_MAX_WORKERS", "16"))
+# Швидкість акаунта пам'ятається й після витіснення його клієнта, доки акаунт не простоїть LIMITER_TTL
+INSTAGRAM_LIMITER_TTL = int(os.environ.get("INSTAGRAM_LIMITER_TTL", "3600"))  # секунди
+INSTAGRAM_MAX_LIMITERS = int(os.environ.get("INSTAGRAM_MAX_LIMITERS", "10000"))
+
+
+@functools.cache
+def throttle_errors():
+    """Помилки, якими Instagram повідомляє про перевищення частоти запитів.
+
+    instagrapi імпортується ліниво, щоб не сповільнювати запуск бота.
+    """
+    from instagrapi.exceptions import ClientThrottledError, PleaseWaitFewMinutes, RateLimitError
+
+    return ClientThrottledError, PleaseWaitFewMinutes, RateLimitError
+
+
+class InstagrapiExecutor:
+    """Єдиний обмежений пул потоків для синхронних викликів instagrapi.
+
+    Виклики одного акаунта виконуються строго по черзі (FIFO), різні акаунти - паралельно.
+    Кожен акаунт має адаптивний token bucket, що сповільнюється після помилок обмеження.
+    Черга та bucket прив'язані до акаунта (telegram_id), а не до Client, тож клієнт,
+    відновлений після витіснення, не виконується паралельно зі старим і не починає
+    знову з повної швидкості одразу після обмеження.
+    """
+
+    def __init__(self, max_workers=INSTAGRAPI_MAX_WORKERS, limiter_ttl=INSTAGRAM_LIMITER_TTL,
+                 max_limiters=INSTAGRAM_MAX_LIMITERS):
+        self.max_workers = max_workers
+        self.limiter_ttl = limiter_ttl
+        self.max_limiters = max_limiters
+        self._pool = None
+        self._locks = {}  # акаунт -> asyncio.Lock (черга акаунта), доки є виклики
+        self._depth = {}  # акаунт -> кількість викликів у черзі/виконанні
+        self._limiters = OrderedDict()  # акаунт -> AdaptiveTokenBucket (від давно використаних)
+        self._limiter_used = {}  # акаунт -> час останнього звернення
+        self.in_flight = 0
+        self.calls = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="instagrapi")
+        return self._pool
+
+    async def run(self, client, func, *args, account=None, **kwargs):
+        """Виконує func(*args, **kwargs) у пулі, серіалізуючи виклики в межах одного акаунта.
+
+        account - ключ черги та обмеження швидкості (telegram_id); без нього - сам client.
+        """
+        loop = asyncio.get_running_loop()
+        key = client if account is None else account
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._depth[key] = self._depth.get(key, 0) + 1
+        enqueued_at = time.monotonic()
+        started_at = None
+
+        def call():
+            nonlocal started_at
+            started_at = time.monotonic()
+            return func(*args, **kwargs)
+
+        try:
+            async with lock:
+                limiter = self.limiter(key)
+                await limiter.acquire()
+                self.in_flight += 1
+                try:
+                    async with track("instagrapi", getattr(func, "__name__", "call")):
+                        result = await loop.run_in_executor(self._get_pool(), call)
+                except throttle_errors():
+                    limiter.on_throttle()
+                    logger.warning(f"Instagram обмежив запити, швидкість акаунта знижено до {limiter.rate:.3f}/с")
+                    raise
+                finally:
+                    self.in_flight -= 1
+                limiter.on_success()
+                return result
+        finally:
+            self._depth[key] -= 1
+            if not self._depth[key]:
+                del self._depth[key]
+                del self._locks[key]
+            if started_at is not None:
+                self._record_wait(started_at - enqueued_at)
+
+    def limiter(self, account):
+        limiter = self._limiters.get(account)
+        if limiter is None:
+            self._prune_limiters()
+            limiter = self._limiters[account] = AdaptiveTokenBucket()
+        else:
+            self._limiters.move_to_end(account)
+        self._limiter_used[account] = time.monotonic()
+        return limiter
+
+    def _prune_limiters(self):
+        """Забуває bucket-и акаунтів, що простоювали довше за limiter_ttl або понад max_limiters."""
+        deadline = time.monotonic() - self.limiter_ttl
+        while self._limiters:
+            account = next(iter(self._limiters))
+            if len(self._limiters) < self.max_limiters and self._limiter_used[account] >= deadline:
+                break
+            del self._limiters[account]
+            del self._limiter_used[account]
+
+    def _record_wait(self, wait):
+        self.calls += 1
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+
+    def queue_depth(self, account=None):
+        """Глибина черги для акаунта або сумарно по всіх акаунтах (без тих, що вже виконуються)."""
+        if account is not None:
+            lock = self._locks.get(account)
+            running = 1 if lock is not None and lock.locked() else 0
+            return max(self._depth.get(account, 0) - running, 0)
+        return max(sum(self._depth.values()) - self.in_flight, 0)
+
+    def busy(self, account):
+        """Чи має акаунт виклики в черзі або у виконанні."""
+        return self._depth.get(account, 0) > 0
+
+    def stats(self):
+        return {
+            "max_workers": self.max_workers,
+            "in_flight": self.in_flight,
+            "queued": self.queue_depth(),
+            "accounts": len(self._locks),
+            "calls": self.calls,
+            "avg_wait_seconds": self.total_wait / self.calls if self.calls else 0.0,
+            "max_wait_seconds": self.max_wait,
+            "throttled_accounts": sum(1 for limiter in self._limiters.values() if limiter.throttles),
+        }
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+# Один пул на процес для всіх викликів instagrapi
+instagrapi_executor = InstagrapiExecutor()
@@ -0,0 +1,197 @@
+import asyncio
+import datetime
+import logging
+import os
+
+from database import session_scope
+from database.crud import get_account_stats, get_media_snapshots, get_media_snapshots_after, get_user
+from database.models import AccountStats, MediaSnapshot
+
+logger = logging.getLogger(__name__)
+
+MEDIA_SYNC_PAGE_SIZE = int(os.environ.get("MEDIA_SYNC_PAGE_SIZE", "50"))
+MEDIA_SYNC_MAX_HEAD_PAGES = int(os.environ.get("MEDIA_SYNC_MAX_HEAD_PAGES", "20"))
+MEDIA_SYNC_BACKFILL_PAGES = int(os.environ.get("MEDIA_SYNC_BACKFILL_PAGES", "5"))
+MEDIA_SYNC_INTERVAL = int(os.environ.get("MEDIA_SYNC_INTERVAL", "600"))  # секунди
+
+
+class MediaSnapshotStore:
+    """Інкрементальна синхронізація медіа акаунта в БД та статистика з локальних агрегатів.
+
+    Кожна синхронізація читає сторінки від найновіших медіа, доки не зустріне вже відоме
+    (лічильники перших сторінок при цьому оновлюються), а старіші медіа догружаються
+    порціями за збереженим курсором. Збережені медіа з прочитаного проміжку, яких
+    більше немає в акаунті, видаляються, а їхні лайки та коментарі віднімаються від агрегатів.
+    """
+
+    def __init__(self):
+        self._syncing = {}  # telegram_id -> Task (одна синхронізація на акаунт)
+
+    async def get_stats(self, api):
+        """Статистика з локальних даних. Застарілі дані оновлюються у фоні."""
+        stats = await self._load(api)
+        if stats is None or stats.last_synced_at is None:
+            stats = await self.sync(api)
+        elif datetime.datetime.utcnow() - stats.last_synced_at > datetime.timedelta(seconds=MEDIA_SYNC_INTERVAL):
+            self._start_sync(api)
+        return self.format_stats(stats) if stats else None
+
+    @staticmethod
+    def format_stats(stats):
+        return {
+            "Лайки (всього)": stats.total_likes,
+            "Підписники": stats.follower_count,
+            "Підписки": stats.following_count,
+            "Публікації": stats.media_count,
+        }
+
+    async def sync(self, api):
+        """Запускає (або приєднується до вже запущеної) синхронізації і чекає на результат."""
+        return await asyncio.shield(self._start_sync(api))
+
+    def _start_sync(self, api):
+        task = self._syncing.get(api.user_id)
+        if task is None:
+            task = asyncio.get_running_loop().create_task(self._sync(api))
+            self._syncing[api.user_id] = task
+            task.add_done_callback(lambda t, key=api.user_id: self._on_sync_done(key, t))
+        return task
+
+    def _on_sync_done(self, key, task):
+        self._syncing.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"❌ Помилка синхронізації медіа: {task.exception()}")
+
+    async def _load(self, api):
+        async with session_scope(api.session_factory) as session:
+            user = await get_user(session, api.user_id)
+            if user is None:
+                return None
+            return await get_account_stats(session, user.id)
+
+    async def _sync(self, api):
+        ig_user_id = await api.resolve_instagram_user_id()
+        user_info = await api._call(api.client.user_info, ig_user_id)
+
+        async with session_scope(api.session_factory) as session:
+            user = await get_user(session, api.user_id)
+            if user is None:
+                return None
+            db_user_id = user.id
+            stats = await get_account_stats(session, db_user_id)
+            if stats is None:
+                stats = AccountStats(user_id=db_user_id, total_likes=0, total_comments=0, synced_media=0)
+                session.add(stats)
+            stats.follower_count = user_info.follower_count
+            stats.following_count = user_info.following_count
+            stats.media_count = user_info.media_count
+            first_sync = stats.last_synced_at is None
+
+        # Нові медіа: від найновіших, доки не дійдемо до вже збережених
+        cursor = ""
+        reached_known = False
+        seen = set()
+        oldest = None
+        for _ in range(MEDIA_SYNC_MAX_HEAD_PAGES):
+            medias, cursor = await api._call(
+                api.client.user_medias_paginated, ig_user_id, MEDIA_SYNC_PAGE_SIZE, end_cursor=cursor)
+            known = await self._apply_page(api, db_user_id, medias)
+            seen.update(str(media.pk) for media in medias)
+            # Закріплені пости йдуть першими, тому орієнтуємось на найстаріше медіа сторінки
+            if medias:
+                oldest = medias[-1].taken_at
+            reached_known = bool(medias) and str(medias[-1].pk) in known
+            if reached_known or not medias or not cursor:
+                break
+        if not cursor:
+            await self._remove_deleted(api, db_user_id, seen)  # Прочитано всі медіа акаунта
+        elif oldest is not None:
+            await self._remove_deleted(api, db_user_id, seen, taken_after=_naive_utc(oldest))
+
+        async with session_scope(api.session_factory) as session:
+            stats = await get_account_stats(session, db_user_id)
+            if first_sync:
+                stats.backfill_cursor = cursor or None
+                stats.backfill_done = not cursor or reached_known
+            backfill_cursor = None if stats.backfill_done else stats.backfill_cursor
+
+        # Догрузка старіших медіа порціями
+        for _ in range(MEDIA_SYNC_BACKFILL_PAGES if backfill_cursor else 0):
+            medias, backfill_cursor = await api._call(
+                api.client.user_medias_paginated, ig_user_id, MEDIA_SYNC_PAGE_SIZE, end_cursor=backfill_cursor)
+            await self._apply_page(api, db_user_id, medias)
+            if not medias or not backfill_cursor:
+                backfill_cursor = None
+                break
+
+        async with session_scope(api.session_factory) as session:
+            stats = await get_account_stats(session, db_user_id)
+            if not stats.backfill_done:
+                stats.backfill_cursor = backfill_cursor
+                stats.backfill_done = backfill_cursor is None
+            stats.last_synced_at = datetime.datetime.utcnow()
+        logger.info(f"Медіа акаунта {api.username} синхронізовано ({stats.synced_media} медіа).")
+        return stats
+
+    @staticmethod
+    async def _remove_deleted(api, db_user_id, seen, taken_after=None):
+        """Видаляє збережені медіа, новіші за taken_after, яких не було серед прочитаних сторінок."""
+        async with session_scope(api.session_factory) as session:
+            snapshots = await get_media_snapshots_after(session, db_user_id, taken_after)
+            removed = [snapshot for snapshot in snapshots if snapshot.media_pk not in seen]
+            if not removed:
+                return 0
+            stats = await get_account_stats(session, db_user_id)
+            for snapshot in removed:
+                stats.total_likes -= snapshot.like_count or 0
+                stats.total_comments -= snapshot.comment_count or 0
+                stats.synced_media -= 1
+                await session.delete(snapshot)
+        logger.info(f"Видалено медіа, яких більше немає в акаунті {api.username}: {len(removed)}")
+        return len(removed)
+
+    @staticmethod
+    async def _apply_page(api, db_user_id, medias):
+        """Зберігає сторінку медіа та оновлює агрегати. Повертає множину вже відомих media_pk."""
+        if not medias:
+            return set()
+        now = datetime.datetime.utcnow()
+        async with session_scope(api.session_factory) as session:
+            stats = await get_account_stats(session, db_user_id)
+            existing = await get_media_snapshots(session, db_user_id, {str(media.pk) for media in medias})
+            for media in medias:
+                likes = media.like_count or 0
+                comments = media.comment_count or 0
+                views = media.view_count or media.play_count or 0
+                snapshot = existing.get(str(media.pk))
+                if snapshot is None:
+                    session.add(MediaSnapshot(
+                        user_id=db_user_id,
+                        media_pk=str(media.pk),
+                        taken_at=_naive_utc(media.taken_at),
+                        like_count=likes,
+                        comment_count=comments,
+                        view_count=views,
+                        updated_at=now,
+                    ))
+                    stats.total_likes += likes
+                    stats.total_comments += comments
+                    stats.synced_media += 1
+                else:
+                    stats.total_likes += likes - snapshot.like_count
+                    stats.total_comments += comments - snapshot.comment_count
+                    snapshot.like_count = likes
+                    snapshot.comment_count = comments
+                    snapshot.view_count = views
+                    snapshot.updated_at = now
+        return set(existing)
+
+
+def _naive_utc(value):
+    """taken_at з instagrapi (UTC з часовим поясом) -> як зберігається в БД (без поясу)."""
+    if value is not None and value.tzinfo is not None:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+media_store = MediaSnapshotStore()
@@ -0,0 +1,56 @@
+import asyncio
+import os
+import time
+
+# Початкова/максимальна швидкість запитів на акаунт (запитів за секунду) та розмір пачки
+INSTAGRAM_RATE = float(os.environ.get("INSTAGRAM_RATE", "0.5"))
+INSTAGRAM_MAX_RATE = float(os.environ.get("INSTAGRAM_MAX_RATE", str(INSTAGRAM_RATE)))
+INSTAGRAM_MIN_RATE = float(os.environ.get("INSTAGRAM_MIN_RATE", "0.02"))
+INSTAGRAM_BURST = float(os.environ.get("INSTAGRAM_BURST", "5"))
+# На скільки зростає швидкість після кожного успішного запиту (повільне відновлення)
+INSTAGRAM_RATE_RECOVERY = float(os.environ.get("INSTAGRAM_RATE_RECOVERY", "0.005"))
+
+
+class AdaptiveTokenBucket:
+    """Token bucket з адаптивною швидкістю (AIMD).
+
+    При обмеженні з боку Instagram швидкість зменшується вдвічі, після успішних
+    запитів - повільно зростає до max_rate.
+    """
+
+    def __init__(self, rate=INSTAGRAM_RATE, burst=INSTAGRAM_BURST, min_rate=INSTAGRAM_MIN_RATE,
+                 max_rate=INSTAGRAM_MAX_RATE, recovery=INSTAGRAM_RATE_RECOVERY, decrease_factor=0.5):
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, rate)
+        self.recovery = recovery
+        self.decrease_factor = decrease_factor
+        self.tokens = burst
+        self.throttles = 0
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """Чекає на токен. Повертає час очікування в секундах."""
+        waited = 0.0
+        while True:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return waited
+            delay = (1 - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def on_success(self):
+        self.rate = min(self.max_rate, self.rate + self.recovery)
+
+    def on_throttle(self):
+        self.throttles += 1
+        self.rate = max(self.min_rate, self.rate * self.decrease_factor)
+        self.tokens = 0  # Після обмеження спершу чекаємо повний інтервал
@@ -0,0 +1,244 @@
+import asyncio
+import datetime
+import importlib
+import logging
+import os
+import resource
+import time
+from collections import OrderedDict
+
+from database import session_scope
+from database.crud import get_recently_active_users
+from .api import InstagramAPI
+from .executor import instagrapi_executor
+from .session_store import SESSION_FLUSH_INTERVAL, SessionStore
+
+logger = logging.getLogger(__name__)
+
+INSTAGRAM_MAX_CLIENTS = int(os.environ.get("INSTAGRAM_MAX_CLIENTS", "500"))
+INSTAGRAM_CLIENT_IDLE_TTL = int(os.environ.get("INSTAGRAM_CLIENT_IDLE_TTL", "1800"))  # секунди
+INSTAGRAM_REGISTRY_SWEEP_INTERVAL = int(os.environ.get("INSTAGRAM_REGISTRY_SWEEP_INTERVAL", "60"))
+# Скільки нещодавно активних користувачів відновлювати у фоні після старту (0 - вимкнено)
+INSTAGRAM_PREWARM_USERS = int(os.environ.get("INSTAGRAM_PREWARM_USERS", "50"))
+
+
+def current_rss_bytes():
+    """Поточний RSS процесу (на Linux з /proc, інакше пікове значення з getrusage)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class InstagramClientRegistry:
+    """Обмежений реєстр InstagramAPI на користувача з витісненням неактивних клієнтів.
+
+    Витіснений клієнт відновлюється зі збереженої сесії при наступному зверненні;
+    змінені сесії активних клієнтів періодично зберігаються одним пакетом.
+    """
+
+    def __init__(self, session_factory, max_size=INSTAGRAM_MAX_CLIENTS, idle_ttl=INSTAGRAM_CLIENT_IDLE_TTL,
+                 sweep_interval=INSTAGRAM_REGISTRY_SWEEP_INTERVAL, shard=None,
+                 flush_interval=SESSION_FLUSH_INTERVAL):
+        self.session_factory = session_factory
+        self.sessions = SessionStore(session_factory)
+        self.flush_interval = flush_interval
+        self.shard = shard  # (номер, кількість): у шардованому режимі прогріваються лише свої користувачі
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self.sweep_interval = sweep_interval
+        self._clients = OrderedDict()  # user_id -> InstagramAPI (від найстаршого до найновішого)
+        self._last_used = {}
+        self._loading = {}  # user_id -> Future, щоб не створювати клієнт двічі
+        self._sweep_task = None
+        self._flush_task = None
+        self._prewarm_task = None
+        self.evictions = 0
+        self.rehydrations = 0
+        self.prewarmed = 0
+
+    def __contains__(self, user_id):
+        return user_id in self._clients
+
+    def __len__(self):
+        return len(self._clients)
+
+    async def get(self, user_id):
+        """Повертає InstagramAPI користувача, за потреби створює та відновлює сесію з БД."""
+        api = self._clients.get(user_id)
+        if api is not None:
+            self._touch(user_id)
+            return api
+
+        if user_id in self._loading:
+            return await asyncio.shield(self._loading[user_id])
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[user_id] = future
+        try:
+            api = InstagramAPI(self.session_factory, self.sessions)
+            api.user_id = user_id
+            if await api.load_session():
+                self.rehydrations += 1
+            self._clients[user_id] = api
+            self._touch(user_id)
+            future.set_result(api)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._loading[user_id]
+
+        await self._evict_overflow()
+        return api
+
+    def discard(self, user_id):
+        """Видалення клієнта без збереження сесії (наприклад, після виходу)."""
+        self._clients.pop(user_id, None)
+        self._last_used.pop(user_id, None)
+
+    def _touch(self, user_id):
+        self._clients.move_to_end(user_id)
+        self._last_used[user_id] = time.monotonic()
+
+    @staticmethod
+    def _evictable(api):
+        # Клієнт, що чекає на код 2FA, тримає стан входу лише в пам'яті; клієнт з викликами
+        # в черзі або у виконанні (наприклад, завантаження) змінює cookies просто зараз
+        return not api.awaiting_2fa and not instagrapi_executor.busy(api.user_id)
+
+    @staticmethod
+    def _last_active_at(last_used):
+        """Монотонний час останнього звернення -> UTC для User.last_active_at."""
+        if last_used is None:
+            return None
+        return datetime.datetime.utcnow() - datetime.timedelta(seconds=time.monotonic() - last_used)
+
+    async def _evict(self, user_id):
+        api = self._clients.pop(user_id, None)
+        last_used = self._last_used.pop(user_id, None)
+        if api is None:
+            return
+        self.evictions += 1
+        if api.is_logged_in:
+            # Щоб відновлення підхопило актуальні cookies
+            await api.save_session(last_active_at=self._last_active_at(last_used))
+
+    async def flush_sessions(self):
+        """Зберігає змінені сесії всіх клієнтів у пам'яті одним пакетом."""
+        return await self.sessions.flush(list(self._clients.values()))
+
+    async def _evict_overflow(self):
+        for user_id in list(self._clients):
+            if len(self._clients) <= self.max_size:
+                break
+            if self._evictable(self._clients[user_id]):
+                await self._evict(user_id)
+
+    async def evict_idle(self):
+        """Витіснення клієнтів, які не використовувались довше за idle_ttl."""
+        deadline = time.monotonic() - self.idle_ttl
+        idle = [user_id for user_id, api in self._clients.items()
+                if self._last_used.get(user_id, 0) < deadline and self._evictable(api)]
+        for user_id in idle:
+            await self._evict(user_id)
+        if idle:
+            logger.info(f"Витіснено неактивних Instagram клієнтів: {len(idle)}. {self.stats()}")
+        return len(idle)
+
+    async def prewarm(self, limit=INSTAGRAM_PREWARM_USERS):
+        """Відновлює клієнти нещодавно активних користувачів одним запитом до БД.
+
+        Прогріті клієнти стають найстаршими в LRU, тож не витісняють тих, хто вже працює.
+        """
+        limit = min(limit, self.max_size - len(self._clients))
+        if limit <= 0:
+            return 0
+        started = time.monotonic()
+        # Важкий імпорт instagrapi - в окремому потоці, щоб не блокувати обробку оновлень
+        await asyncio.to_thread(importlib.import_module, "instagrapi")
+        async with session_scope(self.session_factory) as session:
+            users = await get_recently_active_users(session, limit, shard=self.shard)
+
+        warmed = 0
+        for user in users:
+            if user.telegram_id in self._clients or user.telegram_id in self._loading:
+                continue
+            api = InstagramAPI(self.session_factory, self.sessions)
+            api.user_id = user.telegram_id
+            if api.apply_session(user):
+                self._clients[user.telegram_id] = api
+                self._clients.move_to_end(user.telegram_id, last=False)
+                self._last_used[user.telegram_id] = time.monotonic()
+                warmed += 1
+            await asyncio.sleep(0)  # Оновлення користувачів обробляються між відновленнями
+        self.prewarmed += warmed
+        logger.info(f"Прогріто Instagram клієнтів: {warmed} за {time.monotonic() - started:.2f} с")
+        return warmed
+
+    def start_prewarm(self):
+        if self._prewarm_task is None:
+            self._prewarm_task = asyncio.get_running_loop().create_task(self.prewarm())
+            self._prewarm_task.add_done_callback(self._on_prewarm_done)
+
+    @staticmethod
+    def _on_prewarm_done(task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Помилка прогріву Instagram клієнтів: {task.exception()}")
+
+    def stats(self):
+        return {
+            "resident_clients": len(self._clients),
+            "max_clients": self.max_size,
+            "evictions": self.evictions,
+            "rehydrations": self.rehydrations,
+            "prewarmed": self.prewarmed,
+            "rss_bytes": current_rss_bytes(),
+            **self.sessions.stats(),
+        }
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                await self.evict_idle()
+            except Exception as e:
+                logger.error(f"Помилка витіснення Instagram клієнтів: {e}")
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_sessions()
+            except Exception as e:
+                logger.error(f"Помилка збереження сесій Instagram: {e}")
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.get_running_loop().create_task(self._sweep_loop())
+        if self._flush_task is None and self.flush_interval > 0:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def stop(self):
+        """Зупинка фонової задачі та збереження сесій усіх клієнтів."""
+        for task in (self._sweep_task, self._flush_task, self._prewarm_task):
+            if task is not None:
+                task.cancel()
+                await asyncio.gather(task, return_exceptions=True)
+        self._sweep_task = self._flush_task = self._prewarm_task = None
+        # Сесії та час останньої активності всіх клієнтів - одним пакетом
+        clients = [(api, self._last_active_at(self._last_used.get(user_id)))
+                   for user_id, api in self._clients.items() if api.is_logged_in]
+        try:
+            await self.sessions.flush(clients)
+        except Exception as e:
+            logger.error(f"Помилка пакетного збереження сесій Instagram, зберігаємо по одній: {e}")
+            for api, last_active_at in clients:
+                try:
+                    await self.sessions.save(api, last_active_at)
+                except Exception as e:
+                    logger.error(f"Помилка збереження сесії Instagram {api.user_id}: {e}")
+        self.evictions += len(self._clients)
+        self._clients.clear()
+        self._last_used.clear()
@@ -0,0 +1,134 @@
+import hashlib
+import json
+import logging
+import os
+import zlib
+
+from sqlalchemy import bindparam, update
+
+from database import session_scope
+from database.models import User
+
+logger = logging.getLogger(__name__)
+
+# Як часто зберігати змінені сесії (cookies, налаштування пристрою) усіх активних клієнтів
+SESSION_FLUSH_INTERVAL = int(os.environ.get("SESSION_FLUSH_INTERVAL", "300"))  # секунди
+SESSION_COMPRESS_LEVEL = int(os.environ.get("SESSION_COMPRESS_LEVEL", "6"))
+
+
+def canonical_settings(settings):
+    """Налаштування instagrapi -> (канонічний JSON, sha256 від нього)."""
+    raw = json.dumps(settings, sort_keys=True, separators=(",", ":")).encode()
+    return raw, hashlib.sha256(raw).digest()
+
+
+def encode_settings(settings):
+    """Налаштування instagrapi -> (стиснутий JSON, sha256 від канонічного JSON)."""
+    raw, digest = canonical_settings(settings)
+    return zlib.compress(raw, SESSION_COMPRESS_LEVEL), digest
+
+
+def decode_settings(user):
+    """Налаштування з запису User: стиснутий session_blob або старий текстовий session_data.
+
+    Повертає (settings, digest); digest - None для старого формату, щоб перший запис його перетворив.
+    """
+    if user.session_blob:
+        raw = zlib.decompress(user.session_blob)
+        return json.loads(raw), hashlib.sha256(raw).digest()
+    if user.session_data:
+        return json.loads(user.session_data), None
+    return None, None
+
+
+class SessionStore:
+    """Збереження сесій InstagramAPI: запис лише змінених, за первинним ключем, пакетом.
+
+    Клієнт пам'ятає User.id і хеш останньої збереженої сесії, тож незмінена сесія
+    не перезаписується, а запис не потребує пошуку User за telegram_id.
+    """
+
+    def __init__(self, session_factory=None):
+        self.session_factory = session_factory
+        self.writes = 0
+        self.skipped = 0
+        self.flushes = 0
+        self.bytes_written = 0
+
+    @staticmethod
+    def pending(api, last_active_at=None):
+        """Параметри UPDATE для клієнта або None, якщо записувати нічого."""
+        if not api.is_logged_in or api.user_pk is None:
+            return None
+        # Спершу лише хеш: незмінені сесії (більшість) не стискаються
+        raw, digest = canonical_settings(api.client.get_settings())
+        if digest == api.session_digest and last_active_at is None:
+            return None
+        blob = zlib.compress(raw, SESSION_COMPRESS_LEVEL)
+        values = {"id": api.user_pk, "session_blob": blob, "session_data": None}
+        if last_active_at is not None:
+            values["last_active_at"] = last_active_at
+        return values, digest
+
+    async def save(self, api, last_active_at=None):
+        """Збереження сесії одного клієнта. True, якщо сесія збережена (або не змінилась)."""
+        entry = self.pending(api, last_active_at)
+        if entry is None:
+            self.skipped += 1
+            return api.user_pk is not None
+        values, digest = entry
+        user_pk = values.pop("id")
+        async with session_scope(self.session_factory) as session:
+            await session.execute(update(User).where(User.id == user_pk).values(**values))
+        api.session_digest = digest
+        self.writes += 1
+        self.bytes_written += len(values["session_blob"])
+        return True
+
+    async def flush(self, clients):
+        """Записує змінені сесії клієнтів executemany UPDATE за первинним ключем.
+
+        clients - InstagramAPI або пари (InstagramAPI, last_active_at). UPDATE виконується
+        через Core, без перевірки кількості рядків: запис видаленого користувача
+        просто не оновлюється, а сесії решти клієнтів зберігаються.
+        """
+        batch = []
+        for item in clients:
+            api, last_active_at = item if isinstance(item, tuple) else (item, None)
+            entry = self.pending(api, last_active_at)
+            if entry is None:
+                self.skipped += 1
+            else:
+                batch.append((api, *entry))
+        if not batch:
+            return 0
+        # executemany потребує однакового набору колонок, тож рядки з last_active_at і без - окремо
+        groups = {}
+        for _, values, _ in batch:
+            groups.setdefault(tuple(sorted(values)), []).append(
+                {("user_pk" if key == "id" else key): value for key, value in values.items()})
+        matched = 0
+        async with session_scope(self.session_factory) as session:
+            for columns, params in groups.items():
+                statement = (update(User.__table__)
+                             .where(User.__table__.c.id == bindparam("user_pk"))
+                             .values({column: bindparam(column) for column in columns if column != "id"}))
+                result = await session.execute(statement, params)
+                matched += result.rowcount if result.rowcount >= 0 else len(params)
+        for api, values, digest in batch:
+            api.session_digest = digest
+            self.bytes_written += len(values["session_blob"])
+        self.writes += len(batch)
+        self.flushes += 1
+        if matched < len(batch):
+            logger.warning(f"Сесії Instagram: {len(batch) - matched} записів користувачів не знайдено (видалені?)")
+        logger.info(f"Збережено змінених сесій Instagram: {len(batch)}")
+        return len(batch)
+
+    def stats(self):
+        return {
+            "session_writes": self.writes,
+            "session_writes_skipped": self.skipped,
+            "session_flushes": self.flushes,
+            "session_bytes_written": self.bytes_written,
+        }
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE_TTL = int(os.environ.get("STATS_CACHE_TTL", "60"))  # секунди, дані вважаються свіжими
+STATS_CACHE_STALE_TTL = int(os.environ.get("STATS_CACHE_STALE_TTL", "600"))  # ще стільки віддаємо застарілі
+STATS_CACHE_MAX_ENTRIES = int(os.environ.get("STATS_CACHE_MAX_ENTRIES", "10000"))
+
+
+class StatsCache:
+    """Кеш статистики з TTL, stale-while-revalidate та об'єднанням одночасних запитів.
+
+    Одночасні запити за одним ключем чекають на один спільний виклик loader.
+    invalidate() відв'язує завантаження, що вже триває: його результат (можливо,
+    отриманий до публікації) не потрапляє в кеш, а наступний запит завантажує заново.
+    """
+
+    def __init__(self, ttl=STATS_CACHE_TTL, stale_ttl=STATS_CACHE_STALE_TTL, max_entries=STATS_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (fetched_at, value)
+        self._inflight = {}  # key -> Task
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.discarded = 0
+
+    async def get(self, key, loader):
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[0]
+            if age < self.ttl:
+                self.hits += 1
+                return entry[1]
+            if age < self.ttl + self.stale_ttl:
+                # Віддаємо застарілі дані одразу, оновлюємо у фоні
+                self.stale_hits += 1
+                self._refresh(key, loader)
+                return entry[1]
+        self.misses += 1
+        return await asyncio.shield(self._refresh(key, loader))
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        self._inflight.pop(key, None)  # Нове покоління: старе завантаження більше не зберігається
+
+    def _refresh(self, key, loader):
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+            return task
+        task = asyncio.get_running_loop().create_task(self._load(key, loader))
+        self._inflight[key] = task
+        task.add_done_callback(lambda t: self._on_done(key, t))
+        return task
+
+    async def _load(self, key, loader):
+        value = await loader()
+        if self._inflight.get(key) is not asyncio.current_task():
+            self.discarded += 1  # Ключ скинуто під час завантаження - значення могло застаріти
+            return value
+        if value is not None:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.monotonic(), value)
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        return value
+
+    def _on_done(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Не вдалося оновити статистику {key}: {task.exception()}")
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "discarded": self.discarded,
+        }
+
+
+stats_cache = StatsCache()
@@ -0,0 +1 @@
+"""Офлайн-бенчмарк обробників (python -m bench --help)."""
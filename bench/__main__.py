@@ -0,0 +1,258 @@
+"""Офлайн-бенчмарк обробників бота.
+
+Синтетичні оновлення проходять через справжні обробники з handlers.py та PTB Application;
+Application збирається тим самим main.build_application, що й у боті; Telegram, DeepSeek та
+instagrapi підмінені фейками із заданою затримкою, БД - тимчасовий файл SQLite на сценарій.
+Потрібен config.py (як і для бота), але жодних мережевих запитів і записів у робочу БД немає.
+Помилки обробників рахуються у звіті: результат з помилками не можна порівнювати з іншими.
+
+    python -m bench --scenario mixed --users 50 --flows 5
+    python -m bench --scenario all --rate 200 --tracemalloc --json result.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from telegram import Update
+
+import database
+import handlers
+import main as bot_main
+from api.admission import ai_admission
+from api.deepseek import DeepSeekClient
+from api.executor import instagrapi_executor
+from api.registry import InstagramClientRegistry, current_rss_bytes
+from media import MediaCache, media_pipeline
+from metrics import HANDLER_ERRORS
+from .fakes import FakeInstagrapiClient, FakeTelegramRequest, deepseek_transport
+from .scenarios import FLOWS, build_scenario
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(p / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class ErrorCounter(logging.Handler):
+    """Рахує записи логу рівня ERROR (обробники логують більшість помилок, а не кидають їх)."""
+
+    def __init__(self):
+        super().__init__(logging.ERROR)
+        self.count = 0
+        self.first = None
+
+    def emit(self, record):
+        self.count += 1
+        if self.first is None:
+            self.first = record.getMessage()[:200]
+
+
+def build_bench_application(args, registry, telegram_request):
+    """Application з main.build_application (ті самі обробники й обгортки), але з фейками."""
+    application = bot_main.build_application(request=telegram_request, concurrency=args.concurrency)
+    application.bot_data['db_sessionmaker'] = registry.session_factory
+    application.bot_data['instagram_api'] = registry
+    return application
+
+
+async def login_users(registry, user_ids, args):
+    """Залогінені акаунти з фейковим Client (вхід проходить справжнім InstagramAPI.login)."""
+    fake_clients = []
+
+    async def login(user_id):
+        api = await registry.get(user_id)
+        api.client = FakeInstagrapiClient(latency=0, jitter=0)
+        await api.login(f"bench{user_id}", "password")
+        api.client.latency, api.client.jitter = args.instagram_latency, args.instagram_jitter
+        if not args.keep_rate_limit:
+            limiter = instagrapi_executor.limiter(user_id)
+            limiter.rate = limiter.max_rate = limiter.burst = limiter.tokens = 1e9
+        fake_clients.append(api.client)
+
+    await asyncio.gather(*(login(user_id) for user_id in user_ids))
+    return fake_clients
+
+
+async def drive(application, updates, rate):
+    """Подає оновлення так само, як Application (послідовно або через update_processor).
+
+    Затримка оновлення - від моменту надходження (з урахуванням черги) до завершення обробників.
+    """
+    processor = application.update_processor
+    queue = asyncio.Queue()
+    latencies = []
+    pending = set()
+
+    async def process(update, arrived):
+        await processor.process_update(update, application.process_update(update))
+        latencies.append(time.perf_counter() - arrived)
+
+    async def consume():
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            if processor.max_concurrent_updates > 1:
+                task = asyncio.create_task(process(*item))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+            else:
+                await process(*item)
+
+    consumer = asyncio.create_task(consume())
+    started = time.perf_counter()
+    for index, data in enumerate(updates):
+        if rate:
+            delay = started + index / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        queue.put_nowait((Update.de_json(data, application.bot), time.perf_counter()))
+    queue.put_nowait(None)
+    await consumer
+    await asyncio.gather(*pending)
+    return latencies, time.perf_counter() - started
+
+
+async def run_scenario(name, args, workdir):
+    # Файл, а не :memory: - у пам'яті всі сесії ділять одне з'єднання і конфліктують між собою
+    engine = database.make_engine(f"sqlite+aiosqlite:///{os.path.join(workdir, f'bench_{name}.db')}")
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    database.AsyncSessionLocal = session_factory  # session_scope() без фабрики -> БД бенчмарку
+    await database.init_db(engine)
+
+    registry = InstagramClientRegistry(session_factory, max_size=args.users * 2, idle_ttl=3600)
+    telegram_request = FakeTelegramRequest(latency=args.telegram_latency, jitter=args.telegram_jitter)
+    application = build_bench_application(args, registry, telegram_request)
+    user_ids = list(range(100000, 100000 + args.users))
+    updates = build_scenario(name, args.users, args.flows, seed=args.seed, photo_reuse=args.photo_reuse)
+
+    await application.initialize()
+    fake_clients = await login_users(registry, user_ids, args)
+    await application.start()
+
+    errors = ErrorCounter()
+    logging.getLogger().addHandler(errors)
+    handler_errors_before = HANDLER_ERRORS.total()
+    rss_before = current_rss_bytes()
+    if args.tracemalloc:
+        tracemalloc.start()
+    started = time.perf_counter()
+    latencies, process_time = await drive(application, updates, args.rate)
+    await application.stop()  # Чекає фонові задачі (відповіді AI)
+    total_time = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    if args.tracemalloc:
+        tracemalloc.stop()
+    rss_after = current_rss_bytes()
+    handler_errors = HANDLER_ERRORS.total() - handler_errors_before
+
+    await application.shutdown()
+    await registry.stop()
+    await engine.dispose()
+    logging.getLogger().removeHandler(errors)
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "updates": len(updates),
+        "users": args.users,
+        "seconds": round(process_time, 3),
+        "with_background_seconds": round(total_time, 3),
+        "updates_per_second": round(len(updates) / process_time, 1) if process_time else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 1) if latencies else 0.0,
+        "rss_delta_mb": round((rss_after - rss_before) / 2 ** 20, 1),
+        "tracemalloc_peak_mb": round(peak / 2 ** 20, 1) if peak is not None else None,
+        "telegram_calls": sum(telegram_request.calls.values()),
+        "instagrapi_calls": sum(client.calls for client in fake_clients),
+        "handler_errors": handler_errors,
+        "logged_errors": errors.count,
+        "first_error": errors.first,
+    }
+
+
+def print_report(results):
+    columns = ["scenario", "updates", "seconds", "with_background_seconds", "updates_per_second",
+               "p50_ms", "p95_ms", "p99_ms", "max_ms", "rss_delta_mb", "tracemalloc_peak_mb", "telegram_calls", "instagrapi_calls",
+               "handler_errors", "logged_errors"]
+    widths = [max(len(column), *(len(str(result[column])) for result in results)) for column in columns]
+    print("  ".join(column.ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        print("  ".join(str(result[column]).ljust(width) for column, width in zip(columns, widths)))
+    for result in results:
+        if result["handler_errors"] or result["logged_errors"]:
+            print(f"⚠ {result['scenario']}: помилки під час прогону ({result['handler_errors']} в обробниках, "
+                  f"{result['logged_errors']} у логах; перша: {result['first_error']}) - "
+                  f"результати не відображають швидкість успішної обробки")
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Офлайн-бенчмарк обробників бота")
+    parser.add_argument("--scenario", default="mixed", choices=[*FLOWS, "all"])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--flows", type=int, default=5, help="сценаріїв (діалогів) на користувача")
+    parser.add_argument("--rate", type=float, default=0, help="оновлень/с (0 - усі одразу)")
+    parser.add_argument("--concurrency", type=int, default=16, help="1 - послідовна обробка, як у PTB за замовчуванням")
+    parser.add_argument("--telegram-latency", type=float, default=0.03)
+    parser.add_argument("--telegram-jitter", type=float, default=0.01)
+    parser.add_argument("--deepseek-latency", type=float, default=0.8)
+    parser.add_argument("--deepseek-jitter", type=float, default=0.2)
+    parser.add_argument("--instagram-latency", type=float, default=0.5)
+    parser.add_argument("--instagram-jitter", type=float, default=0.1)
+    parser.add_argument("--keep-rate-limit", action="store_true", help="не вимикати обмеження швидкості instagrapi та AI")
+    parser.add_argument("--photo-reuse", type=float, default=0.0, help="частка повторно надісланих фото")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tracemalloc", action="store_true", help="пікова пам'ять Python-алокацій (повільніше)")
+    parser.add_argument("--json", help="зберегти результати у файл")
+    return parser.parse_args()
+
+
+async def run(args):
+    with tempfile.TemporaryDirectory(prefix="tgbot_bench_") as workdir:
+        media_pipeline.spool_dir = os.path.join(workdir, "spool")
+        os.makedirs(media_pipeline.spool_dir)
+        media_pipeline.cache = MediaCache(directory=os.path.join(workdir, "cache"))
+        handlers.deepseek_client = DeepSeekClient(
+            "http://deepseek.bench/v1/chat/completions", "bench",
+            transport=deepseek_transport(args.deepseek_latency, args.deepseek_jitter))
+        handlers.response_cache.persist = False
+        if not args.keep_rate_limit:
+            bucket = ai_admission.bucket
+            bucket.rate = bucket.max_rate = bucket.burst = bucket.tokens = 1e9
+
+        names = list(FLOWS) if args.scenario == "all" else [args.scenario]
+        results = []
+        try:
+            for name in names:
+                results.append(await run_scenario(name, args, workdir))
+        finally:
+            await handlers.deepseek_client.aclose()
+            instagrapi_executor.shutdown()
+            media_pipeline.shutdown()
+    return results
+
+
+def main():
+    logging.disable(logging.INFO)  # Логи обробників спотворюють вимірювання
+    args = parse_args()
+    results = asyncio.run(run(args))
+    print_report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
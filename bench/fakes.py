@@ -0,0 +1,150 @@
+"""Фейкові бекенди для бенчмарку: Telegram Bot API, DeepSeek та instagrapi Client (без мережі)."""
+import asyncio
+import io
+import itertools
+import json
+import random
+import time
+from types import SimpleNamespace
+
+import httpx
+from PIL import Image
+from telegram.request import BaseRequest
+
+
+def _delay(latency, jitter):
+    return max(0.0, latency + random.uniform(-jitter, jitter))
+
+
+def make_jpeg(width=1280, height=960, seed=0):
+    """Синтетичне фото (шум, щоб JPEG-кодування мало реальну вартість)."""
+    rng = random.Random(seed)
+    img = Image.frombytes("RGB", (width // 8, height // 8), bytes(rng.getrandbits(8) for _ in range(width * height * 3 // 64)))
+    buffer = io.BytesIO()
+    img.resize((width, height)).save(buffer, "JPEG", quality=90)
+    return buffer.getvalue()
+
+
+class FakeTelegramRequest(BaseRequest):
+    """Відповідає на виклики Bot API локально із заданою затримкою та рахує їх."""
+
+    def __init__(self, latency=0.03, jitter=0.01, photo_bytes=None):
+        self.latency = latency
+        self.jitter = jitter
+        self.photo_bytes = photo_bytes or make_jpeg()
+        self.calls = {}
+        self._message_ids = itertools.count(1000)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        await asyncio.sleep(_delay(self.latency, self.jitter))
+        if "/file/bot" in url:
+            # Хвіст після кінця JPEG ігнорується декодером, але робить вміст (і хеш у кеші медіа) унікальним
+            return 200, self.photo_bytes + url.encode()
+
+        endpoint = url.rsplit("/", 1)[-1]
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+        params = request_data.parameters if request_data is not None else {}
+        return 200, json.dumps({"ok": True, "result": self._result(endpoint, params)}).encode()
+
+    def _result(self, endpoint, params):
+        if endpoint == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot",
+                    "can_join_groups": True, "can_read_all_group_messages": False,
+                    "supports_inline_queries": False}
+        if endpoint == "getFile":
+            return {"file_id": params.get("file_id"), "file_unique_id": f"u{params.get('file_id')}",
+                    "file_size": len(self.photo_bytes), "file_path": f"photos/{params.get('file_id')}.jpg"}
+        if endpoint in ("sendMessage", "editMessageText"):
+            chat_id = params.get("chat_id", 0)
+            return {"message_id": params.get("message_id") or next(self._message_ids), "date": int(time.time()),
+                    "chat": {"id": chat_id, "type": "private"}, "text": params.get("text", "")}
+        return True
+
+
+def deepseek_transport(latency=0.8, jitter=0.2):
+    """httpx.MockTransport з відповіддю chat/completions (звичайною та SSE-потоком)."""
+
+    async def handler(request):
+        await asyncio.sleep(_delay(latency, jitter))
+        payload = json.loads(request.content)
+        answer = f"Відповідь на: {payload['messages'][-1]['content'][:50]}"
+        if payload.get("stream"):
+            lines = [f"data: {json.dumps({'choices': [{'delta': {'content': word + ' '}}]})}\n\n"
+                     for word in answer.split()]
+            return httpx.Response(200, content="".join(lines + ["data: [DONE]\n\n"]).encode(),
+                                  headers={"Content-Type": "text/event-stream"})
+        return httpx.Response(200, json={"choices": [{"message": {"content": answer}}]})
+
+    return httpx.MockTransport(handler)
+
+
+class FakeInstagrapiClient:
+    """Замінник instagrapi.Client: синхронні методи з затримкою (виконуються в пулі потоків)."""
+
+    def __init__(self, latency=0.5, jitter=0.1, media_count=60):
+        self.latency = latency
+        self.jitter = jitter
+        self.media_count = media_count
+        self.user_id = None
+        self.calls = 0
+
+    def _wait(self):
+        self.calls += 1
+        time.sleep(_delay(self.latency, self.jitter))
+
+    def set_proxy(self, proxy):
+        pass
+
+    def login(self, username, password):
+        self._wait()
+        self.user_id = abs(hash(username)) % 10 ** 10
+        return True
+
+    def get_settings(self):
+        return {"authorization_data": {"ds_user_id": str(self.user_id)}}
+
+    def set_settings(self, settings):
+        self.user_id = settings.get("authorization_data", {}).get("ds_user_id")
+        return True
+
+    def logout(self):
+        self._wait()
+        return True
+
+    def user_id_from_username(self, username):
+        self._wait()
+        return self.user_id
+
+    def user_info(self, user_id):
+        self._wait()
+        return SimpleNamespace(follower_count=1000, following_count=100, media_count=self.media_count)
+
+    def user_medias_paginated(self, user_id, amount=0, end_cursor=""):
+        self._wait()
+        start = int(end_cursor or 0)
+        end = min(start + (amount or 20), self.media_count)
+        medias = [SimpleNamespace(pk=f"{user_id}_{i}", taken_at=None, like_count=i, comment_count=i // 3,
+                                  view_count=0, play_count=0) for i in range(start, end)]
+        return medias, str(end) if end < self.media_count else ""
+
+    def user_medias(self, user_id, amount=0):
+        return self.user_medias_paginated(user_id, amount)[0]
+
+    def photo_upload(self, path, caption=""):
+        self._wait()
+        return SimpleNamespace(pk="1")
+
+    def album_upload(self, paths, caption=""):
+        self._wait()
+        return SimpleNamespace(pk="1")
+
+    def photo_upload_to_story(self, path, caption=""):
+        self._wait()
+        return SimpleNamespace(pk="1")
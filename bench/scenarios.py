@@ -0,0 +1,109 @@
+"""Генерація синтетичних потоків оновлень Telegram (JSON, як їх надсилає Bot API)."""
+import itertools
+import random
+import time
+
+
+class UpdateFactory:
+    def __init__(self, seed=0, photo_reuse=0.0):
+        self.rng = random.Random(seed)
+        self.photo_reuse = photo_reuse  # Частка фото, що надсилаються повторно (перевірка кешу медіа)
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._photo_ids = itertools.count(1)
+        self._media_groups = itertools.count(1)
+        self._sent_photos = []
+
+    @staticmethod
+    def _user(user_id):
+        return {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"}
+
+    def _message(self, user_id, **fields):
+        return dict({"message_id": next(self._message_ids), "date": int(time.time()),
+                     "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id)}, **fields)
+
+    def text(self, user_id, text):
+        message = self._message(user_id, text=text)
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def callback(self, user_id, data):
+        return {"update_id": next(self._update_ids), "callback_query": {
+            "id": str(next(self._update_ids)), "from": self._user(user_id), "chat_instance": str(user_id),
+            "data": data, "message": self._message(1, text="menu")}}
+
+    def photo(self, user_id, media_group_id=None):
+        if self._sent_photos and self.rng.random() < self.photo_reuse:
+            unique_id = self.rng.choice(self._sent_photos)
+        else:
+            unique_id = f"photo{next(self._photo_ids)}"
+            self._sent_photos.append(unique_id)
+        sizes = [{"file_id": f"{unique_id}_{w}", "file_unique_id": f"{unique_id}_{w}", "width": w,
+                  "height": w * 3 // 4, "file_size": w * 300} for w in (320, 1280)]
+        message = self._message(user_id, photo=sizes)
+        if media_group_id is not None:
+            message["media_group_id"] = media_group_id
+        return {"update_id": next(self._update_ids), "message": message}
+
+    def media_group_id(self):
+        return str(next(self._media_groups))
+
+
+# --- Сценарії одного користувача: список оновлень у порядку надсилання ---
+
+def flow_commands(factory, user_id):
+    return [factory.text(user_id, factory.rng.choice(["/start", "/help"]))]
+
+
+def flow_buttons(factory, user_id):
+    return [factory.callback(user_id, factory.rng.choice(["get_stats", "help"]))]
+
+
+def flow_ai_text(factory, user_id):
+    return [factory.text(user_id, f"Порадь ідею для поста про {factory.rng.choice(['каву', 'море', 'гори'])} "
+                                  f"#{factory.rng.randrange(10 ** 6)}")]
+
+
+def flow_post_photo(factory, user_id):
+    return [factory.callback(user_id, "post_photo"), factory.photo(user_id), factory.text(user_id, "Опис фото")]
+
+
+def flow_post_story(factory, user_id):
+    return [factory.callback(user_id, "post_story"), factory.photo(user_id)]
+
+
+def flow_album(factory, user_id):
+    group = factory.media_group_id()
+    photos = [factory.photo(user_id, group) for _ in range(factory.rng.randint(2, 5))]
+    return [factory.callback(user_id, "post_album"), *photos, factory.text(user_id, "готово"),
+            factory.text(user_id, "Опис альбому")]
+
+
+FLOWS = {
+    "commands": [flow_commands],
+    "buttons": [flow_buttons],
+    "ai_text": [flow_ai_text],
+    "photos": [flow_post_photo, flow_post_story],
+    "album": [flow_album],
+    "mixed": [flow_commands, flow_buttons, flow_ai_text, flow_ai_text, flow_post_photo, flow_post_story, flow_album],
+}
+
+
+def build_scenario(name, users, flows_per_user, seed=0, photo_reuse=0.0, first_user_id=100000):
+    """Оновлення всіх користувачів, перемішані між собою зі збереженням порядку кожного користувача."""
+    factory = UpdateFactory(seed, photo_reuse)
+    queues = {}
+    for user_id in range(first_user_id, first_user_id + users):
+        updates = []
+        for _ in range(flows_per_user):
+            updates.extend(factory.rng.choice(FLOWS[name])(factory, user_id))
+        queues[user_id] = updates[::-1]
+
+    stream = []
+    while queues:
+        user_id = factory.rng.choice(list(queues))
+        stream.append(queues[user_id].pop())
+        if not queues[user_id]:
+            del queues[user_id]
+    return stream
@@ -0,0 +1,2 @@
+from .state import ConversationState, State
+from .store import ConversationStore, conversation_store
@@ -0,0 +1,37 @@
+import time
+from dataclasses import dataclass, field
+from enum import Enum
+
+
+class State(str, Enum):
+    """Крок діалогу користувача з ботом."""
+
+    WAITING_FOR_PHOTO = "waiting_for_photo"
+    WAITING_FOR_CAPTION = "waiting_for_caption"
+    WAITING_FOR_STORY_PHOTO = "waiting_for_story_photo"
+    WAITING_FOR_STORY_CAPTION = "waiting_for_story_caption"
+    WAITING_FOR_ALBUM_PHOTOS = "waiting_for_album_photos"
+    WAITING_FOR_ALBUM_CAPTION = "waiting_for_album_caption"
+    WAITING_FOR_2FA_CODE = "waiting_for_2fa_code"
+    WAITING_FOR_IMPORT_FILE = "waiting_for_import_file"
+
+
+@dataclass(slots=True)
+class ConversationState:
+    """Стан діалогу одного користувача."""
+
+    state: State
+    media_paths: list = field(default_factory=list)  # Підготовлені файли, які треба звільнити
+    album_photos: list = field(default_factory=list)  # PhotoSize.to_dict() фото альбому
+    created_at: float = field(default_factory=time.time)
+    updated_at: float = field(default_factory=time.time)
+
+    def to_dict(self):
+        return {"media_paths": self.media_paths, "album_photos": self.album_photos,
+                "created_at": self.created_at}
+
+    @classmethod
+    def from_dict(cls, state, data, updated_at):
+        return cls(State(state), media_paths=data.get("media_paths", []),
+                   album_photos=data.get("album_photos", []),
+                   created_at=data.get("created_at", updated_at), updated_at=updated_at)
@@ -0,0 +1,213 @@
+import asyncio
+import datetime
+import json
+import logging
+import os
+import time
+
+from sqlalchemy import delete, select
+
+from database import session_scope
+from database.crud import shard_filter
+from database.models import SavedConversation
+from media import media_pipeline
+from .state import ConversationState, State
+
+logger = logging.getLogger(__name__)
+
+CONVERSATION_IDLE_TTL = int(os.environ.get("CONVERSATION_IDLE_TTL", "1800"))  # секунди без дій
+CONVERSATION_FLUSH_INTERVAL = float(os.environ.get("CONVERSATION_FLUSH_INTERVAL", "5"))
+CONVERSATION_SWEEP_INTERVAL = int(os.environ.get("CONVERSATION_SWEEP_INTERVAL", "60"))
+CONVERSATION_PERSIST = os.environ.get("CONVERSATION_PERSIST", "1") == "1"
+
+# Стани, що не переживають рестарт: вхід з 2FA тримається лише в Client у пам'яті
+MEMORY_ONLY_STATES = frozenset({State.WAITING_FOR_2FA_CODE})
+
+
+def release_media(record):
+    """Звільняє підготовлені файли покинутого діалогу."""
+    for path in record.media_paths:
+        media_pipeline.release(path)
+
+
+def restore_media(record):
+    """Після рестарту діалог відновлюється, лише якщо всі його файли ще на місці."""
+    if not all(os.path.exists(path) for path in record.media_paths):
+        release_media(record)
+        return False
+    for path in record.media_paths:
+        media_pipeline.retain(path)
+    return True
+
+
+class ConversationStore:
+    """Стани діалогів у пам'яті з витісненням неактивних та відкладеним записом у БД.
+
+    Зміни позначаються «брудними» і записуються пачкою раз на flush_interval, тож
+    повідомлення користувача не чекають на БД. Для простроченого стану викликається
+    on_expire (звільнення тимчасових файлів).
+    """
+
+    def __init__(self, session_factory=None, idle_ttl=CONVERSATION_IDLE_TTL,
+                 flush_interval=CONVERSATION_FLUSH_INTERVAL, sweep_interval=CONVERSATION_SWEEP_INTERVAL,
+                 persist=CONVERSATION_PERSIST, on_expire=release_media):
+        self.session_factory = session_factory
+        self.idle_ttl = idle_ttl
+        self.flush_interval = flush_interval
+        self.sweep_interval = sweep_interval
+        self.persist = persist
+        self.on_expire = on_expire
+        self.shard = None  # (номер, кількість): у шардованому режимі відновлюються лише свої діалоги
+        self._states = {}  # telegram_id -> ConversationState
+        self._dirty = set()
+        self._task = None
+        self.expired = 0
+        self.flushes = 0
+
+    def get(self, user_id):
+        """Поточний стан користувача або None (прострочений стан очищається)."""
+        record = self._states.get(user_id)
+        if record is not None and time.time() - record.updated_at > self.idle_ttl:
+            self._expire(user_id)
+            return None
+        return record
+
+    def state_of(self, user_id):
+        record = self.get(user_id)
+        return record.state if record is not None else None
+
+    def begin(self, user_id, state, **fields):
+        """Починає новий діалог; попередній незавершений скидається разом з його файлами."""
+        previous = self.clear(user_id)
+        if previous is not None and previous.media_paths and self.on_expire is not None:
+            self.on_expire(previous)
+        return self.set(user_id, state, **fields)
+
+    def set(self, user_id, state, **fields):
+        """Переводить користувача в новий крок; інші поля запису зберігаються, якщо не передані."""
+        record = self._states.get(user_id)
+        if record is None:
+            record = self._states[user_id] = ConversationState(State(state))
+        record.state = State(state)
+        for name, value in fields.items():
+            setattr(record, name, value)
+        self.touch(user_id)
+        return record
+
+    def touch(self, user_id):
+        """Позначає запис зміненим (після зміни його списків на місці)."""
+        record = self._states.get(user_id)
+        if record is not None:
+            record.updated_at = time.time()
+            self._dirty.add(user_id)
+
+    def clear(self, user_id):
+        """Завершує діалог. Повертає запис, щоб викликач сам звільнив його файли."""
+        record = self._states.pop(user_id, None)
+        if record is not None:
+            self._dirty.add(user_id)
+        return record
+
+    def _expire(self, user_id):
+        record = self.clear(user_id)
+        if record is None:
+            return
+        self.expired += 1
+        logger.info(f"Стан діалогу користувача {user_id} ({record.state.value}) прострочено")
+        if self.on_expire is not None:
+            try:
+                self.on_expire(record)
+            except Exception as e:
+                logger.error(f"Помилка очищення стану користувача {user_id}: {e}")
+
+    def sweep(self):
+        deadline = time.time() - self.idle_ttl
+        for user_id in [uid for uid, record in self._states.items() if record.updated_at < deadline]:
+            self._expire(user_id)
+
+    # --- Збереження в БД ---
+
+    async def load(self, restore=restore_media):
+        """Відновлює стани після рестарту. restore(record) -> False відкидає запис."""
+        if not self.persist:
+            return
+        async with session_scope(self.session_factory) as session:
+            query = select(SavedConversation)
+            if self.shard is not None:
+                query = query.where(shard_filter(SavedConversation.telegram_id, self.shard))
+            rows = (await session.execute(query)).scalars().all()
+        for row in rows:
+            if row.state in {state.value for state in MEMORY_ONLY_STATES}:
+                self._dirty.add(row.telegram_id)  # Збережений старішою версією - видаляємо
+                continue
+            try:
+                record = ConversationState.from_dict(
+                    row.state, json.loads(row.data or "{}"),
+                    row.updated_at.replace(tzinfo=datetime.timezone.utc).timestamp())
+            except (ValueError, TypeError) as e:
+                logger.warning(f"Пошкоджений стан діалогу {row.telegram_id}: {e}")
+                self._dirty.add(row.telegram_id)
+                continue
+            self._states[row.telegram_id] = record
+            if restore is not None and restore(record) is False:
+                self._states.pop(row.telegram_id)
+                self._dirty.add(row.telegram_id)
+        self.sweep()
+        logger.info(f"Відновлено {len(self._states)} станів діалогів")
+
+    async def flush(self):
+        if not self.persist or not self._dirty:
+            self._dirty.clear()
+            return
+        dirty, self._dirty = self._dirty, set()
+        upserts = []
+        removed = []
+        for user_id in dirty:
+            record = self._states.get(user_id)
+            if record is None or record.state in MEMORY_ONLY_STATES:
+                removed.append(user_id)
+            else:
+                upserts.append(SavedConversation(
+                    telegram_id=user_id, state=record.state.value, data=json.dumps(record.to_dict()),
+                    updated_at=datetime.datetime.utcfromtimestamp(record.updated_at)))
+        try:
+            async with session_scope(self.session_factory) as session:
+                if removed:
+                    await session.execute(delete(SavedConversation).where(SavedConversation.telegram_id.in_(removed)))
+                for row in upserts:
+                    await session.merge(row)
+            self.flushes += 1
+        except Exception as e:
+            logger.error(f"Помилка збереження станів діалогів: {e}")
+            self._dirty |= dirty  # Спробуємо наступного разу
+
+    async def _run(self):
+        last_sweep = time.monotonic()
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if time.monotonic() - last_sweep >= self.sweep_interval:
+                self.sweep()
+                last_sweep = time.monotonic()
+            await self.flush()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        return {
+            "active": len(self._states),
+            "dirty": len(self._dirty),
+            "expired": self.expired,
+            "flushes": self.flushes,
+        }
+
+
+conversation_store = ConversationStore()
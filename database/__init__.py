@@ -1,6 +1,112 @@
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+import logging
+import os
+import time
+from contextlib import asynccontextmanager
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from config import DATABASE_URL
+from metrics import EXTERNAL_ERRORS, EXTERNAL_IN_FLIGHT, EXTERNAL_LATENCY
+
+logger = logging.getLogger(__name__)
+
+# Розмір пулу з'єднань (можна перевизначити через змінні середовища)
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.environ.get("DB_POOL_TIMEOUT", "30"))
+
+# Відповідність синхронних драйверів асинхронним
+_ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def to_async_url(url):
+    """Перетворює DATABASE_URL на URL з асинхронним драйвером (sqlite:// -> sqlite+aiosqlite://)."""
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme or scheme not in _ASYNC_DRIVERS:
+        return url
+    return f"{_ASYNC_DRIVERS[scheme]}{sep}{rest}"
+
+
+def make_engine(url):
+    url = to_async_url(url)
+    kwargs = {"pool_pre_ping": True}
+    # In-memory SQLite використовує StaticPool, параметри пулу для нього не підходять
+    if not (url.startswith("sqlite") and (":memory:" in url or url.endswith("://"))):
+        kwargs.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    db_engine = create_async_engine(url, **kwargs)
+    instrument_engine(db_engine)
+    return db_engine
+
+
+def _operation(statement):
+    return statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "OTHER"
+
+
+def instrument_engine(db_engine):
+    """Метрики запитів до БД (час, помилки, кількість одночасних) через події SQLAlchemy.
+
+    Помилка в метриках лише логується - вона не повинна переривати сам запит.
+    """
+    sync_engine = db_engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        try:
+            conn.info.setdefault("query_started", []).append(time.perf_counter())
+            EXTERNAL_IN_FLIGHT.inc(service="db")
+        except Exception as e:
+            logger.warning(f"Метрики БД (before_cursor_execute): {e}")
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        try:
+            started = conn.info.get("query_started")
+            if not started:
+                return  # Запит почався до підключення слухачів або на іншому з'єднанні
+            EXTERNAL_LATENCY.observe(time.perf_counter() - started.pop(), service="db",
+                                     operation=_operation(statement))
+            EXTERNAL_IN_FLIGHT.dec(service="db")
+        except Exception as e:
+            logger.warning(f"Метрики БД (after_cursor_execute): {e}")
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        try:
+            started = context.connection.info.get("query_started") if context.connection is not None else None
+            if started:
+                started.pop()
+                EXTERNAL_IN_FLIGHT.dec(service="db")
+            EXTERNAL_ERRORS.inc(service="db", operation=_operation(context.statement or ""))
+        except Exception as e:
+            logger.warning(f"Метрики БД (handle_error): {e}")
+
+
+engine = make_engine(DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+@asynccontextmanager
+async def session_scope(session_factory=None):
+    """Коротка сесія на одну операцію: commit при успіху, rollback при помилці."""
+    async with (session_factory or AsyncSessionLocal)() as session:
+        try:
+            yield session
+            await session.commit()
+        except Exception:
+            await session.rollback()
+            raise
+
+
+async def init_db(db_engine=None):
+    """Створює відсутні таблиці та застосовує міграції колонок."""
+    from database.migrations import run_migrations
+    from database.models import Base
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    async with (db_engine or engine).begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        await run_migrations(conn)
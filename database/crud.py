@@ -1,25 +1,71 @@
 # database/crud.py
-from sqlalchemy.orm import Session
+import datetime
+
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 from database.models import User
 from database.models import ScheduledPost
+from database.models import AccountStats, MediaSnapshot
+from database.models import ShardLease
 # Імпортуємо ScheduledPost
 
+# Підписники на нові заплановані пости (планувальник прокидається одразу)
+_scheduled_post_listeners = []
+
+
+def add_scheduled_post_listener(callback):
+    """callback(post_id, scheduled_time, user_id) викликається після додавання поста."""
+    _scheduled_post_listeners.append(callback)
+
+
+def remove_scheduled_post_listener(callback):
+    if callback in _scheduled_post_listeners:
+        _scheduled_post_listeners.remove(callback)
+
+
+def notify_scheduled_post(post_id, scheduled_time, user_id):
+    for callback in list(_scheduled_post_listeners):
+        callback(post_id, scheduled_time, user_id)
+
+
+async def get_user(session: AsyncSession, telegram_id: int):
+    result = await session.execute(select(User).filter_by(telegram_id=telegram_id))
+    return result.scalars().first()
+
 
-def get_or_create_user(session: Session, telegram_id: int, username: str):
-    user = session.query(User).filter_by(telegram_id=telegram_id).first()
+def shard_filter(telegram_id_column, shard):
+    """Умова «користувач належить шарду» для shard = (номер шарду, кількість шардів)."""
+    index, count = shard
+    return telegram_id_column % count == index
+
+
+async def get_recently_active_users(session: AsyncSession, limit: int, shard=None):
+    """Користувачі зі збереженою сесією Instagram, від нещодавно активних."""
+    query = (
+        select(User)
+        .where(or_(User.session_blob.is_not(None), User.session_data.is_not(None)))
+        .order_by(User.last_active_at.desc().nulls_last())
+        .limit(limit)
+    )
+    if shard is not None:
+        query = query.where(shard_filter(User.telegram_id, shard))
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def get_or_create_user(session: AsyncSession, telegram_id: int, username: str):
+    user = await get_user(session, telegram_id)
     if not user:
         user = User(telegram_id=telegram_id, username=username)  # Виправляємо
         session.add(user)
-        session.commit()
-        session.refresh(user)  # Оновлюємо об'єкт user, щоб отримати id
+        await session.commit()
+        await session.refresh(user)  # Оновлюємо об'єкт user, щоб отримати id
     return user
 
 
-def get_scheduled_posts(db_session: Session):
-    return db_session.query(ScheduledPost).filter(ScheduledPost.posted == False).all()
-
-
-def add_scheduled_post(session: Session, user_id: int, image_path: str, caption: str, scheduled_time):
+async def add_scheduled_post(session: AsyncSession, user_id: int, image_path: str, caption: str, scheduled_time):
     post = ScheduledPost(
         user_id=user_id,
         image_path=image_path,
@@ -27,6 +73,94 @@ def add_scheduled_post(session: Session, user_id: int, image_path: str, caption:
         scheduled_time=scheduled_time
     )
     session.add(post)
-    session.commit()
-    session.refresh(post)  # Оновлюємо об'єкт post, щоб згенерувати id
+    await session.commit()
+    await session.refresh(post)  # Оновлюємо об'єкт post, щоб згенерувати id
+    notify_scheduled_post(post.id, post.scheduled_time, post.user_id)
     return post
+
+
+async def add_scheduled_posts(session: AsyncSession, user_id: int, posts):
+    """Пакетне додавання постів: один INSERT ... RETURNING (executemany) і один commit на пакет.
+
+    posts - список dict з image_path, caption, scheduled_time. Повертає [(id, scheduled_time)].
+    """
+    if not posts:
+        return []
+    result = await session.execute(
+        insert(ScheduledPost).returning(ScheduledPost.id, ScheduledPost.scheduled_time),
+        [dict(post, user_id=user_id) for post in posts],
+    )
+    created = [tuple(row) for row in result]
+    await session.commit()
+    for post_id, scheduled_time in created:
+        notify_scheduled_post(post_id, scheduled_time, user_id)
+    return created
+
+
+async def get_due_posts(session: AsyncSession, until, post_ids=None, shard=None):
+    """Неопубліковані пости з часом публікації до until (використовує індекс posted+scheduled_time).
+
+    shard - лише пости користувачів цього шарду.
+    """
+    query = (
+        select(ScheduledPost)
+        .options(selectinload(ScheduledPost.user))
+        .filter(ScheduledPost.posted == False, ScheduledPost.failed == False,
+                ScheduledPost.scheduled_time <= until)
+        .order_by(ScheduledPost.scheduled_time)
+    )
+    if post_ids is not None:
+        query = query.filter(ScheduledPost.id.in_(list(post_ids)))
+    if shard is not None:
+        query = query.join(ScheduledPost.user).filter(shard_filter(User.telegram_id, shard))
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def get_account_stats(session: AsyncSession, user_id: int):
+    return await session.get(AccountStats, user_id)
+
+
+async def get_media_snapshots(session: AsyncSession, user_id: int, media_pks):
+    """Повертає словник media_pk -> MediaSnapshot для вказаних медіа."""
+    if not media_pks:
+        return {}
+    result = await session.execute(
+        select(MediaSnapshot).filter(MediaSnapshot.user_id == user_id, MediaSnapshot.media_pk.in_(list(media_pks)))
+    )
+    return {snapshot.media_pk: snapshot for snapshot in result.scalars()}
+
+
+async def get_media_snapshots_after(session: AsyncSession, user_id: int, taken_after=None):
+    """Збережені медіа, опубліковані пізніше за taken_after (усі, якщо None)."""
+    query = select(MediaSnapshot).filter(MediaSnapshot.user_id == user_id)
+    if taken_after is not None:
+        query = query.filter(MediaSnapshot.taken_at > taken_after)
+    result = await session.execute(query)
+    return result.scalars().all()
+
+
+async def acquire_shard_lease(session: AsyncSession, shard_id: int, owner: str, ttl: int):
+    """Бере або продовжує оренду шарду. False - шард зайнятий іншим процесом, термін ще не минув."""
+    now = datetime.datetime.utcnow()
+    expires_at = now + datetime.timedelta(seconds=ttl)
+    result = await session.execute(
+        update(ShardLease)
+        .where(ShardLease.shard_id == shard_id, or_(ShardLease.owner == owner, ShardLease.expires_at < now))
+        .values(owner=owner, expires_at=expires_at)
+    )
+    if result.rowcount:
+        return True
+    if await session.get(ShardLease, shard_id) is not None:
+        return False
+    session.add(ShardLease(shard_id=shard_id, owner=owner, expires_at=expires_at))
+    try:
+        await session.flush()
+    except IntegrityError:  # Інший процес створив запис одночасно з нами
+        await session.rollback()
+        return False
+    return True
+
+
+async def release_shard_lease(session: AsyncSession, shard_id: int, owner: str):
+    await session.execute(delete(ShardLease).where(ShardLease.shard_id == shard_id, ShardLease.owner == owner))
@@ -0,0 +1,84 @@
+import logging
+
+from sqlalchemy import DateTime, LargeBinary, inspect, text
+
+logger = logging.getLogger(__name__)
+
+# Колонки, додані до вже існуючих таблиць: (таблиця, колонка, DDL-тип або тип SQLAlchemy).
+# create_all створює лише нові таблиці, тому старі БД доповнюються тут при старті.
+# Тип SQLAlchemy компілюється під діалект БД (BLOB у SQLite, BYTEA у PostgreSQL).
+COLUMN_MIGRATIONS = [
+    ("users", "instagram_user_id", "VARCHAR"),
+    ("users", "last_active_at", DateTime()),
+    ("users", "session_blob", LargeBinary()),
+    # Початкова схема scheduled_posts: chat_id, message_text, photo_path (див. _backfill_legacy_posts)
+    ("scheduled_posts", "user_id", "INTEGER REFERENCES users(id)"),
+    ("scheduled_posts", "caption", "VARCHAR"),
+    ("scheduled_posts", "image_path", "VARCHAR"),
+    ("scheduled_posts", "posted", "BOOLEAN DEFAULT FALSE"),
+    ("scheduled_posts", "attempts", "INTEGER DEFAULT 0"),
+    ("scheduled_posts", "last_error", "VARCHAR"),
+    ("scheduled_posts", "failed", "BOOLEAN DEFAULT FALSE"),
+]
+
+
+def _apply_column_migrations(sync_conn):
+    """Додає відсутні колонки. Повертає множину доданих (таблиця, колонка)."""
+    inspector = inspect(sync_conn)
+    tables = set(inspector.get_table_names())
+    added = set()
+    for table, column, ddl in COLUMN_MIGRATIONS:
+        if table not in tables:
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table)}
+        if column not in existing:
+            if not isinstance(ddl, str):
+                ddl = ddl.compile(dialect=sync_conn.dialect)
+            sync_conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+            added.add((table, column))
+            logger.info(f"Міграція: додано колонку {table}.{column}")
+    return added
+
+
+def _backfill_legacy_posts(sync_conn):
+    """Пости старої схеми: message_text -> caption, photo_path -> image_path, chat_id -> user_id.
+
+    Пост, для чийого chat_id немає користувача, позначається невдалим, щоб планувальник його не брав.
+    """
+    existing = {col["name"] for col in inspect(sync_conn).get_columns("scheduled_posts")}
+    if not {"chat_id", "message_text", "photo_path"} <= existing:
+        return
+    sync_conn.execute(text(
+        "UPDATE scheduled_posts SET caption = message_text, image_path = photo_path, "
+        "user_id = (SELECT users.id FROM users WHERE users.telegram_id = scheduled_posts.chat_id) "
+        "WHERE user_id IS NULL"))
+    orphans = sync_conn.execute(text(
+        "UPDATE scheduled_posts SET failed = TRUE, last_error = 'користувача не знайдено (стара схема)' "
+        "WHERE user_id IS NULL")).rowcount
+    logger.info(f"Міграція: перенесено пости старої схеми scheduled_posts (без користувача: {orphans})")
+
+
+def _apply_index_migrations(sync_conn):
+    from database.models import Base
+
+    inspector = inspect(sync_conn)
+    tables = set(inspector.get_table_names())
+    for table in Base.metadata.sorted_tables:
+        if table.name not in tables:
+            continue
+        existing = {col["name"] for col in inspector.get_columns(table.name)}
+        for index in table.indexes:
+            missing = [column.name for column in index.columns if column.name not in existing]
+            if missing:
+                # Без міграції колонок індекс не створиться, а помилка зупинила б запуск бота
+                logger.warning(f"Міграція: індекс {index.name} пропущено, немає колонок {', '.join(missing)}")
+                continue
+            index.create(sync_conn, checkfirst=True)
+
+
+async def run_migrations(conn):
+    """Додає відсутні колонки та індекси до існуючих таблиць."""
+    added = await conn.run_sync(_apply_column_migrations)
+    if ("scheduled_posts", "user_id") in added:
+        await conn.run_sync(_backfill_legacy_posts)
+    await conn.run_sync(_apply_index_migrations)
@@ -1,5 +1,6 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, Text, ForeignKey, UniqueConstraint, Index, LargeBinary
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import relationship
 import datetime
 
 Base = declarative_base()
@@ -10,18 +11,90 @@ class User(Base):
     id = Column(Integer, primary_key=True, index=True)
     telegram_id = Column(Integer, unique=True, index=True)
     username = Column(String, nullable=True)
-    session_data = Column(String, nullable=True)
+    session_data = Column(String, nullable=True)  # Старий формат: JSON налаштувань instagrapi текстом
+    session_blob = Column(LargeBinary, nullable=True)  # zlib-стиснутий JSON (api.session_store)
     two_factor_enabled = Column(Boolean, default=False)
+    instagram_user_id = Column(String, nullable=True)  # Числовий ID акаунта Instagram (не змінюється)
+    last_active_at = Column(DateTime, nullable=True, index=True)  # Для попереднього прогріву клієнтів при старті
+
+    scheduled_posts = relationship("ScheduledPost", back_populates="user")
 
 
 class ScheduledPost(Base):
     __tablename__ = "scheduled_posts"
+    # Планувальник вибирає лише неопубліковані пости в межах часового вікна
+    __table_args__ = (Index("ix_scheduled_posts_posted_time", "posted", "scheduled_time"),)
 
     id = Column(Integer, primary_key=True)
-    chat_id = Column(Integer)
-    message_text = Column(String)
-    scheduled_time = Column(DateTime, default=datetime.datetime.utcnow) # час створення
-    photo_path = Column(String, nullable=True) # Шлях до фото, якщо є
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    caption = Column(String)
+    scheduled_time = Column(DateTime, default=datetime.datetime.utcnow) # час публікації
+    image_path = Column(String, nullable=True) # Шлях до фото, якщо є
+    posted = Column(Boolean, default=False)
+    attempts = Column(Integer, default=0)  # Кількість невдалих спроб публікації
+    last_error = Column(String, nullable=True)
+    failed = Column(Boolean, default=False)  # Спроби вичерпано, більше не публікуємо
+
+    user = relationship("User", back_populates="scheduled_posts")
 
     def __repr__(self):
-        return f"<ScheduledPost(message_text='{self.message_text}', scheduled_time='{self.scheduled_time}')>"
+        return f"<ScheduledPost(caption='{self.caption}', scheduled_time='{self.scheduled_time}')>"
+
+
+class AIResponseCache(Base):
+    __tablename__ = "ai_response_cache"
+
+    key = Column(String(64), primary_key=True)  # sha256 від нормалізованого запиту
+    response = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+
+class MediaSnapshot(Base):
+    """Локальна копія медіа акаунта з лічильниками (для статистики без повного перезавантаження)."""
+    __tablename__ = "media_snapshots"
+    __table_args__ = (UniqueConstraint("user_id", "media_pk", name="uq_media_snapshots_user_media"),)
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    media_pk = Column(String, nullable=False)
+    taken_at = Column(DateTime, nullable=True)
+    like_count = Column(Integer, default=0)
+    comment_count = Column(Integer, default=0)
+    view_count = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class AccountStats(Base):
+    """Агрегати по медіа акаунта, що підтримуються інкрементально при синхронізації."""
+    __tablename__ = "account_stats"
+
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    total_likes = Column(Integer, default=0)
+    total_comments = Column(Integer, default=0)
+    synced_media = Column(Integer, default=0)
+    follower_count = Column(Integer, default=0)
+    following_count = Column(Integer, default=0)
+    media_count = Column(Integer, default=0)
+    backfill_cursor = Column(String, nullable=True)  # Курсор для догрузки старіших медіа
+    backfill_done = Column(Boolean, default=False)
+    last_synced_at = Column(DateTime, nullable=True)
+
+
+class SavedConversation(Base):
+    """Незавершений діалог користувача (відкладений запис із conversation.ConversationStore)."""
+    __tablename__ = "conversation_states"
+
+    telegram_id = Column(Integer, primary_key=True)
+    state = Column(String, nullable=False)
+    data = Column(Text, nullable=True)  # JSON: шляхи файлів, фото альбому
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow)
+
+
+class ShardLease(Base):
+    """Оренда шарду робочим процесом (шардований режим, див. sharding.py)."""
+    __tablename__ = "shard_leases"
+
+    shard_id = Column(Integer, primary_key=True)
+    owner = Column(String, nullable=False)  # "хост:pid" процесу, що обробляє шард
+    expires_at = Column(DateTime, nullable=False)
@@ -1,13 +1,24 @@
+import asyncio
 import json
 import logging
 import os
+import tempfile
+import time
 
-import requests
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+import httpx
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, PhotoSize
+from telegram.constants import MessageLimit
+from telegram.error import BadRequest, RetryAfter, TelegramError
 from telegram.ext import CallbackContext
 
-from api.api import InstagramAPI
-from config import DEEPSEEK_API_KEY, DEEPSEEK_API_URL
+from api.admission import AIOverloaded, AISuperseded, ai_admission
+from api.ai_cache import make_cache_key, response_cache
+from api.deepseek import deepseek_client
+from conversation import State, conversation_store
+from database import session_scope
+from database.crud import get_user
+from media import media_pipeline
+from scheduler.bulk_import import IMPORT_MAX_ROWS, BulkImporter, ManifestError
 
 # Налаштування логування
 logging.basicConfig(
@@ -16,55 +27,107 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Глобальний кеш для збереження станів користувачів
-user_state = {}
+# Потоковий режим AI-відповідей (DEEPSEEK_STREAM=1) та частота редагування повідомлення
+DEEPSEEK_STREAM = os.environ.get("DEEPSEEK_STREAM", "0") == "1"
+STREAM_EDIT_INTERVAL_MS = int(os.environ.get("STREAM_EDIT_INTERVAL_MS", "1500"))
+STREAM_EDIT_CHARS = int(os.environ.get("STREAM_EDIT_CHARS", "300"))
+# Мінімальний інтервал між редагуваннями, щоб не впертися в ліміти Telegram
+STREAM_MIN_EDIT_INTERVAL_MS = int(os.environ.get("STREAM_MIN_EDIT_INTERVAL_MS", "700"))
 
-# Функція для взаємодії з DeepSeek API
-async def get_deepseek_response(user_message):
-    headers = {
-        "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-        "Content-Type": "application/json"
-    }
-    data = {
-        "model": "deepseek/deepseek-r1:free",
+# Альбом (карусель): Instagram приймає від 2 до 10 фото
+ALBUM_MIN_PHOTOS = 2
+ALBUM_MAX_PHOTOS = 10
+ALBUM_DONE_WORDS = {"готово", "done"}
+# Скільки чекати на решту фото з медіагрупи перед одним підсумковим повідомленням
+ALBUM_GROUP_DEBOUNCE = float(os.environ.get("ALBUM_GROUP_DEBOUNCE", "1.5"))
+_album_ack_tasks = {}
+
+# Масовий імпорт: Bot API віддає боту файли до 20 МБ; прогрес оновлюється не частіше за інтервал
+IMPORT_MAX_FILE_BYTES = 20 * 1024 * 1024
+IMPORT_PROGRESS_INTERVAL = float(os.environ.get("IMPORT_PROGRESS_INTERVAL", "2"))
+
+
+DEEPSEEK_MODEL = "deepseek/deepseek-r1:free"
+# Дешевша/швидша модель, якщо основна недоступна або відповідає з помилкою (порожньо - без запасної)
+DEEPSEEK_FALLBACK_MODEL = os.environ.get("DEEPSEEK_FALLBACK_MODEL", "")
+DEEPSEEK_SYSTEM_PROMPT = "Ти AI-асистент для Telegram бота, який допомагає керувати Instagram. Відповідаєш чітко коротко та без зайвого."
+DEEPSEEK_TEMPERATURE = 0.7
+
+
+AI_BUSY_REPLY = "⏳ Зараз забагато запитів до AI. Спробуйте за хвилину."
+AI_UNAVAILABLE_REPLY = "⚠️ AI тимчасово недоступний. Спробуйте трохи пізніше."
+
+
+def build_deepseek_payload(user_message, model=DEEPSEEK_MODEL):
+    return {
+        "model": model,
         "messages": [
-            {"role": "system", "content": "Ти AI-асистент для Telegram бота, який допомагає керувати Instagram. Відповідаєш чітко коротко та без зайвого."},
+            {"role": "system", "content": DEEPSEEK_SYSTEM_PROMPT},
             {"role": "user", "content": user_message}
         ],
         "max_tokens": 500,
-        "temperature": 0.7
+        "temperature": DEEPSEEK_TEMPERATURE
     }
 
+
+def deepseek_cache_key(user_message):
+    return make_cache_key(user_message, DEEPSEEK_SYSTEM_PROMPT, DEEPSEEK_MODEL, DEEPSEEK_TEMPERATURE)
+
+
+# Функція для взаємодії з DeepSeek API
+async def get_deepseek_response(user_message, user_id=None):
+    """Відповідь AI. None - запит замінено новішим повідомленням того ж користувача."""
+    cache_key = deepseek_cache_key(user_message)
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     try:
-        response = requests.post(DEEPSEEK_API_URL, headers=headers, data=json.dumps(data))
-        response.raise_for_status()
-        response_data = response.json()
+        async with ai_admission.admit(user_id):
+            return await _request_deepseek(user_message, cache_key)
+    except AISuperseded:
+        return None
+    except AIOverloaded:
+        return AI_BUSY_REPLY
+
+
+async def _request_deepseek(user_message, cache_key):
+    """Запит до основної моделі; при помилці чи відкритому запобіжнику - до запасної."""
+    error = None
+    for model in ai_admission.models(DEEPSEEK_MODEL, DEEPSEEK_FALLBACK_MODEL):
+        try:
+            async with ai_admission.call(model):
+                response_data = await deepseek_client.chat(build_deepseek_payload(user_message, model))
+                content = response_data['choices'][0]['message']['content']
+        except httpx.HTTPError as e:
+            logger.error(f"Помилка запиту до DeepSeek API ({model}): {e}")
+            error = e
+            continue
+        except (KeyError, IndexError, json.JSONDecodeError) as e:
+            logger.error(f"Помилка обробки відповіді DeepSeek API: {e}")
+            return "❌ Не вдалося отримати відповідь від AI. Спробуйте ще раз."
         logger.info(f"Відповідь DeepSeek API: {response_data}")
-        return response_data['choices'][0]['message']['content']
+        if model == DEEPSEEK_MODEL:
+            await response_cache.set(cache_key, content)  # Кешуємо лише успішні відповіді основної моделі
+        return content
 
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Помилка запиту до DeepSeek API: {e}")
-        return "❌ Помилка при обробці вашого запиту. Спробуйте ще раз."
-    except (KeyError, IndexError, json.JSONDecodeError) as e:
-        logger.error(f"Помилка обробки відповіді DeepSeek API: {e}")
-        return "❌ Не вдалося отримати відповідь від AI. Спробуйте ще раз."
+    if error is None:
+        return AI_UNAVAILABLE_REPLY  # Запобіжники всіх моделей відкриті
+    return "❌ Помилка при обробці вашого запиту. Спробуйте ще раз."
 
 
 # /start - Початок роботи з ботом
 async def start(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id #Отримуємо id
-    #Перевіряємо, чи є вже інстанція
-    if user_id not in context.bot_data['instagram_api']:
-        context.bot_data['instagram_api'][user_id] = InstagramAPI(context.bot_data['db_session']) # Ініціалізуємо
-        # Якщо потрiбна попередня iнiцiалзацiя, робимо це тут.
-        await context.bot_data['instagram_api'][user_id].load_session() # Спробуємо завантажити
-    print("-->>Start function")
+    # Реєстр створює інстанцію та відновлює сесію з БД, якщо потрібно
+    await context.bot_data['instagram_api'].get(user_id)
     keyboard = [
         [InlineKeyboardButton("Увійти в Instagram", callback_data="login")],
         [InlineKeyboardButton("Вийти з Instagram", callback_data="logout")],
         [InlineKeyboardButton("Отримати статистику", callback_data="get_stats")],
         [InlineKeyboardButton("Запостити фото", callback_data="post_photo")],
         [InlineKeyboardButton("Запостити сторіс", callback_data="post_story")],
+        [InlineKeyboardButton("Запостити альбом", callback_data="post_album")],
         [InlineKeyboardButton("Допомога", callback_data="help")],
     ]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -75,13 +138,15 @@ async def start(update: Update, context: CallbackContext):
 
 # /help - Допомога
 async def help_command(update: Update, context: CallbackContext):
-    await update.message.reply_text(
+    # effective_message: команда може прийти і з inline-кнопки
+    await update.effective_message.reply_text(
         "Список доступних команд:\n"
         "/start - Початок роботи\n"
         "/help - Допомога\n"
         "/stats - Отримати статистику\n"
         "/login - Увійти в Instagram (використовуйте /login user:<username> password:<password>)\n"
-        "/logout - Вийти з Instagram"
+        "/logout - Вийти з Instagram\n"
+        "/import - Запланувати багато постів з файлу (ZIP або CSV)"
     )
 
 
@@ -89,24 +154,19 @@ async def login_command(update: Update, context: CallbackContext):
     """Обробник команди /login."""
     user_id = update.message.from_user.id
 
-    # Перевіряємо, чи є вже інстанція InstagramAPI для цього користувача
-    if user_id not in context.bot_data['instagram_api']:
-        context.bot_data['instagram_api'][user_id] = InstagramAPI(context.bot_data['db_session'])
-
-    insta_api = context.bot_data['instagram_api'][user_id]
-    insta_api.user_id = user_id # Додано
+    # Отримуємо (або відновлюємо) інстанцію InstagramAPI для цього користувача
+    insta_api = await context.bot_data['instagram_api'].get(user_id)
 
     # Перевірка, чи користувач уже в процесі очікування коду 2FA
-    if user_id in user_state and user_state[user_id] == "waiting_for_2fa_code":
+    if conversation_store.state_of(user_id) == State.WAITING_FOR_2FA_CODE:
         # Обробка вводу коду 2FA
         code = update.message.text.strip()
         login_success = await insta_api.complete_2fa_login(code)
+        conversation_store.clear(user_id)  # Очищаємо стан (і у разі невдачі)
         if login_success:
             await update.message.reply_text("✅ Успішний вхід з 2FA!")
-            del user_state[user_id]  # Очищаємо стан
         else:
             await update.message.reply_text("❌ Невірний код 2FA. Почніть вхід знову з /login.")
-            del user_state[user_id]  # Очищаємо стан у разі невдачі
         return #Завершуємо виконання щоб не оброблялось далі.
 
     # Обробка звичайного логіну (вхідні дані з команди)
@@ -127,7 +187,7 @@ async def login_command(update: Update, context: CallbackContext):
                     await update.message.reply_text("❌ Невірний логін або пароль. Спробуйте ще раз.")
                 elif insta_api._last_login_result is None:
                     await insta_api.request_2fa_code(context, update)
-                    user_state[user_id] = "waiting_for_2fa_code"  # Встановлюємо стан
+                    conversation_store.begin(user_id, State.WAITING_FOR_2FA_CODE)  # Встановлюємо стан
                 else:
                     await update.message.reply_text("Не вдалося увійти. Перевірте дані і спробуйте ще раз.")
 
@@ -143,19 +203,16 @@ async def login_command(update: Update, context: CallbackContext):
 
 # /logout - Обробник команди виходу (НОВИЙ)
 async def logout_command(update: Update, context: CallbackContext):
-    user_id = update.message.from_user.id
-    # Перевіряємо, чи є вже інстанція InstagramAPI для цього користувача
-    if user_id not in context.bot_data['instagram_api']:
-        context.bot_data['instagram_api'][user_id] = InstagramAPI(context.bot_data['db_session'])
-    insta_api = context.bot_data['instagram_api'][user_id]
-    insta_api.user_id = user_id
+    user_id = update.effective_user.id
+    # Отримуємо (або відновлюємо) інстанцію InstagramAPI для цього користувача
+    insta_api = await context.bot_data['instagram_api'].get(user_id)
 
     if await insta_api.logout():
-        await update.message.reply_text("✅ Ви вийшли з Instagram.")
-        del context.bot_data['instagram_api'][user_id] #Remove API instance
+        await update.effective_message.reply_text("✅ Ви вийшли з Instagram.")
+        context.bot_data['instagram_api'].discard(user_id) #Remove API instance
 
     else:
-        await update.message.reply_text("Ви не авторизовані.")
+        await update.effective_message.reply_text("Ви не авторизовані.")
 
 
 # Обробник натискань на inline-кнопки
@@ -164,11 +221,8 @@ async def button_click(update: Update, context: CallbackContext):
     await query.answer()  # Завжди викликайте query.answer()
     user_id = query.from_user.id
 
-    # Перевіряємо, чи є вже інстанція InstagramAPI для цього користувача
-    if user_id not in context.bot_data['instagram_api']:
-        context.bot_data['instagram_api'][user_id] = InstagramAPI(context.bot_data['db_session']) # Ініціалізуємо, якщо потрібно
-    insta_api = context.bot_data['instagram_api'][user_id]
-    insta_api.user_id = user_id
+    # Отримуємо (або відновлюємо) інстанцію InstagramAPI для цього користувача
+    insta_api = await context.bot_data['instagram_api'].get(user_id)
 
     if query.data == "login":
         await query.message.reply_text("Введіть команду /login, ваш логін та пароль у форматі: /login user:<username> password:<password>")
@@ -189,15 +243,23 @@ async def button_click(update: Update, context: CallbackContext):
 
             if insta_api.is_logged_in:
                 await query.message.reply_text("Надішліть фото для публікації:")
-                user_state[user_id] = "waiting_for_photo"
+                conversation_store.begin(user_id, State.WAITING_FOR_PHOTO)
             else:
                 await query.message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
     elif query.data == "post_story":
           if insta_api.is_logged_in:
             await query.message.reply_text("Надішліть фото для публікації в сторіс:")
-            user_state[user_id] = "waiting_for_story_photo"
+            conversation_store.begin(user_id, State.WAITING_FOR_STORY_PHOTO)
           else:
             await query.message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
+    elif query.data == "post_album":
+        if insta_api.is_logged_in:
+            await query.message.reply_text(
+                f"Надішліть від {ALBUM_MIN_PHOTOS} до {ALBUM_MAX_PHOTOS} фото (можна одним альбомом). "
+                "Коли закінчите, напишіть «готово».")
+            conversation_store.begin(user_id, State.WAITING_FOR_ALBUM_PHOTOS, album_photos=[])
+        else:
+            await query.message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
     elif query.data == "help":
         await help_command(update, context)
 
@@ -207,16 +269,14 @@ async def handle_text(update: Update, context: CallbackContext):
     user_id = update.message.from_user.id
     text = update.message.text
 
-    # Перевіряємо, чи є вже інстанція InstagramAPI для цього користувача
-    if user_id not in context.bot_data['instagram_api']:
-        context.bot_data['instagram_api'][user_id] = InstagramAPI(context.bot_data['db_session'])
-
-    insta_api = context.bot_data['instagram_api'][user_id]
-    insta_api.user_id = user_id
+    # Отримуємо (або відновлюємо) інстанцію InstagramAPI для цього користувача
+    insta_api = await context.bot_data['instagram_api'].get(user_id)
 
-    if user_id in user_state:
-        if user_state[user_id] == "waiting_for_caption":
-            photo_path = user_state.get(f"{user_id}_photo_path")
+    conversation = conversation_store.get(user_id)
+    if conversation is not None:
+        if conversation.state == State.WAITING_FOR_CAPTION:
+            conversation_store.clear(user_id)  # Очищаємо стан
+            photo_path = conversation.media_paths[0] if conversation.media_paths else None
             if photo_path:
                 if insta_api.is_logged_in:
                     try:
@@ -226,22 +286,17 @@ async def handle_text(update: Update, context: CallbackContext):
                         await update.message.reply_text(f"❌ Помилка при публікації: {e}")
                     finally:
                         # Видаляємо тимчаовий файл
-                        try:
-
-                            os.remove(photo_path)
-                        except FileNotFoundError:
-                            pass
+                        media_pipeline.release(photo_path)
 
                 else:
+                    media_pipeline.release(photo_path)
                     await update.message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
             else:
                 await update.message.reply_text("Сталася помилка з фото. Спробуйте ще раз.")
-            # Очищаємо стани
-            del user_state[user_id]
-            del user_state[f"{user_id}_photo_path"]
 
-        elif user_state[user_id] == "waiting_for_story_caption":
-            photo_path = user_state.get(f"{user_id}_story_photo_path")  # виправлено
+        elif conversation.state == State.WAITING_FOR_STORY_CAPTION:
+            conversation_store.clear(user_id)  # Очищаємо стан
+            photo_path = conversation.media_paths[0] if conversation.media_paths else None
             if photo_path:
                 if insta_api.is_logged_in:
                     try:
@@ -251,51 +306,165 @@ async def handle_text(update: Update, context: CallbackContext):
                         await update.message.reply_text(f"❌ Помилка при публікації сторіс: {e}")
                     finally:
                          # Видаляємо тимчаовий файл
-                        try:
-
-                            os.remove(photo_path)
-                        except FileNotFoundError:
-                            pass
-
+                        media_pipeline.release(photo_path)
+                else:
+                    media_pipeline.release(photo_path)
+                    await update.message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
             else:
                 await update.message.reply_text("Сталася помилка з фото для сторіс. Спробуйте ще раз.")
 
-             # Очищаємо стани
-            del user_state[user_id]
-            del user_state[f"{user_id}_story_photo_path"]
-        elif user_state[user_id] == "waiting_for_2fa_code":
+        elif conversation.state == State.WAITING_FOR_ALBUM_PHOTOS:
+            if text.strip().lower() not in ALBUM_DONE_WORDS:
+                conversation_store.touch(user_id)
+                await update.message.reply_text("Надішліть фото або напишіть «готово».")
+            elif len(conversation.album_photos) < ALBUM_MIN_PHOTOS:
+                conversation_store.touch(user_id)
+                await update.message.reply_text(f"Для альбому потрібно щонайменше {ALBUM_MIN_PHOTOS} фото.")
+            else:
+                conversation_store.set(user_id, State.WAITING_FOR_ALBUM_CAPTION)
+                await update.message.reply_text("Введіть опис для альбому:")
+        elif conversation.state == State.WAITING_FOR_ALBUM_CAPTION:
+            conversation_store.clear(user_id)  # Очищаємо стан
+            photos = [PhotoSize.de_json(photo, context.bot) for photo in conversation.album_photos]
+            await publish_album(update, insta_api, photos, text)
+        elif conversation.state == State.WAITING_FOR_2FA_CODE:
           await login_command(update,context) #Передаємо обробку назад в login_command
     else:
-        response = await get_deepseek_response(text)  # AI, якщо потрібно і команда не розпізнана
+        # AI, якщо потрібно і команда не розпізнана.
+        # Відповідь формується у фоновій задачі, щоб не тримати обробку інших оновлень.
+        context.application.create_task(reply_with_ai(update, text), update=update)
+
+
+async def reply_with_ai(update: Update, text):
+    if DEEPSEEK_STREAM:
+        await reply_with_ai_stream(update, text)
+        return
+    response = await get_deepseek_response(text, update.effective_user.id)
+    if response is not None:
         await update.message.reply_text(response)
 
-async def handle_photo(update: Update, context: CallbackContext):
-    user_id = update.message.from_user.id
 
-    # Перевіряємо, чи є вже інстанція InstagramAPI для цього користувача
-    if user_id not in context.bot_data['instagram_api']:
-        context.bot_data['instagram_api'][user_id] = InstagramAPI(context.bot_data['db_session'])
+async def stream_deepseek_response(user_message, model=DEEPSEEK_MODEL):
+    """Потоковий режим DeepSeek: повертає частини відповіді по мірі генерації."""
+    async for chunk in deepseek_client.stream_chat(build_deepseek_payload(user_message, model)):
+        yield chunk
+
+
+async def _edit_stream_message(message, text):
+    """Редагує повідомлення з відповіддю. Повертає затримку (с), якщо Telegram просить зачекати."""
+    try:
+        await message.edit_text(text[:MessageLimit.MAX_TEXT_LENGTH])
+    except RetryAfter as e:
+        return e.retry_after if isinstance(e.retry_after, (int, float)) else e.retry_after.total_seconds()
+    except BadRequest as e:
+        if "not modified" not in str(e).lower():
+            logger.warning(f"Не вдалося оновити повідомлення: {e}")
+    except TelegramError as e:
+        # Збій Telegram не перериває потік і не зараховується як помилка моделі
+        logger.warning(f"Не вдалося оновити повідомлення: {e}")
+    return 0
+
+
+async def reply_with_ai_stream(update: Update, text):
+    """Показує відповідь AI поступово: плейсхолдер + обмежені за частотою редагування."""
+    cache_key = deepseek_cache_key(text)
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        await update.message.reply_text(cached)
+        return
+
+    try:
+        async with ai_admission.admit(update.effective_user.id):
+            # Потік не повторюється іншою моделлю: запасна - лише якщо запобіжник основної відкритий
+            model = next(ai_admission.models(DEEPSEEK_MODEL, DEEPSEEK_FALLBACK_MODEL), None)
+            if model is None:
+                await update.message.reply_text(AI_UNAVAILABLE_REPLY)
+                return
+            await _stream_ai_reply(update, text, cache_key, model)
+    except AISuperseded:
+        return
+    except AIOverloaded:
+        await update.message.reply_text(AI_BUSY_REPLY)
+
+
+async def _stream_ai_reply(update: Update, text, cache_key, model):
+    loop = asyncio.get_running_loop()
+    message = await update.message.reply_text("⏳ Думаю...")
+    completed = False
+    buffer = ""
+    shown_len = 0
+    last_edit = loop.time()
+    next_allowed = last_edit
 
-    insta_api = context.bot_data['instagram_api'][user_id]
-    insta_api.user_id = user_id
+    try:
+        # Запобіжник міряє час до першої частини: генерація та редагування повідомлень у Telegram
+        # (з паузами flood control) у тривалість запиту до моделі не входять
+        async with ai_admission.call(model) as timer:
+            async for chunk in stream_deepseek_response(text, model):
+                timer.first_response()
+                buffer += chunk
+                now = loop.time()
+                elapsed_ms = (now - last_edit) * 1000
+                pending = len(buffer) - shown_len
+                # Редагуємо кожні N мс або кожні M символів, але не частіше за мінімальний інтервал
+                due = elapsed_ms >= STREAM_EDIT_INTERVAL_MS or (
+                    pending >= STREAM_EDIT_CHARS and elapsed_ms >= STREAM_MIN_EDIT_INTERVAL_MS)
+                if pending and due and now >= next_allowed:
+                    delay = await _edit_stream_message(message, buffer)
+                    last_edit = loop.time()
+                    next_allowed = last_edit + delay
+                    if not delay:
+                        shown_len = len(buffer)
+        completed = True
+    except httpx.HTTPError as e:
+        logger.error(f"Помилка запиту до DeepSeek API: {e}")
+        buffer = "❌ Помилка при обробці вашого запиту. Спробуйте ще раз."
+    except (KeyError, IndexError, json.JSONDecodeError) as e:
+        logger.error(f"Помилка обробки відповіді DeepSeek API: {e}")
+        buffer = "❌ Не вдалося отримати відповідь від AI. Спробуйте ще раз."
+
+    if not buffer.strip():
+        buffer = "❌ Не вдалося отримати відповідь від AI. Спробуйте ще раз."
+    elif completed and model == DEEPSEEK_MODEL:
+        await response_cache.set(cache_key, buffer)
+    # Фінальне редагування з повним текстом
+    delay = await _edit_stream_message(message, buffer)
+    if delay:
+        await asyncio.sleep(delay)
+        await _edit_stream_message(message, buffer)
 
+async def handle_photo(update: Update, context: CallbackContext):
+    user_id = update.message.from_user.id
 
-    if user_id in user_state:
-        if user_state[user_id] == "waiting_for_photo":
-            photo_file = await update.message.photo[-1].get_file()
-            photo_path = f"{photo_file.file_unique_id}.jpg"  # Унікальне ім'я
-            await photo_file.download_to_drive(photo_path)
-            user_state[f"{user_id}_photo_path"] = photo_path  # Зберігаємо шлях
+    # Отримуємо (або відновлюємо) інстанцію InstagramAPI для цього користувача
+    insta_api = await context.bot_data['instagram_api'].get(user_id)
+
+
+    conversation = conversation_store.get(user_id)
+    if conversation is not None:
+        if conversation.state == State.WAITING_FOR_PHOTO:
+            try:
+                # Підготовка під формат стрічки Instagram (з кешу, якщо фото вже надсилалось)
+                photo_path = await media_pipeline.prepare(update.message.photo[-1], "feed")
+            except Exception as e:
+                logger.error(f"Помилка обробки фото: {e}")
+                await update.message.reply_text("Не вдалося обробити фото. Спробуйте інше.")
+                return
+            # Зберігаємо шлях: якщо діалог покинуть, файл звільнить сховище станів
+            conversation_store.set(user_id, State.WAITING_FOR_CAPTION, media_paths=[photo_path])
             await update.message.reply_text("Введіть опис для фото:")
-            user_state[user_id] = "waiting_for_caption"
             return
 
-        elif user_state[user_id] == "waiting_for_story_photo":
-            photo_file = await update.message.photo[-1].get_file()
-            photo_path = f"story_{photo_file.file_unique_id}.jpg"
-            await photo_file.download_to_drive(photo_path)
+        elif conversation.state == State.WAITING_FOR_STORY_PHOTO:
+            try:
+                # Обрізання під 9:16 для сторіс
+                photo_path = await media_pipeline.prepare(update.message.photo[-1], "story")
+            except Exception as e:
+                logger.error(f"Помилка обробки фото: {e}")
+                await update.message.reply_text("Не вдалося обробити фото. Спробуйте інше.")
+                return
 
-            user_state[f"{user_id}_story_photo_path"] = photo_path  # Corrected path
+            conversation_store.clear(user_id)  # Очищення стану
             await update.message.reply_text("Публікую сторіс...")
             if insta_api.is_logged_in:
                 try:
@@ -305,17 +474,165 @@ async def handle_photo(update: Update, context: CallbackContext):
                     await update.message.reply_text(f"❌ Помилка при публікації сторіс: {e}")
                 finally:
                      # Видаляємо тимчаовий файл
-                    try:
-
-                        os.remove(photo_path)
-                    except FileNotFoundError:
-                        pass
+                    media_pipeline.release(photo_path)
             else:
+                media_pipeline.release(photo_path)
                 await update.message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
+            return
 
-            # Очищення стану
-            del user_state[user_id]
-            del user_state[f"{user_id}_story_photo_path"] #Удаляем story_photo_path
+        elif conversation.state == State.WAITING_FOR_ALBUM_PHOTOS:
+            await add_album_photo(update, context)
             return
 
     await update.message.reply_text("Я очікую від вас інші дії. Скористайтеся меню /start.")
+
+
+async def add_album_photo(update: Update, context: CallbackContext):
+    """Додає фото до альбому. Фото лише запам'ятовуються, завантаження - під час публікації."""
+    user_id = update.message.from_user.id
+    photos = conversation_store.get(user_id).album_photos
+    if len(photos) >= ALBUM_MAX_PHOTOS:
+        return
+    photos.append(update.message.photo[-1].to_dict())
+    conversation_store.touch(user_id)
+
+    if len(photos) >= ALBUM_MAX_PHOTOS:
+        conversation_store.set(user_id, State.WAITING_FOR_ALBUM_CAPTION)
+        await update.message.reply_text(f"Отримано {len(photos)} фото (максимум). Введіть опис для альбому:")
+    elif update.message.media_group_id:
+        # Фото з медіагрупи приходять окремими оновленнями - відповідаємо один раз на всю групу
+        previous = _album_ack_tasks.pop(user_id, None)
+        if previous:
+            previous.cancel()
+        _album_ack_tasks[user_id] = context.application.create_task(_album_group_ack(update, user_id))
+    else:
+        await update.message.reply_text(f"Фото {len(photos)} додано. Надішліть ще або напишіть «готово».")
+
+
+async def _album_group_ack(update: Update, user_id):
+    await asyncio.sleep(ALBUM_GROUP_DEBOUNCE)
+    _album_ack_tasks.pop(user_id, None)
+    conversation = conversation_store.get(user_id)
+    if conversation is not None and conversation.state == State.WAITING_FOR_ALBUM_PHOTOS:
+        count = len(conversation.album_photos)
+        await update.message.reply_text(f"Отримано {count} фото. Надішліть ще або напишіть «готово».")
+
+
+async def publish_album(update: Update, insta_api, photos, caption):
+    """Паралельне завантаження та обробка фото альбому і публікація однією каруселлю."""
+    if not insta_api.is_logged_in:
+        await update.message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
+        return
+
+    progress = await update.message.reply_text(f"⏳ Завантажую {len(photos)} фото...")
+    tasks = [asyncio.ensure_future(media_pipeline.prepare(photo, "feed")) for photo in photos]
+    try:
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+    except asyncio.CancelledError:
+        # Публікацію скасовано під час підготовки: звільняємо фото, що вже встигли підготуватись
+        for task in tasks:
+            if task.done() and not task.cancelled() and task.exception() is None:
+                media_pipeline.release(task.result())
+        raise
+    photo_paths = [result for result in results if isinstance(result, str)]
+    try:
+        if len(photo_paths) != len(photos):
+            errors = [result for result in results if isinstance(result, Exception)]
+            logger.error(f"Помилка обробки фото альбому: {errors}")
+            await progress.edit_text("❌ Не вдалося обробити частину фото. Спробуйте ще раз.")
+            return
+        await progress.edit_text(f"⏳ Публікую альбом з {len(photo_paths)} фото...")
+        await insta_api.post_album(photo_paths, caption)
+        await progress.edit_text("✅ Альбом опубліковано!")
+    except Exception as e:
+        await progress.edit_text(f"❌ Помилка при публікації альбому: {e}")
+    finally:
+        # Звільняємо файли
+        for photo_path in photo_paths:
+            media_pipeline.release(photo_path)
+
+
+async def import_command(update: Update, context: CallbackContext):
+    """/import - масове планування постів з маніфесту (ZIP з фото або CSV з посиланнями)."""
+    user_id = update.effective_user.id
+    insta_api = await context.bot_data['instagram_api'].get(user_id)
+    if not insta_api.is_logged_in:
+        await update.effective_message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
+        return
+    conversation_store.begin(user_id, State.WAITING_FOR_IMPORT_FILE)
+    await update.effective_message.reply_text(
+        "Надішліть файлом (до 20 МБ):\n"
+        "• ZIP-архів з фото та manifest.csv, або\n"
+        "• CSV-файл, де фото вказано посиланнями http(s)://\n\n"
+        "Колонки маніфесту: image, caption, time (наприклад, 2024-05-01 10:00 або 01.05.2024 10:00).\n"
+        f"Не більше {IMPORT_MAX_ROWS} рядків.")
+
+
+async def handle_document(update: Update, context: CallbackContext):
+    """Файл маніфесту для /import: завантажується тут, імпорт виконується у фоновій задачі."""
+    user_id = update.message.from_user.id
+    if conversation_store.state_of(user_id) != State.WAITING_FOR_IMPORT_FILE:
+        await update.message.reply_text("Я очікую від вас інші дії. Скористайтеся меню /start.")
+        return
+
+    document = update.message.document
+    if not (document.file_name or "").lower().endswith((".zip", ".csv")):
+        conversation_store.touch(user_id)
+        await update.message.reply_text("Потрібен файл .zip або .csv.")
+        return
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_BYTES:
+        conversation_store.touch(user_id)
+        await update.message.reply_text("Файл завеликий (максимум 20 МБ). Розділіть маніфест на кілька файлів.")
+        return
+    conversation_store.clear(user_id)
+
+    session_factory = context.bot_data['db_sessionmaker']
+    async with session_scope(session_factory) as session:
+        user = await get_user(session, user_id)
+    if user is None:
+        await update.message.reply_text("Спочатку увійдіть в Instagram (/start -> Увійти в Instagram (/login)).")
+        return
+
+    progress = await update.message.reply_text("⏳ Завантажую файл...")
+    os.makedirs(media_pipeline.spool_dir, exist_ok=True)
+    fd, path = tempfile.mkstemp(prefix="import_", suffix=os.path.splitext(document.file_name)[1],
+                                dir=media_pipeline.spool_dir)
+    os.close(fd)
+    try:
+        telegram_file = await document.get_file()
+        await telegram_file.download_to_drive(path)
+    except Exception as e:
+        os.remove(path)
+        logger.error(f"Не вдалося завантажити файл імпорту: {e}")
+        await progress.edit_text("❌ Не вдалося завантажити файл. Спробуйте ще раз.")
+        return
+    # Імпорт тисяч рядків триває довго - не тримаємо чергу оновлень користувача
+    context.application.create_task(
+        run_bulk_import(progress, user.id, user_id, path, session_factory), update=update)
+
+
+async def run_bulk_import(progress, db_user_id, telegram_id, path, session_factory):
+    last_edit = time.monotonic()
+
+    async def on_progress(report):
+        nonlocal last_edit
+        if time.monotonic() - last_edit >= IMPORT_PROGRESS_INTERVAL:
+            last_edit = time.monotonic()
+            await _edit_stream_message(
+                progress, f"⏳ Оброблено рядків: {report.rows}, заплановано постів: {report.imported}...")
+
+    importer = BulkImporter(db_user_id, telegram_id, path, on_progress, session_factory)
+    try:
+        report = await importer.run()
+        await _edit_stream_message(progress, "✅ Імпорт завершено.\n" + report.summary())
+    except ManifestError as e:
+        await _edit_stream_message(progress, f"❌ Некоректний файл: {e}")
+    except Exception as e:
+        logger.error(f"Помилка імпорту для {telegram_id}: {e}")
+        await _edit_stream_message(
+            progress, f"❌ Помилка імпорту: {e}\nЗаплановано постів до помилки: {importer.report.imported}")
+    finally:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
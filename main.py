@@ -1,46 +1,152 @@
+from startup import startup_timer  # Першим: відлік часу запуску
 import logging
 import asyncio
-from telegram.ext import Application, filters, CommandHandler, CallbackQueryHandler, MessageHandler
+import os
+from telegram import Update
+from telegram.ext import Application, filters, CommandHandler, CallbackQueryHandler, MessageHandler, TypeHandler
 from config import TELEGRAM_BOT_TOKEN
+startup_timer.mark("import telegram")
+from database import AsyncSessionLocal, init_db  # Імпортуєм фабрику сесій з database/__init__.py
+startup_timer.mark("import database")
 from handlers import start, handle_text, button_click, help_command, handle_photo, login_command, logout_command
-import nest_asyncio
-from database import SessionLocal  # Імпортуєм SessionLocal з database/__init__.py
+from handlers import import_command, handle_document
+startup_timer.mark("import handlers")
+from api.deepseek import deepseek_client
+from api.admission import ai_admission
+from api.executor import instagrapi_executor
+from api.registry import InstagramClientRegistry
+from scheduler import PostScheduler
+from media import media_pipeline
+from conversation import conversation_store
+from update_processor import UPDATE_CONCURRENCY, PerUserUpdateProcessor
+from api.ai_cache import response_cache
+from api.stats_cache import stats_cache
+from metrics import InstrumentedRequest, instrument_handler, log_update, metrics, start_metrics_server
+startup_timer.mark("import інші модулі")
 
-nest_asyncio.apply()
+# Режим отримання оновлень: "polling" (за замовчуванням) або "webhook" (див. webhook.py)
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+# Кількість робочих процесів; більше 1 - шардований режим (див. sharding.py)
+BOT_SHARDS = int(os.environ.get("BOT_SHARDS", "1"))
 
 #logging.basicConfig(level=logging.DEBUG,
 #                    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',)
 
-async def main():
-    #налаштування логування
-    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-                        level=logging.INFO)
-    logger = logging.getLogger(__name__)
+async def on_startup(application):
+    """Ініціалізація ресурсів перед початком обробки оновлень."""
+    startup_timer.mark("initialize (getMe)")
+    shard = application.bot_data.get('shard')
+    if shard is None:
+        await init_db()  # Створюємо відсутні таблиці (у шардованому режимі - диспетчер, один раз)
+    startup_timer.mark("init_db")
+    conversation_store.shard = shard
+    await conversation_store.load()  # Незавершені діалоги з попереднього запуску
+    conversation_store.start()
+    startup_timer.mark("conversation_store.load")
+    application.bot_data['instagram_api'].start()  # Фонове витіснення неактивних клієнтів
+    # Клієнти нещодавно активних користувачів відновлюються у фоні, оновлення вже приймаються
+    application.bot_data['instagram_api'].start_prewarm()
+    # Планувальник запланованих постів
+    application.bot_data['scheduler'] = PostScheduler(
+        AsyncSessionLocal, application.bot, application.bot_data['instagram_api'], shard=shard)
+    application.bot_data['scheduler'].start()
+    register_collectors(application)
+    # Сервер метрик (aiohttp) піднімається у фоні, щоб не затримувати старт
+    application.bot_data['metrics_server'] = asyncio.get_running_loop().create_task(start_metrics_server())
+    startup_timer.mark("scheduler, metrics")
+    startup_timer.report()
 
-    # Логування
-    async def log_updates(update, context):
-        print(f"Received update: {update}")
-        return
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
-    application.add_handler(MessageHandler(filters.ALL, log_updates), group=-1)
+
+def register_collectors(application):
+    """Статистика компонентів віддається на /metrics разом з гістограмами."""
+    metrics.register_collector("tgbot_instagram_clients", application.bot_data['instagram_api'].stats)
+    metrics.register_collector("tgbot_instagrapi_executor", instagrapi_executor.stats)
+    metrics.register_collector("tgbot_scheduler", application.bot_data['scheduler'].stats_dict)
+    metrics.register_collector("tgbot_conversations", conversation_store.stats)
+    metrics.register_collector("tgbot_ai_cache", response_cache.stats)
+    metrics.register_collector("tgbot_ai_admission", ai_admission.stats)
+    metrics.register_collector("tgbot_stats_cache", stats_cache.stats)
+    if isinstance(application.update_processor, PerUserUpdateProcessor):
+        metrics.register_collector("tgbot_updates", application.update_processor.stats)
+
+
+async def on_shutdown(application):
+    """Звільнення ресурсів при зупинці бота."""
+    if application.bot_data.get('metrics_server') is not None:
+        try:
+            runner = await application.bot_data['metrics_server']
+            if runner is not None:
+                await runner.cleanup()
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Помилка сервера метрик: {e}")
+    if 'scheduler' in application.bot_data:
+        await application.bot_data['scheduler'].stop()
+    await application.bot_data['instagram_api'].stop()  # Зберігаємо сесії клієнтів
+    await conversation_store.stop()  # Записуємо стани діалогів, що ще не збережені
+    await deepseek_client.aclose()  # Закриваємо пул з'єднань DeepSeek
+    instagrapi_executor.shutdown()  # Зупиняємо пул потоків instagrapi
+    media_pipeline.shutdown()  # Зупиняємо пул процесів обробки фото
+
+def build_application(shard=None, request=None, concurrency=UPDATE_CONCURRENCY):
+    """Створює Application з усіма обробниками (спільне для polling, webhook, робочих процесів і бенчмарку).
+
+    shard - (номер, кількість шардів) для робочого процесу: оновлення надходять від диспетчера,
+    а планувальник, прогрів клієнтів і відновлення діалогів обмежені користувачами шарду.
+    request - запити до Bot API (бенчмарк передає фейк), concurrency - оновлень одночасно.
+    """
+    builder = Application.builder().token(TELEGRAM_BOT_TOKEN).post_init(on_startup).post_shutdown(on_shutdown)
+    # Виклики Bot API вимірюються (пул з'єднань - як у PTB за замовчуванням)
+    builder = builder.request(request or InstrumentedRequest(connection_pool_size=256))
+    if BOT_MODE == "webhook" or shard is not None or request is not None:
+        builder = builder.updater(None)  # Оновлення надходять з вебхука, від диспетчера або бенчмарку
+    if concurrency > 1:
+        # Різні користувачі - паралельно, оновлення одного користувача - строго по черзі
+        builder = builder.concurrent_updates(PerUserUpdateProcessor(max_concurrent=concurrency))
+    application = builder.build()
+    # Логування (вибіркове, див. UPDATE_LOG_SAMPLE_RATE)
+    application.add_handler(TypeHandler(Update, log_update), group=-1)
     # Ініціалізація Telegram бота
 
 
      # Ініціалізація bot_data при старті:
-    application.bot_data['instagram_api'] = {}  # Словник для InstagramAPI
-    application.bot_data['db_session'] = SessionLocal() #Додали сессію
+    application.bot_data['db_sessionmaker'] = AsyncSessionLocal #Сесія БД створюється на кожну операцію
+    application.bot_data['shard'] = shard
+    # Реєстр InstagramAPI з обмеженням розміру та витісненням неактивних клієнтів
+    application.bot_data['instagram_api'] = InstagramClientRegistry(AsyncSessionLocal, shard=shard)
+
+    # Додавання обробників (з вимірюванням затримки та помилок)
+    application.add_handler(CommandHandler("start", instrument_handler(start)))
+    application.add_handler(CommandHandler("help", instrument_handler(help_command)))
+    application.add_handler(CommandHandler("login", instrument_handler(login_command)))
+    application.add_handler(CommandHandler("logout", instrument_handler(logout_command)))
+    application.add_handler(CommandHandler("import", instrument_handler(import_command)))
+    application.add_handler(CallbackQueryHandler(instrument_handler(button_click)))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, instrument_handler(handle_text)))
+    application.add_handler(MessageHandler(filters.PHOTO & ~filters.COMMAND, instrument_handler(handle_photo)))
+    application.add_handler(MessageHandler(filters.Document.ALL, instrument_handler(handle_document)))
+    return application
+
+
+def main():
+    #налаштування логування
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
 
-    # Додавання обробників
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(CommandHandler("login", login_command))
-    application.add_handler(CommandHandler("logout", logout_command))
-    application.add_handler(CallbackQueryHandler(button_click))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_text))
-    application.add_handler(MessageHandler(filters.PHOTO & ~filters.COMMAND, handle_photo))
+    if BOT_SHARDS > 1:
+        from sharding import run_sharded  # Диспетчер; обробники працюють у робочих процесах
+        print(f"🟢 Бот запущений! Режим: {BOT_MODE}, шардів: {BOT_SHARDS}")
+        asyncio.run(run_sharded(BOT_SHARDS, BOT_MODE, build_application))
+        return
 
-    print("🟢 Бот запущений!")
-    await application.run_polling()
+    application = build_application()
+    startup_timer.mark("build_application")
+    print(f"🟢 Бот запущений! Режим: {BOT_MODE}")
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook  # aiohttp потрібен лише в цьому режимі
+        asyncio.run(run_webhook(application))
+    else:
+        # run_polling сам керує циклом подій, post_init та post_shutdown
+        application.run_polling()
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    main()
@@ -0,0 +1,2 @@
+from .cache import MediaCache
+from .pipeline import MediaPipeline, media_pipeline
\ No newline at end of file
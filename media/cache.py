@@ -0,0 +1,237 @@
+import asyncio
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MEDIA_CACHE_DIR = os.environ.get("MEDIA_CACHE_DIR") or os.path.join(os.path.expanduser("~"), ".cache", "tgbot_media")
+MEDIA_CACHE_MAX_BYTES = int(os.environ.get("MEDIA_CACHE_MAX_BYTES", str(512 * 1024 * 1024)))
+MEDIA_CACHE_MAX_IDS = int(os.environ.get("MEDIA_CACHE_MAX_IDS", "10000"))
+
+IDS_INDEX_NAME = "ids.log"  # Рядки "file_unique_id sha256", дописуються в кінець
+_INDEX_LINE = re.compile(r"^(\S+) ([0-9a-f]{64})$")
+STALE_TMP_SECONDS = 3600  # Тимчасові файли незавершених записів (після падіння процесу)
+
+
+class MediaCache:
+    """Дисковий кеш оброблених фото, адресований за хешем вмісту.
+
+    Файли зберігаються як <sha256>.<variant>.jpg; file_unique_id з Telegram
+    відображається на хеш (індекс у пам'яті та журнал ids.log у каталозі кешу),
+    тож повторне фото не завантажується знову і після перезапуску.
+    Розмір обмежено max_bytes (LRU), файли, що зараз публікуються, не витісняються.
+    Облік ведеться в пам'яті, а робота з диском (сканування, журнал, видалення) -
+    в окремих потоках, щоб не блокувати цикл подій.
+    """
+
+    def __init__(self, directory=MEDIA_CACHE_DIR, max_bytes=MEDIA_CACHE_MAX_BYTES, max_ids=MEDIA_CACHE_MAX_IDS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_ids = max_ids
+        self._files = None  # OrderedDict: шлях -> розмір (від найстарішого до найновішого)
+        self._ids = OrderedDict()  # file_unique_id -> sha256
+        self._index_lines = 0  # Рядків у ids.log (для стискання журналу)
+        self._leases = Counter()
+        self._index_lock = threading.Lock()  # Дописування та переписування ids.log з різних потоків
+        self._load_lock = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    async def load(self):
+        """Сканування каталогу в окремому потоці (один раз, до першого звернення до кешу)."""
+        if self._files is not None:
+            return
+        if self._load_lock is None:
+            self._load_lock = asyncio.Lock()
+        async with self._load_lock:
+            if self._files is None:
+                await asyncio.to_thread(self._ensure_loaded)
+
+    def _ensure_loaded(self):
+        """Індекс файлів будується один раз зі сканування каталогу (порядок - за mtime)."""
+        if self._files is not None:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        stale_before = time.time() - STALE_TMP_SECONDS
+        for entry in os.scandir(self.directory):
+            if not entry.is_file():
+                continue
+            stat = entry.stat()
+            if entry.name.endswith(".jpg"):
+                entries.append((stat.st_mtime, entry.path, stat.st_size))
+            elif entry.name.endswith(".tmp") and stat.st_mtime < stale_before:
+                self._remove(entry.path)
+        self._load_ids()
+        files = OrderedDict((path, size) for _, path, size in sorted(entries))
+        self.size = sum(files.values())
+        self._files = files  # Останнім: кеш вважається завантаженим лише після читання індексу
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, IDS_INDEX_NAME)
+
+    def _load_ids(self):
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                for line in f:
+                    match = _INDEX_LINE.match(line.rstrip("\n"))
+                    if match:  # Обірваний останній рядок (падіння під час запису) пропускається
+                        self._ids[match.group(1)] = match.group(2)
+                        self._ids.move_to_end(match.group(1))
+                        self._index_lines += 1
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            logger.warning(f"Не вдалося прочитати індекс кешу медіа: {e}")
+        while len(self._ids) > self.max_ids:
+            self._ids.popitem(last=False)
+
+    def _append_id(self, file_unique_id, content_hash):
+        """Дописує відповідність у журнал; коли він удвічі більший за індекс - переписує стисло."""
+        try:
+            with self._index_lock:
+                if self._index_lines >= 2 * self.max_ids:
+                    self._write_index()
+                else:
+                    with open(self.index_path, "a", encoding="utf-8") as f:
+                        f.write(f"{file_unique_id} {content_hash}\n")
+                    self._index_lines += 1
+        except OSError as e:
+            logger.warning(f"Не вдалося записати індекс кешу медіа: {e}")
+
+    def _write_index(self):
+        ids = list(self._ids.items())  # Знімок: індекс у пам'яті змінюється в циклі подій
+        data = "".join(f"{file_unique_id} {content_hash}\n" for file_unique_id, content_hash in ids)
+        self._write_atomic(self.index_path, data.encode("utf-8"))
+        self._index_lines = len(ids)
+
+    def path_for(self, content_hash, variant):
+        return os.path.join(self.directory, f"{content_hash}.{variant}.jpg")
+
+    def owns(self, path):
+        return os.path.dirname(os.path.abspath(path)) == os.path.abspath(self.directory)
+
+    def lookup(self, content_hash, variant):
+        """Шлях до кешованого варіанту або None."""
+        self._ensure_loaded()
+        path = self.path_for(content_hash, variant)
+        if path in self._files:
+            self._files.move_to_end(path)
+            self.hits += 1
+            return path
+        self.misses += 1
+        return None
+
+    def hash_for(self, file_unique_id):
+        self._ensure_loaded()
+        content_hash = self._ids.get(file_unique_id)
+        if content_hash is not None:
+            self._ids.move_to_end(file_unique_id)
+        return content_hash
+
+    async def remember_id(self, file_unique_id, content_hash):
+        await self.load()
+        known = self._ids.get(file_unique_id) == content_hash
+        self._ids[file_unique_id] = content_hash
+        self._ids.move_to_end(file_unique_id)
+        while len(self._ids) > self.max_ids:
+            self._ids.popitem(last=False)
+        if not known and _INDEX_LINE.match(f"{file_unique_id} {content_hash}"):
+            await asyncio.to_thread(self._append_id, file_unique_id, content_hash)
+
+    def _write_atomic(self, path, data):
+        # Унікальне тимчасове ім'я: одночасні записи того самого вмісту не пишуть в один файл
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            self._remove(tmp_path)
+            raise
+
+    def write(self, content_hash, variant, data):
+        """Атомарний запис файлу (виконується в окремому потоці)."""
+        path = self.path_for(content_hash, variant)
+        self._write_atomic(path, data)
+        return path
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def _remove_evicted(self, paths):
+        for path in paths:
+            if path in self._files:
+                continue  # Той самий вміст записано знову, поки видалення чекало в черзі
+            try:
+                self._remove(path)
+            except OSError as e:
+                logger.warning(f"Не вдалося видалити файл кешу медіа {path}: {e}")
+
+    async def add(self, path):
+        """Реєстрація записаного файлу та витіснення найстаріших за потреби.
+
+        Щоб щойно записаний файл не витіснився одразу, його треба захопити (acquire) до add.
+        """
+        await self.load()
+        size = await asyncio.to_thread(os.path.getsize, path)
+        self.size += size - self._files.get(path, 0)
+        self._files[path] = size
+        self._files.move_to_end(path)
+        evicted = self._evict()
+        if evicted:
+            await asyncio.to_thread(self._remove_evicted, evicted)
+
+    def acquire(self, path):
+        self._leases[path] += 1
+
+    def release(self, path):
+        self._leases[path] -= 1
+        if self._leases[path] <= 0:
+            del self._leases[path]
+        evicted = self._evict()
+        if evicted:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._remove_evicted(evicted)
+            else:
+                loop.run_in_executor(None, self._remove_evicted, evicted)
+
+    def _evict(self):
+        """Вилучає найстаріші незахоплені файли з обліку; повертає шляхи для видалення з диска."""
+        evicted = []
+        for path in list(self._files or ()):
+            if self.size <= self.max_bytes:
+                break
+            if self._leases[path]:
+                continue
+            size = self._files.pop(path)
+            self.size -= size
+            self.evictions += 1
+            evicted.append(path)
+        return evicted
+
+    def stats(self):
+        return {
+            "files": len(self._files or ()),
+            "ids": len(self._ids),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
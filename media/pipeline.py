@@ -0,0 +1,205 @@
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from .cache import MEDIA_CACHE_MAX_BYTES, MediaCache
+
+logger = logging.getLogger(__name__)
+
+
+def _default_spool_dir():
+    # tmpfs, якщо є, щоб не писати тимчасові файли на диск
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, "tgbot_media")
+
+
+MEDIA_SPOOL_DIR = os.environ.get("MEDIA_SPOOL_DIR") or _default_spool_dir()
+MEDIA_PROCESS_WORKERS = int(os.environ.get("MEDIA_PROCESS_WORKERS", "2"))
+MEDIA_MAX_UPLOAD_BYTES = int(os.environ.get("MEDIA_MAX_UPLOAD_BYTES", str(1536 * 1024)))
+
+# Обмеження Instagram: стрічка від 4:5 до 1.91:1 шириною до 1080, сторіс 9:16 1080x1920
+FEED_MIN_RATIO = 4 / 5
+FEED_MAX_RATIO = 1.91
+FEED_MAX_WIDTH = 1080
+STORY_SIZE = (1080, 1920)
+
+VARIANTS = ("feed", "story")
+ORIGINAL_VARIANT = "orig"  # Оригінал у кеші, з якого робляться інші варіанти
+
+
+def _crop_to_ratio(img, ratio):
+    """Центроване обрізання до співвідношення сторін ratio (ширина / висота)."""
+    width, height = img.size
+    if width / height > ratio:
+        new_width = round(height * ratio)
+        left = (width - new_width) // 2
+        return img.crop((left, 0, left + new_width, height))
+    new_height = round(width / ratio)
+    top = (height - new_height) // 2
+    return img.crop((0, top, width, top + new_height))
+
+
+def _encode_jpeg(img, max_bytes):
+    """JPEG не більше max_bytes: спершу знижуємо якість, потім розмір."""
+    from PIL import Image
+
+    while True:
+        for quality in (90, 85, 80, 75, 70, 65, 60):
+            out = BytesIO()
+            img.save(out, format="JPEG", quality=quality, optimize=True, progressive=True)
+            if out.tell() <= max_bytes:
+                return out.getvalue()
+        width, height = img.size
+        if width <= 320:
+            return out.getvalue()
+        img = img.resize((int(width * 0.85), int(height * 0.85)), Image.LANCZOS)
+
+
+def process_image(data, variant, max_bytes=MEDIA_MAX_UPLOAD_BYTES):
+    """Поворот за EXIF, обрізання під формат Instagram, зменшення та перекодування в JPEG.
+
+    Виконується в окремому процесі, тому приймає і повертає bytes (Pillow потрібен лише там).
+    """
+    from PIL import Image, ImageOps
+
+    img = Image.open(BytesIO(data))
+    img = ImageOps.exif_transpose(img)
+    if img.mode != "RGB":
+        img = img.convert("RGB")
+
+    if variant == "story":
+        img = ImageOps.fit(img, STORY_SIZE, Image.LANCZOS)
+    else:
+        ratio = img.width / img.height
+        if ratio < FEED_MIN_RATIO:
+            img = _crop_to_ratio(img, FEED_MIN_RATIO)
+        elif ratio > FEED_MAX_RATIO:
+            img = _crop_to_ratio(img, FEED_MAX_RATIO)
+        if img.width > FEED_MAX_WIDTH:
+            img = img.resize((FEED_MAX_WIDTH, round(img.height * FEED_MAX_WIDTH / img.width)), Image.LANCZOS)
+
+    return _encode_jpeg(img, max_bytes)
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class MediaPipeline:
+    """Завантаження фото з Telegram у пам'ять, обробка в пулі процесів і запис готового файлу.
+
+    З кешем готові файли зберігаються за хешем вмісту і повторно використовуються;
+    без кешу (MEDIA_CACHE_MAX_BYTES=0) - пишуться в spool і видаляються після публікації.
+    """
+
+    def __init__(self, spool_dir=MEDIA_SPOOL_DIR, workers=MEDIA_PROCESS_WORKERS, cache=None):
+        self.spool_dir = spool_dir
+        self.workers = workers
+        self.cache = cache
+        self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            # forkserver/spawn: не форкаємо процес з уже запущеними потоками
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._pool
+
+    @staticmethod
+    async def download(telegram_file):
+        """Завантаження файлу Telegram одразу в пам'ять (без тимчасового файлу в CWD)."""
+        buffer = BytesIO()
+        await telegram_file.download_to_memory(out=buffer)
+        return buffer.getvalue()
+
+    async def process(self, data, variant):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_pool(), process_image, data, variant)
+
+    async def prepare(self, photo, variant="feed"):
+        """Повний цикл: завантаження -> обробка -> файл. Повертає шлях, який треба звільнити через release.
+
+        photo - PhotoSize/Document з Telegram; файл запитується лише якщо його немає в кеші.
+        """
+        if self.cache is None:
+            data = await self.download(await photo.get_file())
+            processed = await self.process(data, variant)
+            return await asyncio.to_thread(self._write, processed, variant)
+
+        # Те саме фото вже надсилалось: не завантажуємо і не обробляємо повторно
+        await self.cache.load()
+        content_hash = self.cache.hash_for(photo.file_unique_id)
+        path = self.cache.lookup(content_hash, variant) if content_hash else None
+        if path is None:
+            data = await self._load_original(photo, content_hash)
+            content_hash = hashlib.sha256(data).hexdigest()
+            await self.cache.remember_id(photo.file_unique_id, content_hash)
+            # Інший file_unique_id, але той самий вміст
+            path = self.cache.lookup(content_hash, variant)
+            if path is None:
+                processed = await self.process(data, variant)
+                path = await asyncio.to_thread(self.cache.write, content_hash, variant, processed)
+                # Захоплюємо до add: витіснення не видалить файл, який ми повертаємо
+                self.cache.acquire(path)
+                try:
+                    await self.cache.add(path)
+                except BaseException:
+                    self.cache.release(path)
+                    raise
+                return path
+        self.cache.acquire(path)
+        return path
+
+    async def _load_original(self, photo, content_hash):
+        """Оригінал з кешу (для нового варіанту того ж фото) або з Telegram зі збереженням у кеш."""
+        original_path = self.cache.lookup(content_hash, ORIGINAL_VARIANT) if content_hash else None
+        if original_path is not None:
+            self.cache.acquire(original_path)
+            try:
+                return await asyncio.to_thread(_read_file, original_path)
+            finally:
+                self.cache.release(original_path)
+
+        data = await self.download(await photo.get_file())
+        original_hash = hashlib.sha256(data).hexdigest()
+        if self.cache.lookup(original_hash, ORIGINAL_VARIANT) is None:
+            original_path = await asyncio.to_thread(self.cache.write, original_hash, ORIGINAL_VARIANT, data)
+            await self.cache.add(original_path)
+        return data
+
+    def _write(self, data, variant):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix=f"{variant}_", suffix=".jpg", dir=self.spool_dir)
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        return path
+
+    def retain(self, path):
+        """Повторно захоплює кешований файл (стан діалогу, відновлений після рестарту)."""
+        if self.cache is not None and self.cache.owns(path):
+            self.cache.acquire(path)
+
+    def release(self, path):
+        """Звільнення файлу після публікації: кешований лишається в кеші, тимчасовий видаляється."""
+        if self.cache is not None and self.cache.owns(path):
+            self.cache.release(path)
+            return
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+media_pipeline = MediaPipeline(cache=MediaCache() if MEDIA_CACHE_MAX_BYTES > 0 else None)
@@ -0,0 +1,251 @@
+import functools
+import json
+import logging
+import os
+import random
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Локальний HTTP-ендпоінт з метриками у форматі Prometheus (порт 0 - вимкнено)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "9108"))
+
+# Частка оновлень, що логуються (структурований JSON без тексту повідомлень)
+UPDATE_LOG_SAMPLE_RATE = float(os.environ.get("UPDATE_LOG_SAMPLE_RATE", "0.01"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape_label(value):
+    """Значення мітки за текстовим форматом Prometheus: екрануються зворотна коса риска, лапки та перенесення рядка."""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape_label(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._values = {}  # tuple(значення міток) -> значення
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.label_names)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+    def render(self):
+        lines = self.header()
+        for key, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.label_names, key)} {value}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def total(self):
+        """Сума по всіх значеннях міток."""
+        return sum(self._values.values())
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        self._values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            # Лічильники по кошиках (не кумулятивні) + +Inf, сума
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def render(self):
+        lines = self.header()
+        for key, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                labels = _format_labels(self.label_names + ("le",), key + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Реєстр метрик процесу; render() віддає текстовий формат Prometheus."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = {}  # префікс -> функція, що повертає dict зі значеннями
+
+    def _register(self, metric):
+        self._metrics.setdefault(metric.name, metric)
+        return self._metrics[metric.name]
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def gauge(self, name, documentation, labels=()):
+        return self._register(Gauge(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def register_collector(self, prefix, collect):
+        """Числові значення з collect() (наприклад, stats() компонента) віддаються як gauge при кожному запиті."""
+        self._collectors[prefix] = collect
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for prefix, collect in self._collectors.items():
+            try:
+                values = collect()
+            except Exception as e:
+                logger.warning(f"Не вдалося зібрати метрики {prefix}: {e}")
+                continue
+            for key, value in values.items():
+                if isinstance(value, (int, float)):
+                    lines.append(f"# TYPE {prefix}_{key} gauge")
+                    lines.append(f"{prefix}_{key} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = MetricsRegistry()
+
+HANDLER_LATENCY = metrics.histogram("tgbot_handler_seconds", "Час обробки оновлення обробником", ["handler"])
+HANDLER_ERRORS = metrics.counter("tgbot_handler_errors_total", "Помилки в обробниках", ["handler"])
+HANDLER_IN_FLIGHT = metrics.gauge("tgbot_handler_in_flight", "Оновлення, що зараз обробляються", ["handler"])
+
+EXTERNAL_LATENCY = metrics.histogram(
+    "tgbot_external_call_seconds", "Час зовнішніх викликів", ["service", "operation"])
+EXTERNAL_ERRORS = metrics.counter(
+    "tgbot_external_call_errors_total", "Помилки зовнішніх викликів", ["service", "operation"])
+EXTERNAL_IN_FLIGHT = metrics.gauge("tgbot_external_call_in_flight", "Зовнішні виклики в процесі", ["service"])
+
+
+@asynccontextmanager
+async def track(service, operation):
+    """Вимірює зовнішній виклик: async with track("deepseek", "chat"): ..."""
+    EXTERNAL_IN_FLIGHT.inc(service=service)
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        EXTERNAL_ERRORS.inc(service=service, operation=operation)
+        raise
+    finally:
+        EXTERNAL_LATENCY.observe(time.perf_counter() - started, service=service, operation=operation)
+        EXTERNAL_IN_FLIGHT.dec(service=service)
+
+
+def instrument_handler(handler, name=None):
+    """Обгортка обробника PTB: затримка, помилки та кількість одночасних викликів."""
+    name = name or handler.__name__
+
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        HANDLER_IN_FLIGHT.inc(handler=name)
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started, handler=name)
+            HANDLER_IN_FLIGHT.dec(handler=name)
+
+    return wrapper
+
+
+async def log_update(update, context):
+    """Вибірковий структурований лог оновлень (замість print повного repr кожного оновлення)."""
+    if random.random() >= UPDATE_LOG_SAMPLE_RATE:
+        return
+    message = update.effective_message
+    record = {
+        "update_id": update.update_id,
+        "type": next((name for name in ("message", "edited_message", "callback_query", "inline_query")
+                      if getattr(update, name, None) is not None), "other"),
+        "user_id": update.effective_user.id if update.effective_user else None,
+        "chat_id": update.effective_chat.id if update.effective_chat else None,
+    }
+    if message is not None:
+        record["text_len"] = len(message.text or message.caption or "")
+        record["photo"] = bool(message.photo)
+        record["media_group"] = message.media_group_id is not None
+    if update.callback_query is not None:
+        record["callback_data"] = update.callback_query.data
+    logger.info(json.dumps(record))
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, що вимірює кожен виклик Bot API (sendMessage, editMessageText, ...)."""
+
+    async def do_request(self, url, method, *args, **kwargs):
+        operation = url.rsplit("/", 1)[-1]
+        async with track("telegram", operation):
+            code, payload = await super().do_request(url, method, *args, **kwargs)
+        if code >= 400:
+            EXTERNAL_ERRORS.inc(service="telegram", operation=operation)
+        return code, payload
+
+
+async def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Запускає GET /metrics. Повертає aiohttp AppRunner (для cleanup) або None, якщо вимкнено."""
+    if not port:
+        return None
+    from aiohttp import web
+
+    async def handle_metrics(request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Метрики доступні на http://{host}:{port}/metrics")
+    return runner
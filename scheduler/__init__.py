@@ -1 +1,2 @@
+from .bulk_import import BulkImporter, ManifestError
 from .scheduler import PostScheduler
\ No newline at end of file
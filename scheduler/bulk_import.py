@@ -0,0 +1,355 @@
+"""Масовий імпорт запланованих постів з маніфесту (CSV у ZIP-архіві з фото або CSV з URL фото).
+
+Маніфест читається потоково пакетами по IMPORT_BATCH_SIZE рядків: фото пакета обробляються
+паралельно (пул процесів media_pipeline), а пости пакета додаються однією транзакцією.
+"""
+import asyncio
+import csv
+import io
+import ipaddress
+import itertools
+import logging
+import os
+import posixpath
+import socket
+import uuid
+import zipfile
+from datetime import datetime
+
+import httpx
+
+from database import session_scope
+from database.crud import add_scheduled_posts
+from media import media_pipeline
+
+logger = logging.getLogger(__name__)
+
+# Підготовлені фото імпортованих постів (видаляються після публікації)
+IMPORT_DIR = os.environ.get("IMPORT_DIR") or os.path.join(os.path.expanduser("~"), ".local", "share", "tgbot_imports")
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", "200"))
+IMPORT_MAX_ROWS = int(os.environ.get("IMPORT_MAX_ROWS", "5000"))
+IMPORT_CONCURRENCY = int(os.environ.get("IMPORT_CONCURRENCY", "8"))  # фото, що завантажуються/обробляються одночасно
+IMPORT_MAX_IMAGE_BYTES = int(os.environ.get("IMPORT_MAX_IMAGE_BYTES", str(30 * 1024 * 1024)))
+IMPORT_DOWNLOAD_TIMEOUT = float(os.environ.get("IMPORT_DOWNLOAD_TIMEOUT", "30"))
+IMPORT_MAX_REDIRECTS = 5
+
+MANIFEST_NAME = "manifest.csv"
+CAPTION_MAX_LENGTH = 2200  # Обмеження Instagram
+TIME_FORMATS = ("%d.%m.%Y %H:%M", "%d.%m.%Y %H:%M:%S")  # Крім ISO (2024-05-01 10:00)
+
+# Назви колонок маніфесту (без урахування регістру)
+COLUMN_ALIASES = {
+    "image": ("image", "photo", "file", "url", "фото"),
+    "caption": ("caption", "text", "опис"),
+    "time": ("time", "scheduled_time", "datetime", "час"),
+}
+
+
+class ManifestError(Exception):
+    """Маніфест не можна імпортувати (формат файлу, колонки)."""
+
+
+class ImportReport:
+    """Підсумок імпорту: кількість рядків, доданих постів і помилки по рядках."""
+
+    MAX_ERRORS = 20  # Скільки помилок показувати користувачу
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []  # (номер рядка, причина)
+        self.truncated = False
+
+    def error(self, line, reason):
+        self.failed += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append((line, reason))
+
+    def summary(self):
+        lines = [f"Рядків: {self.rows}, заплановано постів: {self.imported}, з помилками: {self.failed}."]
+        if self.truncated:
+            lines.append(f"Імпортовано лише перші {IMPORT_MAX_ROWS} рядків.")
+        lines += [f"Рядок {line}: {reason}" for line, reason in sorted(self.errors)]
+        if self.failed > len(self.errors):
+            lines.append(f"...та ще {self.failed - len(self.errors)}")
+        return "\n".join(lines)
+
+
+def parse_time(value):
+    """Час публікації з маніфесту -> локальний час без часового поясу (як у планувальника)."""
+    value = value.strip()
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        pass
+    else:
+        # 2030-05-01T10:00+02:00 -> відповідний локальний час сервера
+        return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo is not None else parsed
+    for time_format in TIME_FORMATS:
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    raise ValueError(f"невідомий формат часу «{value}» (очікується 2024-05-01 10:00 або 01.05.2024 10:00)")
+
+
+def _column_indexes(header):
+    names = [name.strip().lower() for name in header]
+    indexes = {}
+    for column, aliases in COLUMN_ALIASES.items():
+        index = next((names.index(alias) for alias in aliases if alias in names), None)
+        if index is None:
+            raise ManifestError(f"у маніфесті немає колонки {column} (є: {', '.join(header)})")
+        indexes[column] = index
+    return indexes
+
+
+def read_manifest(stream):
+    """Генератор (номер рядка, image, caption, час або ValueError) з текстового потоку CSV.
+
+    Роздільник (кома, крапка з комою або табуляція) визначається за заголовком.
+    """
+    header_line = stream.readline()
+    if not header_line.strip():
+        raise ManifestError("маніфест порожній")
+    try:
+        dialect = csv.Sniffer().sniff(header_line, delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    reader = csv.reader(itertools.chain([header_line], stream), dialect)
+    indexes = _column_indexes(next(reader))
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        line = reader.line_num
+        try:
+            if len(row) <= max(indexes.values()):
+                raise ValueError("не вистачає колонок")
+            image = row[indexes["image"]].strip()
+            caption = row[indexes["caption"]].strip()
+            if not image:
+                raise ValueError("не вказано фото")
+            if len(caption) > CAPTION_MAX_LENGTH:
+                raise ValueError(f"опис довший за {CAPTION_MAX_LENGTH} символів")
+            yield line, image, caption, parse_time(row[indexes["time"]])
+        except ValueError as e:
+            yield line, None, None, e
+
+
+class ManifestSource:
+    """Джерело імпорту: ZIP (manifest.csv + фото) або CSV, де колонка image - URL фото."""
+
+    def __init__(self, path):
+        self.path = path
+        self._zip = None
+        self._base = ""
+        self._stream = None
+        self._zip_lock = asyncio.Lock()  # Читання з одного ZipFile - по черзі
+        self._http = None
+
+    def open(self):
+        """Відкриває файл і повертає генератор рядків маніфесту (виконується в потоці)."""
+        if zipfile.is_zipfile(self.path):
+            self._zip = zipfile.ZipFile(self.path)
+            names = [name for name in self._zip.namelist()
+                     if posixpath.basename(name).lower() == MANIFEST_NAME and "__MACOSX" not in name]
+            if not names:
+                raise ManifestError(f"в архіві немає {MANIFEST_NAME}")
+            manifest = min(names, key=len)  # Найближчий до кореня архіву
+            self._base = posixpath.dirname(manifest)
+            self._stream = io.TextIOWrapper(self._zip.open(manifest), encoding="utf-8-sig", newline="")
+        else:
+            self._stream = open(self.path, encoding="utf-8-sig", newline="")
+        return read_manifest(self._stream)
+
+    def _read_member(self, name):
+        name = posixpath.normpath(posixpath.join(self._base, name.replace("\\", "/").lstrip("/")))
+        try:
+            info = self._zip.getinfo(name)
+        except KeyError:
+            raise ValueError(f"файлу {name} немає в архіві") from None
+        if info.file_size > IMPORT_MAX_IMAGE_BYTES:
+            raise ValueError(f"файл {name} завеликий")
+        return self._zip.read(info)
+
+    @staticmethod
+    async def _check_host(url):
+        """Дозволені лише публічні адреси: посилання з маніфесту не повинні вести у внутрішню мережу
+        (localhost, метрики, приватні підмережі). Перевіряються всі адреси, у які резолвиться хост;
+        повертається перевірена адреса, з якою й треба з'єднуватись."""
+        if url.scheme not in ("http", "https") or not url.host:
+            raise ValueError("для CSV без архіву фото вказується посиланням http(s)://")
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(url.host, None, type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            raise ValueError(f"не вдалося знайти хост {url.host}") from None
+        for info in infos:
+            address = ipaddress.ip_address(info[4][0].split("%", 1)[0])
+            if getattr(address, "ipv4_mapped", None) is not None:
+                address = address.ipv4_mapped
+            if not address.is_global or address.is_multicast:
+                raise ValueError(f"посилання на внутрішню адресу ({url.host}) заборонені")
+        return infos[0][4][0]
+
+    async def _download(self, url):
+        if self._http is None:
+            # Перенаправлення - вручну, щоб перевірити адресу кожного з них
+            self._http = httpx.AsyncClient(timeout=IMPORT_DOWNLOAD_TIMEOUT, follow_redirects=False)
+        try:
+            url = httpx.URL(url)
+        except httpx.InvalidURL:
+            raise ValueError("некоректне посилання на фото") from None
+        for _ in range(IMPORT_MAX_REDIRECTS + 1):
+            address = await self._check_host(url)
+            # З'єднання - з уже перевіреною адресою, а не з повторно знайденою httpx
+            # (інакше хост може змінити DNS-відповідь між перевіркою і запитом)
+            request = self._http.build_request(
+                "GET", url.copy_with(host=address), headers={"Host": url.netloc.decode("ascii")},
+                extensions={"sni_hostname": url.raw_host.decode("ascii")})
+            response = await self._http.send(request, stream=True)
+            try:
+                if response.is_redirect:
+                    url = url.join(response.headers["location"])
+                    continue
+                if response.status_code != 200:
+                    raise ValueError(f"не вдалося завантажити фото (HTTP {response.status_code})")
+                chunks = []
+                size = 0
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if size > IMPORT_MAX_IMAGE_BYTES:
+                        raise ValueError("фото за посиланням завелике")
+                    chunks.append(chunk)
+                return b"".join(chunks)
+            finally:
+                await response.aclose()
+        raise ValueError("забагато перенаправлень")
+
+    async def load_image(self, image):
+        if self._zip is not None:
+            async with self._zip_lock:
+                return await asyncio.to_thread(self._read_member, image)
+        try:
+            return await self._download(image)
+        except httpx.HTTPError as e:
+            raise ValueError(f"не вдалося завантажити фото: {e}") from None
+
+    async def close(self):
+        if self._http is not None:
+            await self._http.aclose()
+        if self._stream is not None:
+            await asyncio.to_thread(self._stream.close)
+        if self._zip is not None:
+            self._zip.close()
+
+
+def _remove_images(paths):
+    for path in paths:
+        release_imported_image(path)
+
+
+def _write_image(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+class BulkImporter:
+    """Імпорт маніфесту для одного користувача (User.id) з повідомленням про прогрес після кожного пакета."""
+
+    def __init__(self, user_id, telegram_id, source_path, on_progress=None, session_factory=None,
+                 batch_size=IMPORT_BATCH_SIZE, max_rows=IMPORT_MAX_ROWS):
+        self.user_id = user_id
+        self.telegram_id = telegram_id
+        self.source = ManifestSource(source_path)
+        self.on_progress = on_progress  # async callback(report)
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_rows = max_rows
+        self.import_id = uuid.uuid4().hex[:12]
+        self.directory = os.path.join(IMPORT_DIR, str(telegram_id))
+        self.report = ImportReport()
+        self._slots = asyncio.Semaphore(IMPORT_CONCURRENCY)
+
+    async def _prepare(self, line, image):
+        """Фото рядка -> підготовлений для стрічки JPEG у IMPORT_DIR."""
+        async with self._slots:
+            data = await self.source.load_image(image)
+            try:
+                processed = await media_pipeline.process(data, "feed")
+            except Exception:
+                raise ValueError("файл не є зображенням або пошкоджений") from None
+            path = os.path.join(self.directory, f"{self.import_id}_{line}.jpg")
+            await asyncio.to_thread(_write_image, path, processed)
+            return path
+
+    async def _import_batch(self, batch, now):
+        rows = []
+        for line, image, caption, scheduled_time in batch:
+            if isinstance(scheduled_time, ValueError):
+                self.report.error(line, str(scheduled_time))
+            elif scheduled_time < now:
+                self.report.error(line, f"час {scheduled_time:%d.%m.%Y %H:%M} уже минув")
+            else:
+                rows.append((line, image, caption, scheduled_time))
+
+        results = await asyncio.gather(*(self._prepare(line, image) for line, image, _, _ in rows),
+                                       return_exceptions=True)
+        posts = []
+        for (line, _, caption, scheduled_time), result in zip(rows, results):
+            if isinstance(result, ValueError):
+                self.report.error(line, str(result))
+            elif isinstance(result, Exception):
+                logger.error(f"Імпорт {self.import_id}, рядок {line}: {result}")
+                self.report.error(line, "не вдалося обробити фото")
+            else:
+                posts.append({"image_path": result, "caption": caption, "scheduled_time": scheduled_time})
+
+        try:
+            async with session_scope(self.session_factory) as session:
+                await add_scheduled_posts(session, self.user_id, posts)
+        except Exception:
+            # Пости пакета не додано - їхні фото ніхто не опублікує і не видалить
+            await asyncio.to_thread(_remove_images, [post["image_path"] for post in posts])
+            raise
+        self.report.imported += len(posts)
+
+    async def run(self):
+        """Імпортує весь маніфест. ManifestError - якщо файл не вдалося прочитати як маніфест."""
+        try:
+            try:
+                rows = await asyncio.to_thread(self.source.open)
+            except (zipfile.BadZipFile, UnicodeDecodeError, csv.Error) as e:
+                raise ManifestError(f"не вдалося прочитати файл: {e}") from None
+            now = datetime.now()
+            while True:
+                try:
+                    batch = await asyncio.to_thread(list, itertools.islice(rows, self.batch_size))
+                except (UnicodeDecodeError, csv.Error) as e:
+                    raise ManifestError(f"помилка читання маніфесту: {e}") from None
+                if not batch:
+                    break
+                if self.report.rows + len(batch) > self.max_rows:
+                    batch = batch[:self.max_rows - self.report.rows]
+                    self.report.truncated = True
+                self.report.rows += len(batch)
+                await self._import_batch(batch, now)
+                if self.on_progress is not None:
+                    await self.on_progress(self.report)
+                if self.report.truncated:
+                    break
+            logger.info(f"Імпорт {self.import_id} для {self.telegram_id}: "
+                        f"{self.report.imported} з {self.report.rows} рядків")
+            return self.report
+        finally:
+            await self.source.close()
+
+
+def release_imported_image(path):
+    """Видаляє фото імпортованого поста після публікації (інші файли не чіпає)."""
+    if path and os.path.commonpath([os.path.abspath(path), os.path.abspath(IMPORT_DIR)]) == os.path.abspath(IMPORT_DIR):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
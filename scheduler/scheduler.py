@@ -1,45 +1,297 @@
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from instagrapi import Client
+from api.executor import throttle_errors
+from scheduler.bulk_import import release_imported_image
+from database import session_scope
+from database.crud import add_scheduled_post_listener, get_due_posts, remove_scheduled_post_listener
 from database.models import ScheduledPost
-from database.crud import get_scheduled_posts
-from datetime import datetime
-from database.models import ScheduledPost, User  # Додано User
+from datetime import datetime, timedelta
+from sqlalchemy.orm import selectinload
 import asyncio
+import heapq
+import logging
+import os
+import random
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Вікно наперед, у межах якого пости з БД тримаються в пам'яті
+SCHEDULER_LOOKAHEAD = int(os.environ.get("SCHEDULER_LOOKAHEAD", "300"))  # секунди
+# Скільки постів різних акаунтів публікується одночасно
+SCHEDULER_PUBLISH_WORKERS = int(os.environ.get("SCHEDULER_PUBLISH_WORKERS", "4"))
+# Повторні спроби невдалих публікацій: експоненційна затримка з jitter
+SCHEDULER_MAX_ATTEMPTS = int(os.environ.get("SCHEDULER_MAX_ATTEMPTS", "5"))
+SCHEDULER_RETRY_BASE = int(os.environ.get("SCHEDULER_RETRY_BASE", "60"))  # секунди
+SCHEDULER_THROTTLE_RETRY_BASE = int(os.environ.get("SCHEDULER_THROTTLE_RETRY_BASE", "300"))
+SCHEDULER_RETRY_MAX_DELAY = int(os.environ.get("SCHEDULER_RETRY_MAX_DELAY", str(6 * 60 * 60)))
+# Пауза перед повторною звіркою з БД, якщо вона не вдалась (БД недоступна)
+SCHEDULER_RECONCILE_RETRY = int(os.environ.get("SCHEDULER_RECONCILE_RETRY", "30"))  # секунди
+
+
+def retry_delay(attempt, throttled=False):
+    """Затримка перед спробою attempt+1: base * 2^(attempt-1), з них половина - випадкова."""
+    base = SCHEDULER_THROTTLE_RETRY_BASE if throttled else SCHEDULER_RETRY_BASE
+    delay = min(SCHEDULER_RETRY_MAX_DELAY, base * 2 ** (attempt - 1))
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+class PublishStats:
+    """Затримки публікації та відставання черги (від запланованого часу до початку публікації)."""
+
+    def __init__(self):
+        self.published = 0
+        self.failed = 0
+        self.retried = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+
+    def record(self, latency, lag, ok):
+        if ok:
+            self.published += 1
+        else:
+            self.failed += 1
+        self.total_latency += latency
+        self.max_latency = max(self.max_latency, latency)
+        self.total_lag += lag
+        self.max_lag = max(self.max_lag, lag)
+
+    def as_dict(self):
+        count = self.published + self.failed
+        return {
+            "published": self.published,
+            "failed": self.failed,
+            "retried": self.retried,
+            "avg_latency_seconds": self.total_latency / count if count else 0.0,
+            "max_latency_seconds": self.max_latency,
+            "avg_lag_seconds": self.total_lag / count if count else 0.0,
+            "max_lag_seconds": self.max_lag,
+        }
+
 
 class PostScheduler:
-    def __init__(self, db_session, telegram_bot):
-        self.scheduler = AsyncIOScheduler()
-        self.db_session = db_session
+    """Планувальник публікацій: купа найближчих постів у пам'яті та пробудження точно в час.
+
+    З БД вибираються лише пости в межах вікна SCHEDULER_LOOKAHEAD; нові пости з
+    crud.add_scheduled_post потрапляють у купу одразу через підписку. Пости, час яких
+    настав, стають у чергу свого акаунта; кожну чергу розбирає окрема задача, тож пости
+    одного акаунта публікуються по черзі, а багато постів одного акаунта (масовий імпорт)
+    не затримують інші акаунти. Одночасних публікацій - не більше workers, через
+    клієнти з реєстру (один залогінений клієнт на акаунт). Невдалі публікації переносяться в БД на пізніший
+    час з експоненційною затримкою, доки не вичерпано SCHEDULER_MAX_ATTEMPTS спроб.
+    """
+
+    def __init__(self, session_factory, telegram_bot, registry, lookahead=SCHEDULER_LOOKAHEAD,
+                 workers=SCHEDULER_PUBLISH_WORKERS, shard=None):
+        self.session_factory = session_factory
+        self.shard = shard  # (номер, кількість): публікуються лише пости користувачів цього шарду
         self.bot = telegram_bot
-        self.instagram_client = Client()
+        self.registry = registry
+        self.lookahead = timedelta(seconds=lookahead)
+        self.workers = workers
+        self._heap = []  # (scheduled_time, post_id, user_id)
+        self._queued = set()  # Пости в купі, черзі або в процесі публікації
+        self._window_end = None
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(workers)
+        self._accounts = {}  # User.id -> deque (post_id, scheduled_time), час яких настав
+        self._drains = {}  # User.id -> задача, що публікує пости акаунта по черзі
+        self._uploaded = set()  # Опубліковані в Instagram, але позначка posted ще не записана в БД
+        self._markers = set()  # Задачі повторного запису позначки posted
+        self._tasks = []
+        self.stats = PublishStats()
+
+    def notify(self, post_id, scheduled_time, user_id):
+        """Новий пост: якщо він у поточному вікні - додаємо в купу та будимо цикл."""
+        if self._window_end is not None and scheduled_time <= self._window_end:
+            self._push(post_id, scheduled_time, user_id)
+        self._wakeup.set()
 
-    async def check_posts(self):
-        """Перевірка запланованих постів"""
-        posts = get_scheduled_posts(self.db_session)
+    def _push(self, post_id, scheduled_time, user_id):
+        if post_id not in self._queued and post_id not in self._uploaded:
+            self._queued.add(post_id)
+            heapq.heappush(self._heap, (scheduled_time, post_id, user_id))
+
+    async def reconcile(self):
+        """Звірка з БД: усі неопубліковані пости до кінця нового вікна (в т.ч. прострочені після рестарту)."""
+        window_end = datetime.now() + self.lookahead
+        async with session_scope(self.session_factory) as session:
+            posts = await get_due_posts(session, window_end, shard=self.shard)
+        self._window_end = window_end  # Лише після успішного читання, інакше пости вікна загубляться
         for post in posts:
-            if post.scheduled_time <= datetime.now() and not post.posted:
-                await self.publish_post(post)
+            self._push(post.id, post.scheduled_time, post.user_id)
+
+    def queue_lag(self):
+        """Скільки секунд чекає найстаріший пост, час якого вже настав (у купі або в черзі акаунта)."""
+        now = datetime.now()
+        oldest = [posts[0][1] for posts in self._accounts.values() if posts]
+        if self._heap:
+            oldest.append(self._heap[0][0])
+        due = [scheduled_time for scheduled_time in oldest if scheduled_time <= now]
+        return (now - min(due)).total_seconds() if due else 0.0
+
+    def stats_dict(self):
+        """Статистика публікацій разом із поточним відставанням черги (для /metrics)."""
+        return {
+            **self.stats.as_dict(),
+            "queue_lag_seconds": self.queue_lag(),
+            "queued": len(self._queued),
+            "pending_marks": len(self._uploaded),
+        }
+
+    async def _reconcile_until_done(self):
+        """Звірка з БД; помилка не зупиняє планувальник - повтор через SCHEDULER_RECONCILE_RETRY."""
+        while True:
+            try:
+                await self.reconcile()
+                return
+            except Exception as e:
+                logger.error(f"Помилка читання запланованих постів, повтор через {SCHEDULER_RECONCILE_RETRY} с: {e}")
+                await asyncio.sleep(SCHEDULER_RECONCILE_RETRY)
 
-    async def publish_post(self, post):
-        """Публікація поста"""
+    async def _run(self):
+        await self._reconcile_until_done()
+        while True:
+            self._wakeup.clear()
+            now = datetime.now()
+            if now >= self._window_end:
+                await self._reconcile_until_done()
+                continue
+
+            # Пости, час яких настав, - у черги їхніх акаунтів
+            while self._heap and self._heap[0][0] <= now:
+                scheduled_time, post_id, user_id = heapq.heappop(self._heap)
+                self._enqueue(post_id, scheduled_time, user_id)
+
+            next_at = min(self._heap[0][0], self._window_end) if self._heap else self._window_end
+            timeout = max((next_at - datetime.now()).total_seconds(), 0)
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def _enqueue(self, post_id, scheduled_time, user_id):
+        self._accounts.setdefault(user_id, deque()).append((post_id, scheduled_time))
+        if user_id not in self._drains:
+            self._drains[user_id] = asyncio.get_running_loop().create_task(self._drain(user_id))
+
+    async def _drain(self, user_id):
+        """Публікує пости акаунта по черзі, доки його черга не спорожніє."""
+        posts = self._accounts[user_id]
+        try:
+            while posts:
+                post_id, _ = posts.popleft()
+                retry_at = None
+                try:
+                    async with self._slots:
+                        retry_at = await self.publish_post(post_id)
+                except Exception as e:
+                    logger.error(f"Помилка публікації запланованого поста {post_id}: {e}")
+                finally:
+                    self._queued.discard(post_id)
+                if retry_at is not None:
+                    self.notify(post_id, retry_at, user_id)
+        finally:
+            del self._accounts[user_id]
+            del self._drains[user_id]
+
+    async def publish_post(self, post_id):
+        """Публікація поста. Повертає час наступної спроби, якщо публікацію перенесено."""
+        if post_id in self._uploaded:
+            return  # Уже опубліковано, чекає лише на позначку в БД
+        async with session_scope(self.session_factory) as session:
+            post = await session.get(ScheduledPost, post_id, options=[selectinload(ScheduledPost.user)])
+            if post is None or post.posted or post.failed:
+                return
+            telegram_id = post.user.telegram_id
+            image_path, caption, scheduled_time = post.image_path, post.caption, post.scheduled_time
+
+        lag = max((datetime.now() - scheduled_time).total_seconds(), 0.0)
+        started = time.monotonic()
+        ok = False
+        error = None
+        try:
+            # Клієнт акаунта з реєстру: сесія відновлюється з БД без повторного логіну
+            insta_api = await self.registry.get(telegram_id)
+            if not insta_api.is_logged_in:
+                raise Exception("Користувач не авторизований")
+            await insta_api.post_photo(image_path, caption)
+            ok = True
+        except Exception as e:
+            error = e
+            logger.warning(f"Не вдалося опублікувати пост {post_id}: {e}")
+        finally:
+            self.stats.record(time.monotonic() - started, lag, ok)
+
+        if not ok:
+            return await self._schedule_retry(post_id, telegram_id, error, image_path)
+
+        # Пост уже в Instagram: помилка запису в БД не повинна призвести до повторної публікації
+        self._uploaded.add(post_id)
         try:
-            # Виконання синхронного коду в окремому потоці
-            await asyncio.to_thread(
-                self.instagram_client.login,
-                post.user.instagram_username,
-                post.user.session_data
-            )
-            await asyncio.to_thread(
-                self.instagram_client.photo_upload,
-                post.image_path,
-                post.caption
-            )
-            post.posted = True
-            self.db_session.commit()
-            await self.bot.send_message(post.user.telegram_id, "✅ Пост успішно опубліковано!")
+            await self._mark_posted(post_id)
         except Exception as e:
-            await self.bot.send_message(post.user.telegram_id, f"❌ Помилка публікації: {e}")
+            logger.error(f"Не вдалося позначити пост {post_id} опублікованим, повтор через "
+                         f"{SCHEDULER_RECONCILE_RETRY} с: {e}")
+            task = asyncio.get_running_loop().create_task(self._mark_posted_until_done(post_id))
+            self._markers.add(task)
+            task.add_done_callback(self._markers.discard)
+        release_imported_image(image_path)  # Фото з масового імпорту більше не потрібне
+        await self.bot.send_message(telegram_id, "✅ Пост успішно опубліковано!")
+        return None
+
+    async def _mark_posted(self, post_id):
+        async with session_scope(self.session_factory) as session:
+            post = await session.get(ScheduledPost, post_id)
+            if post is not None:
+                post.posted = True
+        self._uploaded.discard(post_id)
+
+    async def _mark_posted_until_done(self, post_id):
+        while True:
+            await asyncio.sleep(SCHEDULER_RECONCILE_RETRY)
+            try:
+                await self._mark_posted(post_id)
+                return
+            except Exception as e:
+                logger.error(f"Повторна спроба позначити пост {post_id} опублікованим не вдалась: {e}")
+
+    async def _schedule_retry(self, post_id, telegram_id, error, image_path=None):
+        """Переносить пост на пізніше (в БД) або позначає як невдалий після останньої спроби."""
+        async with session_scope(self.session_factory) as session:
+            post = await session.get(ScheduledPost, post_id)
+            if post is None:
+                return None  # Пост видалено між спробами
+            post.attempts = (post.attempts or 0) + 1
+            post.last_error = str(error)[:500]
+            attempts = post.attempts
+            if attempts >= SCHEDULER_MAX_ATTEMPTS:
+                post.failed = True
+                retry_at = None
+            else:
+                retry_at = datetime.now() + timedelta(
+                    seconds=retry_delay(attempts, throttled=isinstance(error, throttle_errors())))
+                post.scheduled_time = retry_at
+
+        if retry_at is None:
+            release_imported_image(image_path)  # Більше спроб не буде
+            await self.bot.send_message(telegram_id, f"❌ Помилка публікації: {error}")
+        else:
+            self.stats.retried += 1
+            if attempts == 1:  # Не спамимо користувача повідомленням про кожну спробу
+                await self.bot.send_message(
+                    telegram_id, f"⏳ Не вдалося опублікувати пост ({error}). Повторимо о {retry_at:%H:%M}.")
+        return retry_at
 
     def start(self):
-        self.scheduler.add_job(self.check_posts, 'interval', minutes=5)
-        self.scheduler.start()
\ No newline at end of file
+        add_scheduled_post_listener(self.notify)
+        self._tasks = [asyncio.get_running_loop().create_task(self._run())]
+
+    async def stop(self):
+        remove_scheduled_post_listener(self.notify)
+        tasks = self._tasks + list(self._drains.values()) + list(self._markers)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks = []
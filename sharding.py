@@ -0,0 +1,326 @@
+"""Шардований режим: диспетчер і N робочих процесів.
+
+Диспетчер отримує оновлення (polling або webhook) і передає кожне в процес шарду
+telegram_id % N, тож оновлення одного користувача обробляються одним процесом і по черзі.
+Робочий процес - звичайний Application з обробниками, клієнтами InstagramAPI та станами
+діалогів своїх користувачів; планувальник публікує лише пости свого шарду.
+Шард закріплюється за процесом орендою в спільній БД (таблиця shard_leases), тому
+два процеси (наприклад, старий, що ще не завершився, і перезапущений) не обробляють
+один шард одночасно. Для кількох процесів краще PostgreSQL; SQLite працює, але записи
+з різних процесів виконуються по черзі.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import signal
+import socket
+
+from telegram import Bot, Update
+from telegram.ext import Updater
+
+from config import TELEGRAM_BOT_TOKEN
+from database import init_db, session_scope
+from database.crud import acquire_shard_lease, release_shard_lease
+from media.cache import MEDIA_CACHE_DIR
+from media.pipeline import MEDIA_SPOOL_DIR
+from metrics import METRICS_PORT, metrics, start_metrics_server
+
+logger = logging.getLogger(__name__)
+
+SHARD_LEASE_TTL = int(os.environ.get("SHARD_LEASE_TTL", "30"))  # секунди
+SHARD_QUEUE_SIZE = int(os.environ.get("SHARD_QUEUE_SIZE", "1000"))  # оновлень у черзі одного процесу
+SHARD_SUPERVISE_INTERVAL = float(os.environ.get("SHARD_SUPERVISE_INTERVAL", "5"))
+SHARD_STOP_TIMEOUT = float(os.environ.get("SHARD_STOP_TIMEOUT", "60"))  # очікування завершення процесів
+
+
+def shard_of(telegram_id, shards):
+    return telegram_id % shards
+
+
+def update_shard(update, shards):
+    """Шард оновлення: за користувачем, інакше за чатом (службові оновлення без них - шард 0)."""
+    if update.effective_user is not None:
+        return shard_of(update.effective_user.id, shards)
+    if update.effective_chat is not None:
+        return shard_of(update.effective_chat.id, shards)
+    return 0
+
+
+def shard_environ(shard_id):
+    """Налаштування, що відрізняються для кожного процесу: окремі каталоги медіа та порт метрик."""
+    environ = {
+        "MEDIA_CACHE_DIR": os.path.join(MEDIA_CACHE_DIR, f"shard{shard_id}"),
+        "MEDIA_SPOOL_DIR": os.path.join(MEDIA_SPOOL_DIR, f"shard{shard_id}"),
+    }
+    if METRICS_PORT:
+        environ["METRICS_PORT"] = str(METRICS_PORT + 1 + shard_id)
+    return environ
+
+
+# --- Робочий процес ---
+
+def worker_main(shard_id, shards, updates, build_application):
+    """Точка входу робочого процесу (multiprocessing, spawn)."""
+    logging.basicConfig(format=f'%(asctime)s - shard{shard_id} - %(name)s - %(levelname)s - %(message)s',
+                        level=logging.INFO)
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # Ctrl+C зупиняє диспетчер, а він - процеси
+    application = build_application(shard=(shard_id, shards))
+    asyncio.run(run_worker(application, shard_id, updates))
+
+
+async def _receive(application, updates, stop_event):
+    """Переносить оновлення з черги диспетчера в update_queue Application (None - сигнал зупинки)."""
+    while not stop_event.is_set():
+        try:
+            data = await asyncio.to_thread(updates.get, True, 1.0)
+        except queue_module.Empty:
+            continue
+        if data is None:
+            stop_event.set()
+            return
+        await application.update_queue.put(Update.de_json(data, application.bot))
+
+
+async def _renew_lease(shard_id, owner, stop_event):
+    """Продовжує оренду шарду; якщо її втрачено (або БД недоступна довше за TTL) - зупиняє процес."""
+    loop = asyncio.get_running_loop()
+    renewed_at = loop.time()
+    while not stop_event.is_set():
+        try:
+            await asyncio.wait_for(stop_event.wait(), SHARD_LEASE_TTL / 3)
+            return
+        except asyncio.TimeoutError:
+            pass
+        try:
+            async with session_scope() as session:
+                acquired = await acquire_shard_lease(session, shard_id, owner, SHARD_LEASE_TTL)
+        except Exception as e:
+            logger.error(f"Не вдалося продовжити оренду шарду {shard_id}: {e}")
+            acquired = loop.time() - renewed_at < SHARD_LEASE_TTL
+        else:
+            renewed_at = loop.time()
+        if not acquired:
+            logger.error(f"Оренду шарду {shard_id} втрачено - процес зупиняється")
+            stop_event.set()
+
+
+async def acquire_lease(shard_id, owner, stop_event):
+    """Чекає, доки шард звільниться (наприклад, закінчиться оренда процесу, що впав). False - зупинено раніше."""
+    while not stop_event.is_set():
+        async with session_scope() as session:
+            if await acquire_shard_lease(session, shard_id, owner, SHARD_LEASE_TTL):
+                return True
+        logger.info(f"Шард {shard_id} зайнятий іншим процесом, очікуємо звільнення оренди")
+        try:
+            await asyncio.wait_for(stop_event.wait(), SHARD_LEASE_TTL / 3)
+        except asyncio.TimeoutError:
+            pass
+    return False
+
+
+async def run_worker(application, shard_id, updates):
+    """Життєвий цикл Application робочого процесу (як run_webhook, але оновлення - від диспетчера)."""
+    from webhook import stop_on_signals
+
+    stop_event = stop_on_signals((signal.SIGTERM,))
+    owner = f"{socket.gethostname()}:{os.getpid()}"
+    if not await acquire_lease(shard_id, owner, stop_event):
+        return
+    logger.info(f"Шард {shard_id} закріплено за {owner}")
+
+    try:
+        async with application:  # initialize() / shutdown()
+            if application.post_init:
+                await application.post_init(application)
+            await application.start()
+            receiver = asyncio.create_task(_receive(application, updates, stop_event))
+            renewer = asyncio.create_task(_renew_lease(shard_id, owner, stop_event))
+            try:
+                await stop_event.wait()
+            finally:
+                await asyncio.gather(receiver, renewer, return_exceptions=True)
+                await application.stop()  # Дообробляє оновлення, що вже в update_queue
+        # Як у run_polling: post_shutdown - після application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+    finally:
+        async with session_scope() as session:
+            await release_shard_lease(session, shard_id, owner)
+
+
+# --- Диспетчер ---
+
+class ShardDispatcher:
+    """Запускає робочі процеси, розподіляє між ними оновлення та перезапускає ті, що впали.
+
+    Кожен шард має власний буфер у диспетчері та задачу, що передає з нього оновлення в
+    чергу процесу: процес, який не читає чергу (наприклад, чекає на оренду після
+    перезапуску), затримує лише оновлення свого шарду, а не всіх.
+    """
+
+    def __init__(self, shards, build_application, queue_size=SHARD_QUEUE_SIZE):
+        self.shards = shards
+        self.build_application = build_application
+        self._context = multiprocessing.get_context("spawn")  # Без успадкування потоків і циклу подій
+        self.queues = [self._context.Queue(queue_size) for _ in range(shards)]
+        self.buffers = [asyncio.Queue() for _ in range(shards)]  # Ще не передані процесу
+        self.processes = [None] * shards
+        self.routed = [0] * shards
+        self.restarts = 0
+        self._senders = []
+        self._stopping = False
+        self._abandon = False  # Процес так і не прочитав чергу до кінця зупинки
+
+    def _spawn(self, shard_id):
+        process = self._context.Process(
+            target=worker_main, name=f"tgbot-shard{shard_id}",
+            args=(shard_id, self.shards, self.queues[shard_id], self.build_application))
+        # spawn запускає новий інтерпретатор з поточним os.environ, тож налаштування шарду
+        # діють уже під час імпорту модулів у дочірньому процесі
+        overrides = shard_environ(shard_id)
+        saved = {key: os.environ.get(key) for key in overrides}
+        os.environ.update(overrides)
+        try:
+            process.start()
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        self.processes[shard_id] = process
+        logger.info(f"Запущено процес шарду {shard_id} (pid {process.pid})")
+
+    def start(self):
+        loop = asyncio.get_running_loop()
+        for shard_id in range(self.shards):
+            self._spawn(shard_id)
+        self._senders = [loop.create_task(self._send(shard_id)) for shard_id in range(self.shards)]
+
+    def route(self, update):
+        """Додає оновлення в буфер шарду (не блокує: повна черга одного процесу не затримує інші)."""
+        shard_id = update_shard(update, self.shards)
+        self.buffers[shard_id].put_nowait(update.to_dict())
+
+    async def _send(self, shard_id):
+        """Передає оновлення з буфера шарду в чергу процесу по порядку; None - сигнал зупинки процесу."""
+        buffer, updates = self.buffers[shard_id], self.queues[shard_id]
+        while True:
+            data = await buffer.get()
+            while True:
+                try:
+                    updates.put_nowait(data)
+                    break
+                except queue_module.Full:
+                    pass
+                if self._abandon:
+                    return
+                try:
+                    # З тайм-аутом, щоб потік не блокувався назавжди, якщо процес більше не читає
+                    await asyncio.to_thread(updates.put, data, True, 1.0)
+                    break
+                except queue_module.Full:
+                    continue
+            if data is None:
+                return
+            self.routed[shard_id] += 1
+
+    async def consume(self, update_queue):
+        """Розподіляє оновлення з update_queue (Updater або вебхука) по черзі надходження; None - кінець."""
+        while True:
+            update = await update_queue.get()
+            if update is None:
+                return
+            try:
+                self.route(update)
+            except Exception as e:
+                logger.error(f"Не вдалося передати оновлення {update.update_id}: {e}")
+
+    async def supervise(self):
+        while not self._stopping:
+            await asyncio.sleep(SHARD_SUPERVISE_INTERVAL)
+            for shard_id, process in enumerate(self.processes):
+                if not self._stopping and not process.is_alive():
+                    logger.error(f"Процес шарду {shard_id} завершився (код {process.exitcode}), перезапуск")
+                    self.restarts += 1
+                    self._spawn(shard_id)
+
+    async def stop(self, timeout=SHARD_STOP_TIMEOUT):
+        """Надсилає процесам сигнал зупинки після вже переданих оновлень і чекає їх завершення."""
+        self._stopping = True
+        for buffer in self.buffers:
+            buffer.put_nowait(None)
+        if self._senders:
+            _, pending = await asyncio.wait(self._senders, timeout=timeout)
+            if pending:
+                logger.warning(f"Не всі оновлення передано процесам за {timeout} с: "
+                               f"{sum(buffer.qsize() for buffer in self.buffers)} в буферах")
+                self._abandon = True
+                await asyncio.gather(*pending, return_exceptions=True)
+        for shard_id, process in enumerate(self.processes):
+            if process is None:
+                continue
+            await asyncio.to_thread(process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"Процес шарду {shard_id} не завершився за {timeout} с, примусова зупинка")
+                process.terminate()
+                await asyncio.to_thread(process.join)
+
+    def stats(self):
+        stats = {
+            "shards": self.shards,
+            "alive": sum(1 for process in self.processes if process is not None and process.is_alive()),
+            "restarts": self.restarts,
+            "routed": sum(self.routed),
+            "buffered": sum(buffer.qsize() for buffer in self.buffers),
+        }
+        for shard_id in range(self.shards):
+            stats[f"shard{shard_id}_routed"] = self.routed[shard_id]
+            stats[f"shard{shard_id}_buffered"] = self.buffers[shard_id].qsize()
+        return stats
+
+
+async def run_sharded(shards, mode, build_application):
+    """Диспетчер: init_db, запуск процесів і отримання оновлень до SIGINT/SIGTERM."""
+    from webhook import stop_on_signals
+
+    await init_db()  # Один раз, до запуску процесів
+    dispatcher = ShardDispatcher(shards, build_application)
+    dispatcher.start()
+    # Метрики диспетчера - на METRICS_PORT, робочих процесів - на наступних портах (shard_environ)
+    metrics.register_collector("tgbot_shards", dispatcher.stats)
+    metrics_server = await start_metrics_server()
+    stop_event = stop_on_signals()
+    update_queue = asyncio.Queue()
+
+    async with Bot(TELEGRAM_BOT_TOKEN) as bot:
+        if mode == "webhook":
+            from webhook import set_webhook, start_web_app
+            await set_webhook(bot)
+            receiver = await start_web_app(update_queue, bot)
+        else:
+            receiver = Updater(bot, update_queue)
+            await receiver.initialize()
+            await receiver.start_polling(allowed_updates=Update.ALL_TYPES)
+        consumer = asyncio.create_task(dispatcher.consume(update_queue))
+        supervisor = asyncio.create_task(dispatcher.supervise())
+        logger.info(f"Диспетчер запущено: {shards} шардів, режим {mode}")
+        try:
+            await stop_event.wait()
+        finally:
+            # Спершу перестаємо отримувати оновлення, потім передаємо ті, що вже отримані
+            if mode == "webhook":
+                await receiver.cleanup()
+            else:
+                await receiver.stop()
+                await receiver.shutdown()
+            update_queue.put_nowait(None)
+            await asyncio.gather(consumer, return_exceptions=True)
+            supervisor.cancel()
+            await asyncio.gather(supervisor, return_exceptions=True)
+            await dispatcher.stop()
+            if metrics_server is not None:
+                await metrics_server.cleanup()
+    logger.info(f"Диспетчер зупинено: {dispatcher.stats()}")
@@ -0,0 +1,35 @@
+import logging
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# Модулі, які не повинні завантажуватись до першого використання
+LAZY_MODULES = ("instagrapi", "PIL", "aiohttp")
+
+
+class StartupTimer:
+    """Тривалість етапів запуску (імпорти, ініціалізація) для звіту в лозі."""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._last = self.started
+        self.stages = []
+
+    def mark(self, stage):
+        """Завершує етап: час від попередньої позначки."""
+        now = time.perf_counter()
+        self.stages.append((stage, now - self._last))
+        self._last = now
+
+    def report(self):
+        total = time.perf_counter() - self.started
+        lines = [f"  {stage:<28}{seconds * 1000:9.1f} мс" for stage, seconds in self.stages]
+        loaded = [name for name in LAZY_MODULES if name in sys.modules]
+        lines.append(f"  вже завантажені ліниві модулі: {', '.join(loaded) or 'немає'}")
+        logger.info(f"Бот готовий приймати оновлення через {total * 1000:.1f} мс:\n" + "\n".join(lines))
+        return total
+
+
+# Створюється при першому імпорті, тому main.py імпортує його першим
+startup_timer = StartupTimer()
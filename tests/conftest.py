@@ -0,0 +1,42 @@
+"""Спільні налаштування тестів.
+
+config.py (токени, DATABASE_URL) не зберігається в репозиторії; якщо його немає,
+тести підставляють власний з БД SQLite у пам'яті - жодних мережевих запитів тести не роблять.
+"""
+import os
+import sys
+import types
+from contextlib import asynccontextmanager
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import config  # noqa: F401
+except ImportError:
+    config = types.ModuleType("config")
+    config.TELEGRAM_BOT_TOKEN = "123456:TEST"
+    config.DEEPSEEK_API_KEY = "test"
+    config.DEEPSEEK_API_URL = "http://deepseek.test/v1/chat/completions"
+    config.DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+    sys.modules["config"] = config
+
+
+@pytest.fixture
+def temp_db(tmp_path):
+    """Окрема БД SQLite у файлі на тест: async with temp_db() as session_factory."""
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    import database
+
+    @asynccontextmanager
+    async def open_db():
+        engine = database.make_engine(f"sqlite+aiosqlite:///{tmp_path / 'test.db'}")
+        await database.init_db(engine)
+        try:
+            yield async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+        finally:
+            await engine.dispose()
+
+    return open_db
@@ -0,0 +1,141 @@
+import asyncio
+
+import httpx
+import pytest
+
+from api.admission import AIAdmission, AIOverloaded, AISuperseded, CircuitBreaker
+
+
+def make_breaker(**kwargs):
+    options = dict(window=10, min_calls=4, failure_rate=0.5, slow_call=1.0, open_seconds=0.05)
+    options.update(kwargs)
+    return CircuitBreaker("test", **options)
+
+
+def test_breaker_opens_after_failure_rate_and_recovers_through_probe():
+    breaker = make_breaker()
+    for ok in (True, False, True):
+        breaker.record(ok)
+    assert breaker.state == CircuitBreaker.CLOSED  # Замало запитів для рішення
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opens == 1
+    assert not breaker.allow()
+
+    asyncio.run(asyncio.sleep(0.06))
+    assert breaker.allow() and breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow()  # Лише один пробний запит
+    breaker.record(True)
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow()
+
+
+def test_breaker_failed_probe_reopens():
+    breaker = make_breaker(min_calls=1, failure_rate=1.0)
+    breaker.record(False)
+    asyncio.run(asyncio.sleep(0.06))
+    assert breaker.allow()
+    breaker.record(False)
+    assert breaker.state == CircuitBreaker.OPEN and breaker.opens == 2
+
+
+def admission(**kwargs):
+    instance = AIAdmission(**kwargs)
+    instance.bucket.rate = instance.bucket.max_rate = instance.bucket.burst = instance.bucket.tokens = 1e9
+    return instance
+
+
+def test_newer_message_replaces_the_waiting_one():
+    async def other_user(gate):
+        async with gate.admit(user_id=2):
+            return "ok"
+
+    async def scenario():
+        gate = admission(max_concurrent=4)
+        release = asyncio.Event()
+        order = []
+
+        async def request(name):
+            try:
+                async with gate.admit(user_id=1):
+                    order.append(name)
+                    if name == "first":
+                        await release.wait()
+                return name
+            except AISuperseded:
+                return f"{name}: superseded"
+
+        first = asyncio.create_task(request("first"))
+        await asyncio.sleep(0.01)
+        second = asyncio.create_task(request("second"))
+        await asyncio.sleep(0.01)
+        third = asyncio.create_task(request("third"))
+        await asyncio.sleep(0.01)
+        other_result = await asyncio.wait_for(other_user(gate), 1)  # Інших користувачів не чекає
+        release.set()
+        results = await asyncio.gather(first, second, third)
+        assert results == ["first", "second: superseded", "third"]
+        assert order == ["first", "third"]
+        assert other_result == "ok"
+        assert gate.superseded == 1 and gate._users == {}
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_shed():
+    async def scenario():
+        gate = admission(max_concurrent=1, max_queue=1, queue_timeout=5)
+        release = asyncio.Event()
+
+        async def hold():
+            async with gate.admit():
+                await release.wait()
+
+        holder = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        waiter = asyncio.create_task(hold())
+        await asyncio.sleep(0.01)
+        with pytest.raises(AIOverloaded):
+            async with gate.admit():
+                pass
+        release.set()
+        await asyncio.gather(holder, waiter)
+        assert gate.shed == 1 and gate.admitted == 2
+
+    asyncio.run(scenario())
+
+
+def test_slow_stream_counts_time_to_first_chunk_only():
+    async def scenario():
+        gate = admission()
+        breaker = gate.breaker("m")
+        breaker.slow_call = 0.05
+        async with gate.call("m") as timer:
+            timer.first_response()
+            await asyncio.sleep(0.1)  # Довга генерація після першої частини
+        async with gate.call("m"):
+            await asyncio.sleep(0.1)  # Без потоку - уся тривалість
+        assert list(breaker._outcomes) == [True, False]
+
+    asyncio.run(scenario())
+
+
+def test_throttled_call_slows_bucket_and_counts_as_failure():
+    async def scenario():
+        gate = AIAdmission()
+        rate = gate.bucket.rate
+        response = httpx.Response(429, request=httpx.Request("POST", "http://ai.test"))
+        with pytest.raises(httpx.HTTPStatusError):
+            async with gate.call("m"):
+                response.raise_for_status()
+        assert gate.bucket.rate < rate
+        assert list(gate.breaker("m")._outcomes) == [False]
+
+    asyncio.run(scenario())
+
+
+def test_fallback_model_when_primary_breaker_is_open():
+    gate = admission()
+    gate.breaker("primary")._open()
+    assert list(gate.models("primary", "fallback")) == ["fallback"]
+    assert gate.fallbacks == 1
+    stats = gate.stats()
+    assert stats["breaker_primary_open"] == 1 and stats["breaker_fallback_open"] == 0
@@ -0,0 +1,77 @@
+import asyncio
+import datetime
+
+from sqlalchemy import func, select
+
+from api.ai_cache import ResponseCache, make_cache_key
+from database import session_scope
+from database.models import AIResponseCache
+
+
+async def stored_keys(session_factory):
+    async with session_scope(session_factory) as session:
+        return set((await session.execute(select(AIResponseCache.key))).scalars())
+
+
+def test_cache_key_ignores_case_spaces_and_trailing_punctuation():
+    assert make_cache_key("Що  таке Python?", "s", "m", 0.7) == make_cache_key("що таке python", "s", "m", 0.7)
+    assert make_cache_key("python", "s", "m", 0.7) != make_cache_key("python", "s", "m", 0.2)
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    async def scenario():
+        now = [1000.0]
+        monkeypatch.setattr("api.ai_cache.time.time", lambda: now[0])
+        cache = ResponseCache(ttl=60, persist=False)
+        await cache.set("key", "answer")
+        assert await cache.get("key") == "answer"
+        now[0] += 61
+        assert await cache.get("key") is None
+        assert cache.stats()["entries"] == 0 and cache.hits == 1 and cache.misses == 1
+
+    asyncio.run(scenario())
+
+
+def test_lru_evicts_oldest():
+    async def scenario():
+        cache = ResponseCache(max_entries=2, persist=False)
+        for key in ("a", "b"):
+            await cache.set(key, key)
+        await cache.get("a")
+        await cache.set("c", "c")
+        assert await cache.get("b") is None and await cache.get("a") == "a"
+        assert cache.evictions == 1
+
+    asyncio.run(scenario())
+
+
+def test_persisted_response_survives_restart(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            await ResponseCache(persist=True, session_factory=session_factory).set("key", "answer")
+            restarted = ResponseCache(persist=True, session_factory=session_factory)
+            assert await restarted.get("key") == "answer"
+            assert restarted.stats()["entries"] == 1  # Підхоплено в пам'ять
+
+    asyncio.run(scenario())
+
+
+def test_expired_rows_are_pruned_on_store(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            expired = datetime.datetime.utcnow() - datetime.timedelta(minutes=1)
+            async with session_scope(session_factory) as session:
+                session.add_all([AIResponseCache(key=f"old{index}", response="x", expires_at=expired)
+                                 for index in range(3)])
+            cache = ResponseCache(persist=True, session_factory=session_factory, prune_interval=3600)
+            await cache.set("fresh", "answer")
+            assert await stored_keys(session_factory) == {"fresh"}
+            assert cache.pruned == 3
+            # Наступне видалення - не раніше ніж через prune_interval
+            async with session_scope(session_factory) as session:
+                session.add(AIResponseCache(key="old", response="x", expires_at=expired))
+            await cache.set("another", "answer")
+            async with session_scope(session_factory) as session:
+                assert await session.scalar(select(func.count()).select_from(AIResponseCache)) == 3
+
+    asyncio.run(scenario())
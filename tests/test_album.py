@@ -0,0 +1,133 @@
+import asyncio
+import types
+
+import pytest
+
+import handlers
+from conversation import State, conversation_store
+
+USER_ID = 501
+
+
+class FakeMessage:
+    def __init__(self, replies, photo_id=None, media_group_id=None):
+        self.replies = replies
+        self.from_user = types.SimpleNamespace(id=USER_ID)
+        self.media_group_id = media_group_id
+        if photo_id is not None:
+            self.photo = [types.SimpleNamespace(to_dict=lambda: {"file_id": photo_id})]
+
+    async def reply_text(self, text):
+        self.replies.append(text)
+        return types.SimpleNamespace(edit_text=self.reply_text)
+
+
+def fake_update(replies, photo_id=None, media_group_id=None):
+    return types.SimpleNamespace(message=FakeMessage(replies, photo_id, media_group_id))
+
+
+def fake_context():
+    return types.SimpleNamespace(application=types.SimpleNamespace(create_task=asyncio.create_task))
+
+
+@pytest.fixture
+def album(monkeypatch):
+    monkeypatch.setattr(handlers, "ALBUM_GROUP_DEBOUNCE", 0.05)
+    conversation_store.begin(USER_ID, State.WAITING_FOR_ALBUM_PHOTOS, album_photos=[])
+    yield
+    conversation_store.clear(USER_ID)
+
+
+def test_media_group_is_acknowledged_once(album):
+    async def scenario():
+        replies = []
+        for index in range(3):
+            await handlers.add_album_photo(fake_update(replies, f"p{index}", "group"), fake_context())
+        assert replies == []
+        await asyncio.sleep(0.1)
+        assert replies == ["Отримано 3 фото. Надішліть ще або напишіть «готово»."]
+
+    asyncio.run(scenario())
+
+
+def test_album_is_limited_to_ten_photos(album):
+    async def scenario():
+        replies = []
+        for index in range(handlers.ALBUM_MAX_PHOTOS + 2):
+            await handlers.add_album_photo(fake_update(replies, f"p{index}"), fake_context())
+        record = conversation_store.get(USER_ID)
+        assert len(record.album_photos) == handlers.ALBUM_MAX_PHOTOS
+        assert record.state == State.WAITING_FOR_ALBUM_CAPTION
+        assert replies[-1].startswith(f"Отримано {handlers.ALBUM_MAX_PHOTOS} фото (максимум)")
+        assert len(replies) == handlers.ALBUM_MAX_PHOTOS
+
+    asyncio.run(scenario())
+
+
+class FakePipeline:
+    """prepare повертає шлях (або помилку для фото "bad"); release записує звільнені шляхи."""
+
+    def __init__(self, delays=None):
+        self.delays = delays or {}
+        self.released = []
+
+    async def prepare(self, photo, variant):
+        await asyncio.sleep(self.delays.get(photo, 0))
+        if photo == "bad":
+            raise ValueError("пошкоджене фото")
+        return f"/cache/{photo}.jpg"
+
+    def release(self, path):
+        self.released.append(path)
+
+
+class FakeInstagram:
+    is_logged_in = True
+
+    def __init__(self, error=None, delay=0):
+        self.error = error
+        self.delay = delay
+        self.albums = []
+
+    async def post_album(self, paths, caption):
+        await asyncio.sleep(self.delay)
+        if self.error:
+            raise self.error
+        self.albums.append((paths, caption))
+
+
+@pytest.mark.parametrize("photos, insta, published", [
+    (["a", "b"], FakeInstagram(), True),
+    (["a", "b"], FakeInstagram(error=RuntimeError("instagram недоступний")), False),
+    (["a", "bad", "b"], FakeInstagram(), False),
+])
+def test_prepared_photos_are_released_after_publishing(monkeypatch, photos, insta, published):
+    pipeline = FakePipeline()
+    monkeypatch.setattr(handlers, "media_pipeline", pipeline)
+    replies = []
+    asyncio.run(handlers.publish_album(fake_update(replies), insta, photos, "опис"))
+    expected = [f"/cache/{photo}.jpg" for photo in photos if photo != "bad"]
+    assert sorted(pipeline.released) == sorted(expected)
+    assert bool(insta.albums) == published
+    assert replies[-1].startswith("✅" if published else "❌")
+
+
+@pytest.mark.parametrize("delays, insta_delay", [
+    ({"b": 10}, 0),  # Скасовано під час підготовки: "a" вже готове
+    ({}, 10),  # Скасовано під час публікації
+])
+def test_prepared_photos_are_released_when_cancelled(monkeypatch, delays, insta_delay):
+    pipeline = FakePipeline(delays)
+    monkeypatch.setattr(handlers, "media_pipeline", pipeline)
+
+    async def scenario():
+        task = asyncio.create_task(handlers.publish_album(
+            fake_update([]), FakeInstagram(delay=insta_delay), ["a", "b"], "опис"))
+        await asyncio.sleep(0.05)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+
+    asyncio.run(scenario())
+    expected = ["/cache/a.jpg"] if delays else ["/cache/a.jpg", "/cache/b.jpg"]
+    assert sorted(pipeline.released) == expected
@@ -0,0 +1,151 @@
+import asyncio
+import io
+import os
+import socket
+import zipfile
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from scheduler import bulk_import
+from scheduler.bulk_import import ManifestError, ManifestSource, parse_time, read_manifest
+
+
+def rows(text):
+    return list(read_manifest(io.StringIO(text)))
+
+
+def test_parse_time_formats():
+    assert parse_time("2030-05-01 10:00") == datetime(2030, 5, 1, 10, 0)
+    assert parse_time(" 2030-05-01T10:00:30 ") == datetime(2030, 5, 1, 10, 0, 30)
+    assert parse_time("01.05.2030 10:00") == datetime(2030, 5, 1, 10, 0)
+    assert parse_time("01.05.2030 10:00:15") == datetime(2030, 5, 1, 10, 0, 15)
+
+
+def test_parse_time_with_offset_becomes_naive_local_time():
+    parsed = parse_time("2030-05-01T10:00+02:00")
+    assert parsed.tzinfo is None
+    expected = datetime(2030, 5, 1, 8, 0, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+    assert parsed == expected
+    assert parsed > datetime.now() - timedelta(days=1)  # Порівнюється з naive now без TypeError
+
+
+def test_parse_time_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        parse_time("завтра о десятій")
+
+
+def test_read_manifest_rows_and_row_errors():
+    result = rows(
+        "image,caption,time\n"
+        "a.jpg,Перший,2030-05-01 10:00\n"
+        "\n"
+        ",Без фото,2030-05-01 11:00\n"
+        "b.jpg,Поганий час,колись\n"
+        "c.jpg\n"
+        'd.jpg,"Опис, з комою",01.05.2030 12:00\n')
+    assert result[0] == (2, "a.jpg", "Перший", datetime(2030, 5, 1, 10, 0))
+    assert [(line, type(error)) for line, _, _, error in result[1:4]] == [
+        (4, ValueError), (5, ValueError), (6, ValueError)]
+    assert result[4] == (7, "d.jpg", "Опис, з комою", datetime(2030, 5, 1, 12, 0))
+
+
+def test_read_manifest_semicolon_delimiter_and_aliases():
+    assert rows("Фото;Опис;Час\nx.jpg;текст;01.05.2030 10:00\n") == [
+        (2, "x.jpg", "текст", datetime(2030, 5, 1, 10, 0))]
+
+
+def test_read_manifest_missing_column():
+    with pytest.raises(ManifestError):
+        rows("image,caption\na.jpg,x\n")
+
+
+def test_read_manifest_empty():
+    with pytest.raises(ManifestError):
+        rows("")
+
+
+@pytest.mark.parametrize("url", [
+    "http://127.0.0.1:9108/metrics",
+    "http://localhost/photo.jpg",
+    "http://10.0.0.5/photo.jpg",
+    "http://169.254.169.254/latest/meta-data",
+    "http://[::1]/photo.jpg",
+    "ftp://93.184.216.34/photo.jpg",
+])
+def test_download_refuses_internal_addresses(url):
+    source = ManifestSource("unused.csv")
+    with pytest.raises(ValueError):
+        asyncio.run(source.load_image(url))
+
+
+def test_download_checks_redirect_targets():
+    requested = []
+
+    def handler(request):
+        requested.append(str(request.url))
+        return httpx.Response(302, headers={"location": "http://127.0.0.1:9108/metrics"})
+
+    async def scenario():
+        source = ManifestSource("unused.csv")
+        source._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            with pytest.raises(ValueError, match="внутрішню"):
+                await source.load_image("http://93.184.216.34/photo.jpg")
+        finally:
+            await source.close()
+
+    asyncio.run(scenario())
+    assert requested == ["http://93.184.216.34/photo.jpg"]  # На внутрішню адресу запит не пішов
+
+
+def test_download_connects_to_checked_address(monkeypatch):
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        return httpx.Response(200, content=b"jpeg")
+
+    def resolve(host, *args, **kwargs):
+        # Після перевірки хост міг би повернути внутрішню адресу, але повторно він не резолвиться
+        answers = {"photos.example": "93.184.216.34"}
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, "", (answers.pop(host, "127.0.0.1"), 0))]
+
+    monkeypatch.setattr(socket, "getaddrinfo", resolve)
+
+    async def scenario():
+        source = ManifestSource("unused.csv")
+        source._http = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        try:
+            assert await source.load_image("https://photos.example/a.jpg?x=1") == b"jpeg"
+        finally:
+            await source.close()
+
+    asyncio.run(scenario())
+    [request] = requests
+    assert str(request.url) == "https://93.184.216.34/a.jpg?x=1"
+    assert request.headers["host"] == "photos.example"
+    assert request.extensions["sni_hostname"] == "photos.example"
+
+
+def test_images_are_removed_when_batch_insert_fails(tmp_path, monkeypatch):
+    monkeypatch.setattr(bulk_import, "IMPORT_DIR", str(tmp_path))
+    archive = tmp_path / "posts.zip"
+    with zipfile.ZipFile(archive, "w") as zf:
+        zf.writestr("manifest.csv", "image,caption,time\na.jpg,Перший,2099-05-01 10:00\n")
+        zf.writestr("a.jpg", b"raw")
+
+    async def process(data, variant):
+        return b"processed"
+
+    async def failing_insert(session, user_id, posts):
+        assert all(os.path.exists(post["image_path"]) for post in posts)
+        raise RuntimeError("БД недоступна")
+
+    monkeypatch.setattr(bulk_import.media_pipeline, "process", process)
+    monkeypatch.setattr(bulk_import, "add_scheduled_posts", failing_insert)
+    importer = bulk_import.BulkImporter(1, 42, str(archive))
+    with pytest.raises(RuntimeError):
+        asyncio.run(importer.run())
+    assert not os.listdir(tmp_path / "42")
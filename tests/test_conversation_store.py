@@ -0,0 +1,91 @@
+import asyncio
+import datetime
+import time
+
+from sqlalchemy import select
+
+from conversation import ConversationStore, State
+from database import session_scope
+from database.models import SavedConversation
+
+
+async def saved(session_factory):
+    async with session_scope(session_factory) as session:
+        rows = (await session.execute(select(SavedConversation))).scalars().all()
+    return {row.telegram_id: row.state for row in rows}
+
+
+def test_idle_state_expires_and_releases_media(tmp_path):
+    photo = tmp_path / "feed_1.jpg"
+    photo.write_bytes(b"jpeg")
+    store = ConversationStore(idle_ttl=60, persist=False)
+    store.begin(1, State.WAITING_FOR_CAPTION, media_paths=[str(photo)])
+    store.begin(2, State.WAITING_FOR_PHOTO)
+    store.get(1).updated_at = time.time() - 61
+    store.sweep()
+    assert store.get(1) is None and store.state_of(2) == State.WAITING_FOR_PHOTO
+    assert not photo.exists()  # Тимчасовий файл покинутого діалогу видалено
+    assert store.stats()["expired"] == 1
+
+
+def test_changes_are_written_behind_in_batches(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            store = ConversationStore(session_factory, persist=True)
+            store.begin(1, State.WAITING_FOR_PHOTO)
+            store.begin(2, State.WAITING_FOR_IMPORT_FILE)
+            assert await saved(session_factory) == {}  # Лише в пам'яті до flush
+            await store.flush()
+            assert await saved(session_factory) == {1: "waiting_for_photo", 2: "waiting_for_import_file"}
+            store.set(1, State.WAITING_FOR_CAPTION)
+            store.clear(2)
+            await store.flush()
+            assert await saved(session_factory) == {1: "waiting_for_caption"}
+            assert store.flushes == 2
+
+    asyncio.run(scenario())
+
+
+def test_2fa_state_is_not_persisted(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            store = ConversationStore(session_factory, persist=True)
+            store.begin(1, State.WAITING_FOR_PHOTO)
+            await store.flush()
+            store.begin(1, State.WAITING_FOR_2FA_CODE)
+            await store.flush()
+            assert await saved(session_factory) == {}
+            # Запис, збережений старішою версією, не відновлюється і видаляється
+            async with session_scope(session_factory) as session:
+                session.add(SavedConversation(telegram_id=2, state="waiting_for_2fa_code", data="{}",
+                                              updated_at=datetime.datetime.utcnow()))
+            restarted = ConversationStore(session_factory, persist=True)
+            await restarted.load()
+            assert restarted.get(2) is None
+            await restarted.flush()
+            assert await saved(session_factory) == {}
+
+    asyncio.run(scenario())
+
+
+def test_load_restores_only_own_shard_with_existing_media(temp_db, tmp_path):
+    async def scenario():
+        async with temp_db() as session_factory:
+            photo = tmp_path / "feed_1.jpg"
+            photo.write_bytes(b"jpeg")
+            store = ConversationStore(session_factory, persist=True)
+            store.begin(2, State.WAITING_FOR_CAPTION, media_paths=[str(photo)])
+            store.begin(3, State.WAITING_FOR_PHOTO)
+            store.begin(4, State.WAITING_FOR_CAPTION, media_paths=[str(tmp_path / "missing.jpg")])
+            await store.flush()
+
+            restarted = ConversationStore(session_factory, persist=True)
+            restarted.shard = (0, 2)
+            await restarted.load()
+            assert restarted.get(2).media_paths == [str(photo)]
+            assert restarted.get(3) is None  # Інший шард
+            assert restarted.get(4) is None  # Файл зник - діалог не відновлюється
+            await restarted.flush()
+            assert set(await saved(session_factory)) == {2, 3}
+
+    asyncio.run(scenario())
@@ -0,0 +1,94 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from media.cache import IDS_INDEX_NAME, MediaCache
+
+
+def digest(index):
+    return hashlib.sha256(str(index).encode()).hexdigest()
+
+
+def remember(cache, pairs):
+    async def scenario():
+        for file_unique_id, content_hash in pairs:
+            await cache.remember_id(file_unique_id, content_hash)
+
+    asyncio.run(scenario())
+
+
+def test_file_unique_ids_survive_restart(tmp_path):
+    cache = MediaCache(directory=str(tmp_path))
+    # Повторна відповідність журнал не збільшує
+    remember(cache, [("AQADabc", digest(1)), ("AQADdef", digest(2)), ("AQADabc", digest(1))])
+
+    restarted = MediaCache(directory=str(tmp_path))
+    assert restarted.hash_for("AQADabc") == digest(1)
+    assert restarted.hash_for("AQADdef") == digest(2)
+    assert restarted.hash_for("unknown") is None
+    assert len((tmp_path / IDS_INDEX_NAME).read_text().splitlines()) == 2
+
+
+def test_index_is_compacted_and_bounded(tmp_path):
+    cache = MediaCache(directory=str(tmp_path), max_ids=3)
+    remember(cache, [(f"id{index}", digest(index)) for index in range(10)])
+    assert len((tmp_path / IDS_INDEX_NAME).read_text().splitlines()) <= 6
+
+    restarted = MediaCache(directory=str(tmp_path), max_ids=3)
+    assert [restarted.hash_for(f"id{index}") for index in range(7, 10)] == [digest(7), digest(8), digest(9)]
+    assert restarted.hash_for("id0") is None
+
+
+def test_truncated_index_line_is_ignored(tmp_path):
+    (tmp_path / IDS_INDEX_NAME).write_text(f"good {digest(1)}\nbroken {digest(2)[:10]}")
+    cache = MediaCache(directory=str(tmp_path))
+    assert cache.hash_for("good") == digest(1)
+    assert cache.hash_for("broken") is None
+
+
+def test_concurrent_writes_of_same_content(tmp_path):
+    cache = MediaCache(directory=str(tmp_path))
+    data = os.urandom(256 * 1024)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        paths = list(pool.map(lambda _: cache.write(digest(1), "feed", data), range(32)))
+    assert set(paths) == {cache.path_for(digest(1), "feed")}
+    with open(paths[0], "rb") as f:
+        assert f.read() == data
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+
+def test_leased_file_is_not_evicted_on_add(tmp_path):
+    async def scenario():
+        cache = MediaCache(directory=str(tmp_path), max_bytes=100)
+        old = await asyncio.to_thread(cache.write, digest(1), "feed", b"x" * 60)
+        await cache.add(old)
+        # Новий файл більший за весь кеш: захоплений до add, тож лишається на диску
+        new = await asyncio.to_thread(cache.write, digest(2), "feed", b"y" * 150)
+        cache.acquire(new)
+        await cache.add(new)
+        assert os.path.exists(new) and not os.path.exists(old)
+        assert cache.stats()["evictions"] == 1
+        cache.release(new)  # Тепер витісняється (видалення - у фоновому потоці)
+        for _ in range(100):
+            if not os.path.exists(new):
+                break
+            await asyncio.sleep(0.01)
+        assert not os.path.exists(new) and cache.size == 0
+
+    asyncio.run(scenario())
+
+
+def test_load_scans_directory_off_loop(tmp_path):
+    (tmp_path / f"{digest(1)}.feed.jpg").write_bytes(b"x" * 10)
+    (tmp_path / "stale.tmp").write_bytes(b"")
+    os.utime(tmp_path / "stale.tmp", (0, 0))
+
+    async def scenario():
+        cache = MediaCache(directory=str(tmp_path))
+        await cache.load()
+        assert cache.lookup(digest(1), "feed") == cache.path_for(digest(1), "feed")
+        assert cache.size == 10
+
+    asyncio.run(scenario())
+    assert not (tmp_path / "stale.tmp").exists()
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from io import BytesIO
+
+from PIL import Image
+
+from media.cache import MediaCache
+from media.pipeline import FEED_MAX_WIDTH, STORY_SIZE, MediaPipeline, process_image
+
+
+def jpeg(size):
+    out = BytesIO()
+    Image.new("RGB", size, (200, 80, 40)).save(out, format="JPEG")
+    return out.getvalue()
+
+
+def image_size(data):
+    return Image.open(BytesIO(data)).size
+
+
+def test_variants_are_resized_for_instagram():
+    assert image_size(process_image(jpeg((2160, 1440)), "feed")) == (FEED_MAX_WIDTH, 720)
+    assert image_size(process_image(jpeg((2400, 1200)), "feed")) == (FEED_MAX_WIDTH, 565)  # Обрізано до 1.91:1
+    width, height = image_size(process_image(jpeg((800, 2000)), "feed"))  # Вище за 4:5 - обрізається
+    assert (width, height) == (800, 1000)
+    assert image_size(process_image(jpeg((1000, 1000)), "story")) == STORY_SIZE
+
+
+class FakePhoto:
+    def __init__(self, file_unique_id, data):
+        self.file_unique_id = file_unique_id
+        self.data = data
+        self.downloads = 0
+
+    async def get_file(self):
+        photo = self
+
+        class File:
+            async def download_to_memory(self, out):
+                photo.downloads += 1
+                out.write(photo.data)
+
+        return File()
+
+
+def test_prepare_reuses_processed_file(tmp_path):
+    async def scenario():
+        cache = MediaCache(directory=str(tmp_path / "cache"))
+        pipeline = MediaPipeline(spool_dir=str(tmp_path / "spool"), cache=cache)
+        processed = []
+
+        async def process(data, variant):
+            processed.append(variant)
+            return process_image(data, variant)
+
+        pipeline.process = process
+        photo = FakePhoto("AQADunique", jpeg((1200, 1200)))
+        first = await pipeline.prepare(photo, "feed")
+        second = await pipeline.prepare(photo, "feed")
+        assert first == second and os.path.exists(first)
+        assert processed == ["feed"] and photo.downloads == 1
+        variants = [name for name in os.listdir(tmp_path / "cache") if name.endswith(".feed.jpg")]
+        assert len(variants) == 1
+        # Те саме фото з іншим file_unique_id: вміст однаковий, обробка не повторюється
+        assert await pipeline.prepare(FakePhoto("AQADother", photo.data), "feed") == first
+        assert processed == ["feed"]
+        for _ in range(3):
+            pipeline.release(first)
+        assert os.path.exists(first)  # Звільнений файл лишається в кеші
+
+    asyncio.run(scenario())
@@ -0,0 +1,95 @@
+import asyncio
+import datetime
+import types
+
+from database import session_scope
+from database.crud import get_account_stats
+from database.models import User
+from api.media_sync import MediaSnapshotStore
+
+UTC = datetime.timezone.utc
+
+
+def media(pk, likes, comments=0, days_ago=0):
+    taken_at = datetime.datetime(2030, 1, 31, tzinfo=UTC) - datetime.timedelta(days=days_ago)
+    return types.SimpleNamespace(pk=pk, like_count=likes, comment_count=comments, view_count=0, play_count=0,
+                                 taken_at=taken_at)
+
+
+class FakeInstagram:
+    """Медіа акаунта від найновіших; сторінки по page_size з курсором-зсувом."""
+
+    def __init__(self, medias, page_size):
+        self.medias = medias
+        self.page_size = page_size
+
+    def user_info(self, user_id):
+        return types.SimpleNamespace(follower_count=10, following_count=5, media_count=len(self.medias))
+
+    def user_medias_paginated(self, user_id, amount, end_cursor=""):
+        start = int(end_cursor or 0)
+        end = start + self.page_size
+        return self.medias[start:end], str(end) if end < len(self.medias) else ""
+
+
+def fake_api(session_factory, instagram):
+    async def call(func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    async def resolve():
+        return "1"
+
+    return types.SimpleNamespace(session_factory=session_factory, user_id=77, username="acc", client=instagram,
+                                 _call=call, resolve_instagram_user_id=resolve)
+
+
+async def totals(session_factory, db_user_id):
+    async with session_scope(session_factory) as session:
+        stats = await get_account_stats(session, db_user_id)
+        return stats.total_likes, stats.total_comments, stats.synced_media
+
+
+def test_deleted_media_are_subtracted(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            async with session_scope(session_factory) as session:
+                user = User(telegram_id=77)
+                session.add(user)
+            instagram = FakeInstagram([media(pk, likes=10 * pk, comments=pk, days_ago=pk) for pk in range(1, 7)], 50)
+            api = fake_api(session_factory, instagram)
+            store = MediaSnapshotStore()
+
+            await store.sync(api)
+            assert await totals(session_factory, user.id) == (210, 21, 6)
+
+            instagram.medias = [m for m in instagram.medias if m.pk not in (3, 6)]  # 6 - найстаріше
+            instagram.medias[0].like_count = 15
+            await store.sync(api)
+            assert await totals(session_factory, user.id) == (15 + 20 + 40 + 50, 1 + 2 + 4 + 5, 4)
+
+            instagram.medias = []
+            await store.sync(api)
+            assert await totals(session_factory, user.id) == (0, 0, 0)
+
+    asyncio.run(scenario())
+
+
+def test_only_the_read_head_range_is_reconciled(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            async with session_scope(session_factory) as session:
+                user = User(telegram_id=77)
+                session.add(user)
+            instagram = FakeInstagram([media(pk, likes=1, days_ago=pk) for pk in range(1, 7)], 50)
+            api = fake_api(session_factory, instagram)
+            store = MediaSnapshotStore()
+            await store.sync(api)
+
+            # Наступна синхронізація читає лише першу сторінку (2 медіа), вона закінчується відомим
+            instagram.page_size = 2
+            instagram.medias = [m for m in instagram.medias if m.pk != 2]
+            await store.sync(api)
+            # pk 2 був новішим за найстаріше медіа сторінки (pk 3) - видалено; старіші не чіпаються
+            assert await totals(session_factory, user.id) == (5, 0, 5)
+
+    asyncio.run(scenario())
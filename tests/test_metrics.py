@@ -0,0 +1,7 @@
+from metrics import Counter
+
+
+def test_label_values_are_escaped():
+    counter = Counter("tgbot_errors_total", "Помилки", labels=("handler",))
+    counter.inc(handler='say "hi"\\now\nnext')
+    assert counter.render()[-1] == 'tgbot_errors_total{handler="say \\"hi\\"\\\\now\\nnext"} 1'
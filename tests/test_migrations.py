@@ -0,0 +1,46 @@
+import asyncio
+import datetime
+
+from sqlalchemy import select, text
+
+import database
+from database.models import ScheduledPost
+
+# Схема до переходу на async (початкова версія моделей)
+LEGACY_SCHEMA = [
+    "CREATE TABLE users (id INTEGER PRIMARY KEY, telegram_id INTEGER UNIQUE, username VARCHAR, "
+    "session_data VARCHAR, two_factor_enabled BOOLEAN)",
+    "CREATE TABLE scheduled_posts (id INTEGER PRIMARY KEY, chat_id INTEGER, message_text VARCHAR, "
+    "scheduled_time DATETIME, photo_path VARCHAR)",
+    "INSERT INTO users (id, telegram_id, username) VALUES (1, 555, 'old')",
+    "INSERT INTO scheduled_posts (id, chat_id, message_text, scheduled_time, photo_path) "
+    "VALUES (1, 555, 'старий пост', '2030-01-01 10:00:00.000000', '/tmp/old.jpg')",
+    "INSERT INTO scheduled_posts (id, chat_id, message_text, scheduled_time, photo_path) "
+    "VALUES (2, 999, 'без користувача', '2030-01-01 11:00:00.000000', NULL)",
+]
+
+
+def test_init_db_upgrades_legacy_scheduled_posts(tmp_path):
+    async def scenario():
+        engine = database.make_engine(f"sqlite+aiosqlite:///{tmp_path / 'legacy.db'}")
+        try:
+            async with engine.begin() as conn:
+                for statement in LEGACY_SCHEMA:
+                    await conn.execute(text(statement))
+            await database.init_db(engine)
+            await database.init_db(engine)  # Повторний запуск нічого не змінює
+
+            async with engine.connect() as conn:
+                posts = (await conn.execute(select(ScheduledPost.__table__).order_by(ScheduledPost.id))).all()
+                indexes = (await conn.execute(text("PRAGMA index_list(scheduled_posts)"))).all()
+        finally:
+            await engine.dispose()
+
+        first, orphan = posts
+        assert (first.user_id, first.caption, first.image_path, first.posted, first.failed) == (
+            1, "старий пост", "/tmp/old.jpg", False, False)
+        assert first.scheduled_time == datetime.datetime(2030, 1, 1, 10, 0)
+        assert (orphan.user_id, orphan.failed) == (None, True)
+        assert "ix_scheduled_posts_posted_time" in {index[1] for index in indexes}
+
+    asyncio.run(scenario())
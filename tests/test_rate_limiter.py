@@ -0,0 +1,107 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from instagrapi.exceptions import PleaseWaitFewMinutes
+
+from api.executor import InstagrapiExecutor
+from api.rate_limiter import AdaptiveTokenBucket
+
+
+def test_burst_is_immediate_then_rate_limited():
+    async def scenario():
+        bucket = AdaptiveTokenBucket(rate=20, burst=3, min_rate=1, max_rate=20, recovery=0)
+        started = time.monotonic()
+        for _ in range(3):
+            assert await bucket.acquire() == 0.0
+        assert time.monotonic() - started < 0.02
+        waited = await bucket.acquire()
+        assert waited == pytest.approx(1 / 20, abs=0.02)
+
+    asyncio.run(scenario())
+
+
+def test_throttle_halves_rate_down_to_min_and_empties_bucket():
+    bucket = AdaptiveTokenBucket(rate=1.0, burst=5, min_rate=0.3, max_rate=1.0, recovery=0.1)
+    bucket.on_throttle()
+    assert (bucket.rate, bucket.tokens, bucket.throttles) == (0.5, 0, 1)
+    bucket.on_throttle()
+    assert bucket.rate == 0.3  # Не нижче min_rate
+    assert bucket.throttles == 2
+
+
+def test_success_recovers_rate_up_to_max():
+    bucket = AdaptiveTokenBucket(rate=0.5, burst=5, min_rate=0.1, max_rate=0.8, recovery=0.2)
+    bucket.on_success()
+    assert bucket.rate == pytest.approx(0.7)
+    bucket.on_success()
+    assert bucket.rate == 0.8
+
+
+class Client:
+    """Окремий об'єкт на кожне «відновлення» клієнта акаунта."""
+
+
+def test_executor_keeps_account_rate_across_new_clients():
+    async def scenario():
+        executor = InstagrapiExecutor(max_workers=2)
+
+        def throttled():
+            raise PleaseWaitFewMinutes("Please wait a few minutes")
+
+        try:
+            with pytest.raises(PleaseWaitFewMinutes):
+                await executor.run(Client(), throttled, account=42)
+            rate = executor.limiter(42).rate
+            assert executor.limiter(42).throttles == 1
+            # Клієнт після витіснення/відновлення - той самий bucket зі зниженою швидкістю
+            assert await executor.run(Client(), lambda: "ok", account=42) == "ok"
+            assert executor.limiter(42).rate <= rate + executor.limiter(42).recovery
+            assert executor.limiter(43).throttles == 0
+        finally:
+            executor.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_executor_limiters_are_bounded_and_expire():
+    executor = InstagrapiExecutor(max_limiters=2, limiter_ttl=3600)
+    first = executor.limiter(1)
+    executor.limiter(2)
+    assert executor.limiter(1) is first  # 1 тепер використаний нещодавно
+    executor.limiter(3)  # Витісняє найдавніше використаний - 2
+    assert executor.limiter(1) is first
+    assert set(executor._limiters) == {1, 3}
+
+    executor = InstagrapiExecutor(limiter_ttl=0)
+    stale = executor.limiter(1)
+    executor.limiter(2)
+    assert executor.limiter(1) is not stale
+
+
+def test_executor_serializes_account_across_new_clients():
+    async def scenario():
+        executor = InstagrapiExecutor(max_workers=4)
+        active, overlaps = [], []
+        guard = threading.Lock()
+
+        def upload(name):
+            with guard:
+                active.append(name)
+                overlaps.append(len(active))
+            time.sleep(0.05)
+            with guard:
+                active.remove(name)
+            return name
+
+        try:
+            # Старий клієнт ще завантажує, а реєстр уже створив новий для того самого акаунта
+            results = await asyncio.gather(executor.run(Client(), upload, "old", account=42),
+                                           executor.run(Client(), upload, "new", account=42))
+            assert results == ["old", "new"] and max(overlaps) == 1
+            assert not executor.busy(42) and executor.stats()["accounts"] == 0
+        finally:
+            executor.shutdown()
+
+    asyncio.run(scenario())
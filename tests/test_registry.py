@@ -0,0 +1,35 @@
+import asyncio
+import threading
+import types
+
+from api.executor import instagrapi_executor
+from api.registry import InstagramClientRegistry
+
+
+def fake_api(user_id, awaiting_2fa=False):
+    return types.SimpleNamespace(user_id=user_id, awaiting_2fa=awaiting_2fa, is_logged_in=False)
+
+
+def test_busy_and_2fa_clients_are_not_evicted():
+    async def scenario():
+        registry = InstagramClientRegistry(session_factory=None, idle_ttl=0)
+        for api in (fake_api(1), fake_api(2), fake_api(3, awaiting_2fa=True)):
+            registry._clients[api.user_id] = api
+            registry._last_used[api.user_id] = 0
+        release = threading.Event()
+        upload = asyncio.create_task(instagrapi_executor.run(object(), release.wait, 5, account=1))
+        try:
+            while not instagrapi_executor.busy(1):
+                await asyncio.sleep(0.01)
+            assert await registry.evict_idle() == 1  # Лише клієнт 2: 1 завантажує, 3 чекає на 2FA
+            assert 1 in registry and 2 not in registry and 3 in registry
+        finally:
+            release.set()
+            await upload
+        assert await registry.evict_idle() == 1
+        assert 1 not in registry
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        instagrapi_executor.shutdown()
@@ -0,0 +1,287 @@
+import asyncio
+import time
+import types
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import select
+
+from database import session_scope
+from database.crud import add_scheduled_posts
+from database.models import ScheduledPost, User
+from scheduler import PostScheduler
+
+
+class FakeBot:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, chat_id, text):
+        self.messages.append((chat_id, text))
+
+
+class FakeRegistry:
+    """Клієнти-фейки: post_photo записує (telegram_id, caption) і триває latency секунд."""
+
+    def __init__(self, latency=0.02, failures=()):
+        self.latency = latency
+        self.failures = set(failures)  # Підписи постів, публікація яких завершується помилкою
+        self.published = []
+
+    async def get(self, telegram_id):
+        async def post_photo(image_path, caption):
+            await asyncio.sleep(self.latency)
+            if caption in self.failures:
+                raise RuntimeError("instagram недоступний")
+            self.published.append((telegram_id, caption))
+
+        return types.SimpleNamespace(is_logged_in=True, post_photo=post_photo)
+
+
+async def add_user(session_factory, telegram_id):
+    async with session_scope(session_factory) as session:
+        user = User(telegram_id=telegram_id)
+        session.add(user)
+    return user.id
+
+
+async def add_posts(session_factory, user_id, captions, start):
+    async with session_scope(session_factory) as session:
+        return await add_scheduled_posts(session, user_id, [
+            {"image_path": None, "caption": caption, "scheduled_time": start + timedelta(seconds=index)}
+            for index, caption in enumerate(captions)])
+
+
+async def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "умова не виконалась вчасно"
+        await asyncio.sleep(0.01)
+
+
+def test_posts_of_one_account_do_not_block_other_accounts(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            busy = await add_user(session_factory, 1)
+            other = await add_user(session_factory, 2)
+            start = datetime.now() - timedelta(minutes=5)
+            await add_posts(session_factory, busy, [f"busy{index}" for index in range(8)], start)
+            await add_posts(session_factory, other, ["other"], start + timedelta(minutes=1))
+
+            registry = FakeRegistry()
+            scheduler = PostScheduler(session_factory, FakeBot(), registry, workers=2)
+            scheduler.start()
+            try:
+                await wait_for(lambda: len(registry.published) == 9)
+            finally:
+                await scheduler.stop()
+
+            busy_posts = [caption for telegram_id, caption in registry.published if telegram_id == 1]
+            assert busy_posts == [f"busy{index}" for index in range(8)]  # По черзі в межах акаунта
+            assert registry.published.index((2, "other")) <= 1  # Не чекає на всі пости іншого акаунта
+
+    asyncio.run(scenario())
+
+
+def test_posts_of_one_account_are_published_one_at_a_time(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            user_id = await add_user(session_factory, 1)
+            await add_posts(session_factory, user_id, [f"post{index}" for index in range(5)],
+                            datetime.now() - timedelta(minutes=1))
+            registry = FakeRegistry()
+            active = []
+            original_get = registry.get
+
+            async def tracking_get(telegram_id):
+                api = await original_get(telegram_id)
+                publish = api.post_photo
+
+                async def post_photo(image_path, caption):
+                    active.append(caption)
+                    assert len(active) == 1, f"одночасні публікації одного акаунта: {active}"
+                    try:
+                        await publish(image_path, caption)
+                    finally:
+                        active.remove(caption)
+
+                api.post_photo = post_photo
+                return api
+
+            registry.get = tracking_get
+            scheduler = PostScheduler(session_factory, FakeBot(), registry, workers=4)
+            scheduler.start()
+            try:
+                await wait_for(lambda: len(registry.published) == 5)
+            finally:
+                await scheduler.stop()
+            assert scheduler.stats.published == 5
+
+    asyncio.run(scenario())
+
+
+async def stored_post(session_factory, caption):
+    async with session_scope(session_factory) as session:
+        return (await session.execute(select(ScheduledPost).filter_by(caption=caption))).scalar_one()
+
+
+def test_failed_publish_is_retried_later(temp_db, monkeypatch):
+    monkeypatch.setattr("scheduler.scheduler.retry_delay", lambda attempt, throttled=False: 0.2)
+
+    async def scenario():
+        async with temp_db() as session_factory:
+            user_id = await add_user(session_factory, 7)
+            due = datetime.now() - timedelta(seconds=1)
+            await add_posts(session_factory, user_id, ["flaky"], due)
+            bot = FakeBot()
+            registry = FakeRegistry(failures={"flaky"})
+            scheduler = PostScheduler(session_factory, bot, registry, workers=2)
+            scheduler.start()
+            try:
+                await wait_for(lambda: scheduler.stats.retried == 1)
+                post = await stored_post(session_factory, "flaky")
+                assert (post.attempts, post.posted, post.failed) == (1, False, False)
+                assert post.scheduled_time > due and "instagram" in post.last_error
+                registry.failures.clear()  # Наступна спроба вдається
+                await wait_for(lambda: len(bot.messages) == 2)  # Після позначки posted у БД
+            finally:
+                await scheduler.stop()
+            post = await stored_post(session_factory, "flaky")
+            assert post.posted and not post.failed
+            assert registry.published == [(7, "flaky")]
+            assert [text[0] for _, text in bot.messages] == ["⏳", "✅"]
+
+    asyncio.run(scenario())
+
+
+def test_post_is_marked_failed_after_max_attempts(temp_db, monkeypatch):
+    monkeypatch.setattr("scheduler.scheduler.retry_delay", lambda attempt, throttled=False: 0.05)
+    monkeypatch.setattr("scheduler.scheduler.SCHEDULER_MAX_ATTEMPTS", 3)
+
+    async def scenario():
+        async with temp_db() as session_factory:
+            user_id = await add_user(session_factory, 8)
+            await add_posts(session_factory, user_id, ["broken"], datetime.now() - timedelta(seconds=1))
+            bot = FakeBot()
+            scheduler = PostScheduler(session_factory, bot, FakeRegistry(failures={"broken"}), workers=2)
+            scheduler.start()
+            try:
+                await wait_for(lambda: scheduler.stats.failed == 3)
+                await wait_for(lambda: len(bot.messages) == 2)
+            finally:
+                await scheduler.stop()
+            post = await stored_post(session_factory, "broken")
+            assert (post.attempts, post.posted, post.failed) == (3, False, True)
+            assert [text[0] for _, text in bot.messages] == ["⏳", "❌"]
+
+    asyncio.run(scenario())
+
+
+def test_reconcile_error_is_retried(temp_db, monkeypatch):
+    monkeypatch.setattr("scheduler.scheduler.SCHEDULER_RECONCILE_RETRY", 0.05)
+
+    async def scenario():
+        async with temp_db() as session_factory:
+            user_id = await add_user(session_factory, 9)
+            await add_posts(session_factory, user_id, ["after outage"], datetime.now() - timedelta(seconds=1))
+            registry = FakeRegistry()
+            scheduler = PostScheduler(session_factory, FakeBot(), registry, workers=1)
+            calls = []
+            reconcile = scheduler.reconcile
+
+            async def flaky_reconcile():
+                calls.append(1)
+                if len(calls) < 3:
+                    raise ConnectionError("БД недоступна")
+                await reconcile()
+
+            scheduler.reconcile = flaky_reconcile
+            scheduler.start()
+            try:
+                await wait_for(lambda: registry.published == [(9, "after outage")])
+            finally:
+                await scheduler.stop()
+            assert len(calls) == 3
+
+    asyncio.run(scenario())
+
+
+def test_uploaded_post_is_not_republished_when_marking_fails(temp_db, monkeypatch):
+    monkeypatch.setattr("scheduler.scheduler.SCHEDULER_RECONCILE_RETRY", 0.1)
+
+    async def scenario():
+        async with temp_db() as session_factory:
+            user_id = await add_user(session_factory, 10)
+            await add_posts(session_factory, user_id, ["once"], datetime.now() - timedelta(seconds=1))
+            registry = FakeRegistry()
+            scheduler = PostScheduler(session_factory, FakeBot(), registry, workers=1)
+            mark_posted = scheduler._mark_posted
+            marks = []
+
+            async def flaky_mark_posted(post_id):
+                marks.append(post_id)
+                if len(marks) == 1:
+                    raise ConnectionError("БД недоступна")
+                await mark_posted(post_id)
+
+            scheduler._mark_posted = flaky_mark_posted
+            scheduler.start()
+            try:
+                await wait_for(lambda: len(marks) == 1)
+                await scheduler.reconcile()  # Пост ще posted=False в БД, але вже опублікований
+                assert scheduler.stats_dict()["pending_marks"] == 1
+                await wait_for(lambda: scheduler.stats_dict()["pending_marks"] == 0)
+            finally:
+                await scheduler.stop()
+            assert registry.published == [(10, "once")]
+            assert (await stored_post(session_factory, "once")).posted
+            assert len(marks) == 2
+
+    asyncio.run(scenario())
+
+
+def test_queue_lag_counts_posts_waiting_in_account_queues(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            scheduler = PostScheduler(session_factory, FakeBot(), FakeRegistry(), workers=1)
+            assert scheduler.queue_lag() == 0.0
+            scheduler._accounts[1] = deque([(5, datetime.now() - timedelta(seconds=30))])
+            assert 29 < scheduler.stats_dict()["queue_lag_seconds"] < 60
+
+    asyncio.run(scenario())
+
+
+def test_failed_import_image_is_released(temp_db, tmp_path, monkeypatch):
+    monkeypatch.setattr("scheduler.scheduler.SCHEDULER_MAX_ATTEMPTS", 1)
+    monkeypatch.setattr("scheduler.bulk_import.IMPORT_DIR", str(tmp_path))
+    image = tmp_path / "imported.jpg"
+    image.write_bytes(b"jpeg")
+
+    async def scenario():
+        async with temp_db() as session_factory:
+            user_id = await add_user(session_factory, 11)
+            async with session_scope(session_factory) as session:
+                await add_scheduled_posts(session, user_id, [
+                    {"image_path": str(image), "caption": "broken", "scheduled_time": datetime.now()}])
+            bot = FakeBot()
+            scheduler = PostScheduler(session_factory, bot, FakeRegistry(failures={"broken"}), workers=1)
+            scheduler.start()
+            try:
+                await wait_for(lambda: len(bot.messages) == 1)
+            finally:
+                await scheduler.stop()
+            assert (await stored_post(session_factory, "broken")).failed
+            assert not image.exists()
+
+    asyncio.run(scenario())
+
+
+def test_retry_of_deleted_post_is_dropped(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            bot = FakeBot()
+            scheduler = PostScheduler(session_factory, bot, FakeRegistry(), workers=1)
+            assert await scheduler._schedule_retry(12345, 1, RuntimeError("x")) is None
+            assert bot.messages == []
+
+    asyncio.run(scenario())
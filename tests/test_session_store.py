@@ -0,0 +1,110 @@
+import asyncio
+import datetime
+import types
+import zlib
+
+from sqlalchemy import select
+
+from api.session_store import SessionStore, decode_settings, encode_settings
+from database import session_scope
+from database.models import User
+
+
+class FakeClient:
+    def __init__(self, settings):
+        self.settings = settings
+
+    def get_settings(self):
+        return self.settings
+
+
+def fake_api(user_pk, settings):
+    return types.SimpleNamespace(is_logged_in=True, user_pk=user_pk, session_digest=None,
+                                 client=FakeClient(settings))
+
+
+async def add_users(session_factory, count):
+    async with session_scope(session_factory) as session:
+        users = [User(telegram_id=1000 + index) for index in range(count)]
+        session.add_all(users)
+    return [user.id for user in users]
+
+
+async def stored_settings(session_factory):
+    async with session_scope(session_factory) as session:
+        users = (await session.execute(select(User).order_by(User.id))).scalars().all()
+    return {user.id: decode_settings(user)[0] for user in users}
+
+
+def test_encode_decode_roundtrip():
+    blob, digest = encode_settings({"cookies": {"sessionid": "x"}, "uuids": {"a": 1}})
+    user = User(session_blob=blob)
+    assert decode_settings(user) == ({"cookies": {"sessionid": "x"}, "uuids": {"a": 1}}, digest)
+
+
+def test_decode_legacy_session_data():
+    assert decode_settings(User(session_data='{"a": 1}')) == ({"a": 1}, None)
+
+
+def test_flush_writes_only_changed_sessions(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            store = SessionStore(session_factory)
+            pks = await add_users(session_factory, 3)
+            clients = [fake_api(pk, {"n": pk}) for pk in pks]
+            assert await store.flush(clients) == 3
+            assert await store.flush(clients) == 0  # Нічого не змінилось
+            clients[1].client.settings = {"n": "changed"}
+            assert await store.flush(clients) == 1
+            assert await stored_settings(session_factory) == {pks[0]: {"n": pks[0]}, pks[1]: {"n": "changed"},
+                                                              pks[2]: {"n": pks[2]}}
+            assert store.writes == 4 and store.skipped == 5
+
+    asyncio.run(scenario())
+
+
+def test_flush_survives_missing_user_row(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            store = SessionStore(session_factory)
+            pks = await add_users(session_factory, 3)
+            clients = [fake_api(pk, {"n": pk}) for pk in pks] + [fake_api(999999, {"n": "deleted"})]
+            assert await store.flush(clients) == 4
+            assert await stored_settings(session_factory) == {pk: {"n": pk} for pk in pks}
+
+    asyncio.run(scenario())
+
+
+def test_flush_with_and_without_last_active_at(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            store = SessionStore(session_factory)
+            pks = await add_users(session_factory, 2)
+            active_at = datetime.datetime(2030, 1, 1, 12, 0)
+            await store.flush([(fake_api(pks[0], {"n": 1}), active_at), fake_api(pks[1], {"n": 2})])
+            async with session_scope(session_factory) as session:
+                users = (await session.execute(select(User).order_by(User.id))).scalars().all()
+            assert [user.last_active_at for user in users] == [active_at, None]
+            assert [decode_settings(user)[0] for user in users] == [{"n": 1}, {"n": 2}]
+
+    asyncio.run(scenario())
+
+
+def test_unchanged_sessions_are_not_compressed(temp_db, monkeypatch):
+    async def scenario():
+        async with temp_db() as session_factory:
+            store = SessionStore(session_factory)
+            pks = await add_users(session_factory, 3)
+            clients = [fake_api(pk, {"n": pk}) for pk in pks]
+            await store.flush(clients)
+            compressed = []
+            compress = zlib.compress
+            monkeypatch.setattr("api.session_store.zlib.compress",
+                                lambda data, level: compressed.append(data) or compress(data, level))
+            assert await store.flush(clients) == 0
+            assert compressed == []
+            clients[0].client.settings = {"n": "changed"}
+            assert await store.flush(clients) == 1
+            assert len(compressed) == 1
+
+    asyncio.run(scenario())
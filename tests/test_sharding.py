@@ -0,0 +1,89 @@
+import asyncio
+import datetime
+import types
+
+from database import session_scope
+from database.crud import acquire_shard_lease, release_shard_lease
+from database.models import ShardLease
+from sharding import ShardDispatcher, shard_of, update_shard
+
+
+def fake_update(user_id):
+    user = types.SimpleNamespace(id=user_id)
+    return types.SimpleNamespace(effective_user=user, effective_chat=None, update_id=user_id,
+                                 to_dict=lambda: {"user": user_id})
+
+
+async def lease(session_factory, shard_id, owner, ttl=30):
+    async with session_scope(session_factory) as session:
+        return await acquire_shard_lease(session, shard_id, owner, ttl)
+
+
+async def lease_owner(session_factory, shard_id):
+    async with session_scope(session_factory) as session:
+        row = await session.get(ShardLease, shard_id)
+        return row.owner if row is not None else None
+
+
+def test_shard_of_update():
+    assert shard_of(7, 3) == 1
+    assert update_shard(fake_update(8), 3) == 2
+    chat_only = types.SimpleNamespace(effective_user=None, effective_chat=types.SimpleNamespace(id=4))
+    assert update_shard(chat_only, 3) == 1
+    assert update_shard(types.SimpleNamespace(effective_user=None, effective_chat=None), 3) == 0
+
+
+def test_lease_conflict_and_renewal(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            assert await lease(session_factory, 0, "a")
+            assert not await lease(session_factory, 0, "b")  # Оренда ще діє
+            assert await lease(session_factory, 0, "a")  # Власник продовжує
+            assert await lease(session_factory, 1, "b")  # Інший шард вільний
+            assert await lease_owner(session_factory, 0) == "a"
+
+    asyncio.run(scenario())
+
+
+def test_lease_takeover_after_expiry(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            assert await lease(session_factory, 0, "crashed", ttl=-1)
+            assert await lease(session_factory, 0, "b")
+            assert await lease_owner(session_factory, 0) == "b"
+            assert not await lease(session_factory, 0, "crashed")
+
+    asyncio.run(scenario())
+
+
+def test_release_only_by_owner(temp_db):
+    async def scenario():
+        async with temp_db() as session_factory:
+            assert await lease(session_factory, 0, "a")
+            async with session_scope(session_factory) as session:
+                await release_shard_lease(session, 0, "b")
+            assert await lease_owner(session_factory, 0) == "a"
+            async with session_scope(session_factory) as session:
+                await release_shard_lease(session, 0, "a")
+            assert await lease_owner(session_factory, 0) is None
+            assert await lease(session_factory, 0, "b")
+
+    asyncio.run(scenario())
+
+
+def test_stalled_shard_does_not_block_others():
+    async def scenario():
+        dispatcher = ShardDispatcher(2, build_application=None, queue_size=1)
+        # Без процесів: шард 0 ніхто не читає (як процес, що чекає на оренду)
+        dispatcher._senders = [asyncio.create_task(dispatcher._send(shard_id)) for shard_id in range(2)]
+        for user_id in range(10):
+            dispatcher.route(fake_update(user_id))
+        received = [await asyncio.to_thread(dispatcher.queues[1].get, True, 5) for _ in range(5)]
+        assert received == [{"user": user_id} for user_id in (1, 3, 5, 7, 9)]
+        stats = dispatcher.stats()
+        assert stats["shard1_routed"] == 5 and stats["shard0_routed"] == 1
+        assert stats["shard0_buffered"] == 3  # Ще одне - у задачі передачі, чекає на місце в черзі
+        await dispatcher.stop(timeout=0.5)  # Шард 0 так і не прочитано - передачу покинуто
+        assert all(task.done() for task in dispatcher._senders)
+
+    asyncio.run(scenario())
@@ -0,0 +1,45 @@
+import asyncio
+
+from api.stats_cache import StatsCache
+
+
+def test_concurrent_requests_share_one_load():
+    async def scenario():
+        cache = StatsCache(ttl=60)
+        calls = []
+
+        async def loader():
+            calls.append(1)
+            await asyncio.sleep(0.02)
+            return {"likes": len(calls)}
+
+        results = await asyncio.gather(*(cache.get("k", loader) for _ in range(5)))
+        assert results == [{"likes": 1}] * 5
+        assert len(calls) == 1 and cache.coalesced == 4
+        assert await cache.get("k", loader) == {"likes": 1}  # Свіже значення з кешу
+
+    asyncio.run(scenario())
+
+
+def test_invalidate_discards_load_started_before_it():
+    async def scenario():
+        cache = StatsCache(ttl=60)
+        release_old = asyncio.Event()
+
+        async def old_loader():
+            await release_old.wait()
+            return "до публікації"
+
+        async def new_loader():
+            return "після публікації"
+
+        old_request = asyncio.create_task(cache.get("k", old_loader))
+        await asyncio.sleep(0)
+        cache.invalidate("k")  # Пост опубліковано, поки статистика завантажувалась
+        assert await cache.get("k", new_loader) == "після публікації"
+        release_old.set()
+        assert await old_request == "до публікації"  # Той, хто вже чекав, отримує свій результат
+        assert await cache.get("k", old_loader) == "після публікації"  # Але в кеш він не потрапив
+        assert cache.discarded == 1 and cache.stats()["in_flight"] == 0
+
+    asyncio.run(scenario())
@@ -0,0 +1,62 @@
+import asyncio
+import datetime
+
+from telegram import Chat, Message, Update, User
+
+from update_processor import PerUserUpdateProcessor
+
+
+def make_update(update_id, user_id):
+    message = Message(update_id, datetime.datetime.now(datetime.timezone.utc), Chat(user_id, Chat.PRIVATE),
+                      from_user=User(user_id, "user", is_bot=False))
+    return Update(update_id, message=message)
+
+
+def test_same_user_in_order_other_users_concurrently():
+    async def scenario():
+        processor = PerUserUpdateProcessor(max_concurrent=4)
+        events = []
+        running = set()
+        overlaps = []
+
+        async def handle(update_id, user_id, delay):
+            running.add(user_id)
+            overlaps.append(len(running))
+            events.append(("start", user_id, update_id))
+            await asyncio.sleep(delay)
+            events.append(("end", user_id, update_id))
+            running.discard(user_id)
+
+        updates = [(1, 1, 0.05), (2, 1, 0.01), (3, 2, 0.01), (4, 1, 0.0)]
+        await asyncio.gather(*(processor.do_process_update(make_update(update_id, user_id),
+                                                           handle(update_id, user_id, delay))
+                               for update_id, user_id, delay in updates))
+
+        user1 = [(kind, update_id) for kind, user_id, update_id in events if user_id == 1]
+        assert user1 == [("start", 1), ("end", 1), ("start", 2), ("end", 2), ("start", 4), ("end", 4)]
+        # Користувач 2 не чекав, доки завершаться оновлення користувача 1
+        assert events.index(("end", 2, 3)) < events.index(("end", 1, 1))
+        assert max(overlaps) == 2
+        assert processor.queue_depth() == {} and processor._locks == {}
+        assert processor.stats()["processed"] == 4
+
+    asyncio.run(scenario())
+
+
+def test_depth_is_tracked_while_pending():
+    async def scenario():
+        processor = PerUserUpdateProcessor(max_concurrent=1)
+        release = asyncio.Event()
+
+        async def wait():
+            await release.wait()
+
+        tasks = [asyncio.create_task(processor.do_process_update(make_update(index, 7), wait()))
+                 for index in range(3)]
+        await asyncio.sleep(0.01)
+        assert processor.queue_depth(7) == 3 and processor.stats()["active"] == 1
+        release.set()
+        await asyncio.gather(*tasks)
+        assert processor.queue_depth(7) == 0 and 7 not in processor._locks
+
+    asyncio.run(scenario())
@@ -0,0 +1,76 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from telegram import Bot
+
+import webhook
+from webhook import SECRET_HEADER, make_web_app
+
+UPDATE = {"update_id": 10, "message": {"message_id": 1, "date": 0, "chat": {"id": 5, "type": "private"},
+                                       "from": {"id": 5, "is_bot": False, "first_name": "U"}, "text": "hi"}}
+
+
+async def post_update(update_queue, headers, secret_token="s3cret", payload=UPDATE):
+    app = make_web_app(update_queue, Bot("123:TEST"), path="/telegram", secret_token=secret_token)
+    async with TestClient(TestServer(app)) as client:
+        response = await client.post("/telegram", json=payload, headers=headers)
+        return response.status
+
+
+def test_wrong_or_missing_secret_is_rejected():
+    async def scenario():
+        update_queue = asyncio.Queue()
+        assert await post_update(update_queue, {}) == 403
+        assert await post_update(update_queue, {SECRET_HEADER: "wrong"}) == 403
+        assert update_queue.empty()
+
+    asyncio.run(scenario())
+
+
+def test_valid_update_reaches_update_queue():
+    async def scenario():
+        update_queue = asyncio.Queue()
+        assert await post_update(update_queue, {SECRET_HEADER: "s3cret"}) == 200
+        update = update_queue.get_nowait()
+        assert update.update_id == 10 and update.effective_user.id == 5
+        assert await post_update(update_queue, {SECRET_HEADER: "s3cret"}, payload=[1]) == 400
+
+    asyncio.run(scenario())
+
+
+class FakeApplication:
+    def __init__(self, calls):
+        self.calls = calls
+        self.bot = Bot("123:TEST")
+        self.update_queue = asyncio.Queue()
+
+    async def __aenter__(self):
+        self.calls.append("initialize")
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.calls.append("shutdown")
+
+    async def start(self):
+        self.calls.append("start")
+
+    async def stop(self):
+        self.calls.append("stop")
+
+    async def post_init(self, application):
+        self.calls.append("post_init")
+
+    async def post_shutdown(self, application):
+        self.calls.append("post_shutdown")
+
+
+def test_run_webhook_calls_post_shutdown_after_shutdown(monkeypatch):
+    async def scenario():
+        stop_event = asyncio.Event()
+        stop_event.set()  # Зупинка одразу після запуску
+        monkeypatch.setattr(webhook, "stop_on_signals", lambda: stop_event)
+        calls = []
+        await webhook.run_webhook(FakeApplication(calls), listen="127.0.0.1", port=0)
+        assert calls == ["initialize", "post_init", "start", "stop", "shutdown", "post_shutdown"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,87 @@
+import asyncio
+import os
+from collections import Counter
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+# Скільки оновлень різних користувачів обробляється одночасно (1 - послідовно, як раніше)
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", "16"))
+# Скільки оновлень загалом може чекати на обробку (включно з тими, що стоять у черзі користувача)
+UPDATE_MAX_PENDING = int(os.environ.get("UPDATE_MAX_PENDING", "1024"))
+
+
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    """Паралельна обробка оновлень різних користувачів зі збереженням порядку для одного користувача.
+
+    Оновлення одного користувача проходять через його asyncio.Lock (FIFO), тож діалог
+    фото -> опис не ламається. Слот конкурентності займається лише після отримання
+    блокування користувача, щоб довга черга одного користувача не блокувала інших.
+    """
+
+    def __init__(self, max_concurrent=UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING):
+        # Семафор базового класу обмежує кількість оновлень, що очікують, а не виконуються
+        super().__init__(max(max_pending, max_concurrent, 2))
+        self.max_concurrent = max_concurrent
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self._locks = {}  # user_id -> asyncio.Lock
+        self._depth = Counter()  # user_id -> кількість оновлень в обробці та в черзі
+        self.active = 0
+        self.processed = 0
+
+    @staticmethod
+    def _user_key(update):
+        if isinstance(update, Update):
+            if update.effective_user:
+                return update.effective_user.id
+            if update.effective_chat:
+                return update.effective_chat.id
+        return None
+
+    async def do_process_update(self, update, coroutine):
+        key = self._user_key(update)
+        if key is None:
+            await self._run(coroutine)
+            return
+
+        self._depth[key] += 1
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        try:
+            async with lock:
+                await self._run(coroutine)
+        finally:
+            self._depth[key] -= 1
+            if self._depth[key] <= 0:
+                del self._depth[key]
+                self._locks.pop(key, None)
+
+    async def _run(self, coroutine):
+        async with self._slots:
+            self.active += 1
+            try:
+                await coroutine
+            finally:
+                self.active -= 1
+                self.processed += 1
+
+    def queue_depth(self, user_id=None):
+        """Кількість оновлень користувача в обробці та в черзі (без user_id - по всіх користувачах)."""
+        if user_id is None:
+            return dict(self._depth)
+        return self._depth.get(user_id, 0)
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "max_concurrent": self.max_concurrent,
+            "users_pending": len(self._depth),
+            "pending": sum(self._depth.values()),
+            "max_user_depth": max(self._depth.values(), default=0),
+            "processed": self.processed,
+        }
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
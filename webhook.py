@@ -0,0 +1,98 @@
+import asyncio
+import hmac
+import json
+import logging
+import os
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Публічна адреса вебхука (https://example.com/telegram). Якщо не задана - вебхук у Telegram
+# не реєструється, сервер лише приймає POST-запити (зручно для локальної перевірки)
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
+WEBHOOK_LISTEN = os.environ.get("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+# Передається в setWebhook і перевіряється в заголовку X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET_TOKEN = os.environ.get("WEBHOOK_SECRET_TOKEN", "")
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def make_web_app(update_queue, bot, path=WEBHOOK_PATH, secret_token=WEBHOOK_SECRET_TOKEN):
+    """aiohttp-застосунок, що перевіряє секрет і кладе оновлення в update_queue (Application або диспетчера шардів)."""
+
+    async def handle_update(request):
+        if secret_token and not hmac.compare_digest(
+                request.headers.get(SECRET_HEADER, "").encode(), secret_token.encode()):
+            return web.Response(status=403)
+        try:
+            data = await request.json(loads=json.loads)
+            update = Update.de_json(data, bot)
+        except Exception as e:
+            logger.warning(f"Некоректне оновлення у вебхуку: {e}")
+            return web.Response(status=400)
+        if update is None:
+            return web.Response(status=400)
+        await update_queue.put(update)
+        return web.Response()
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    return app
+
+
+def stop_on_signals(signals=(signal.SIGINT, signal.SIGTERM)):
+    """asyncio.Event, що встановлюється при SIGINT/SIGTERM (очікування зупинки без run_polling)."""
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in signals:
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except (NotImplementedError, RuntimeError):
+            pass
+    return stop_event
+
+
+async def set_webhook(bot):
+    """Реєструє WEBHOOK_URL в Telegram (якщо задано)."""
+    if not WEBHOOK_SECRET_TOKEN:
+        logger.warning("WEBHOOK_SECRET_TOKEN не задано - перевірка секрету вебхука вимкнена")
+    if WEBHOOK_URL:
+        await bot.set_webhook(
+            WEBHOOK_URL, secret_token=WEBHOOK_SECRET_TOKEN or None,
+            allowed_updates=Update.ALL_TYPES, max_connections=WEBHOOK_MAX_CONNECTIONS)
+
+
+async def start_web_app(update_queue, bot, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+    """Запускає HTTP-сервер вебхука. Повертає AppRunner (для cleanup)."""
+    runner = web.AppRunner(make_web_app(update_queue, bot))
+    await runner.setup()
+    await web.TCPSite(runner, listen, port).start()
+    logger.info(f"Вебхук слухає {listen}:{port}{WEBHOOK_PATH}")
+    return runner
+
+
+async def run_webhook(application, listen=WEBHOOK_LISTEN, port=WEBHOOK_PORT):
+    """Повний життєвий цикл Application у режимі вебхука (аналог run_polling, без nest_asyncio)."""
+    stop_event = stop_on_signals()
+
+    async with application:  # initialize() / shutdown()
+        if application.post_init:
+            await application.post_init(application)
+        await set_webhook(application.bot)
+        await application.start()
+
+        runner = await start_web_app(application.update_queue, application.bot, listen, port)
+        try:
+            await stop_event.wait()
+        finally:
+            await runner.cleanup()  # Спершу перестаємо приймати нові оновлення
+            await application.stop()
+    # Як у run_polling: post_shutdown - після application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)